@@ -31,15 +31,17 @@ class AssetDaoBT:
         return savedAsset
 
     async def GetAllAssets(self):
-        db = self.db
         result = []
         
-        for key in db:
-            asset = db.get_value(key)
-            result.append(json.loads(asset))
+        for asset in self.IterAllAssets():
+            result.append(asset)
             
         return result
 
+    def IterAllAssets(self, offset=0, limit=None):
+        # One at a time in id order, for callers that stream the result
+        return self.db.iter_values(offset=offset, limit=limit)
+
     async def GetAssetCount(self):
         db = self.db
         return db.count_all()
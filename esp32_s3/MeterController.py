@@ -77,7 +77,8 @@ class MeterController:
                             "ClientId": savedMeter["clientId"],                                                                                                    
                             "EntityType":"Meter",
                             "Operation":"Update",                        
-                            "Entity" : json.dumps(result)                                                        
+                            "Entity" : json.dumps(result),
+                            "entityId": id
                           }
             
             for topic in self.topics:
@@ -114,6 +115,9 @@ class MeterController:
         result = await self.meterDao.GetAllMeters()
         return result
 
+    def IterAllMeters(self, offset=0, limit=None):
+        return self.meterDao.IterAllMeters(offset, limit)
+
     async def DeleteAllMeters(self):
         result = await self.meterDao.DeleteAllMeters()
         return result
@@ -0,0 +1,165 @@
+class MeterAdr:
+    """Running ADR state of one meter: index keys of its first and last reading, count and rate sum."""
+    def __init__(self):
+        self.head = None
+        self.tail = None
+        self.count = 0
+        self.rate_sum = 0.0
+
+class AdrAggregates:
+    """
+    Per-meter average daily rate kept up to date on every reading write.
+
+    A reading's daily rate is taken from its predecessor in the meter's
+    secondary index, whose keys run in (meterId, readingOn, id) order, so
+    adding or removing a reading only changes its own rate and its
+    successor's. Both neighbours are found with a bounded range() around
+    its key, and only each meter's MeterAdr is kept in memory; a meter is
+    loaded by streaming its index range the first time it is used.
+    `point(id)` gives the (time, reading) of a stored reading. Rates come
+    from AdrHelper.daily_rate, so they match calculate_average_daily_rate.
+    """
+    def __init__(self, adrHelper, index, point, sep):
+        self.adrHelper = adrHelper
+        self.index = index
+        self.point = point
+        self.sep = sep
+        self.meters = {}
+
+    def clear(self):
+        """Drops every meter; each is loaded again from the index when next used."""
+        self.meters = {}
+
+    def add(self, meterId, key, time, reading):
+        """Counts in a reading; call it before `key` goes into the index."""
+        meter = self._meter(meterId)
+        current = (time, reading)
+        # Readings mostly arrive in time order, past the tail: no successor to look for
+        prev = None if meter.head is None or key < meter.head else self._before(meterId, key)
+        next = None if meter.tail is None or key > meter.tail else self._after(meterId, key)
+        previous = None if prev is None else self.point(prev[1])
+
+        if previous is not None:
+            meter.rate_sum += self._rate(previous, current)
+
+        if next is not None:
+            following = self.point(next[1])
+
+            if previous is not None:
+                meter.rate_sum -= self._rate(previous, following)
+
+            meter.rate_sum += self._rate(current, following)
+
+        if prev is None:
+            meter.head = key
+
+        if next is None:
+            meter.tail = key
+
+        meter.count += 1
+
+    def remove(self, meterId, key, time, reading):
+        """Counts out a reading; call it while `key` is still in the index."""
+        meter = self._meter(meterId)
+
+        if meter.count == 0:
+            return
+
+        current = (time, reading)
+        prev = None if key == meter.head else self._before(meterId, key)
+        next = None if key == meter.tail else self._after(meterId, key)
+        previous = None if prev is None else self.point(prev[1])
+
+        if previous is not None:
+            meter.rate_sum -= self._rate(previous, current)
+
+        if next is not None:
+            following = self.point(next[1])
+            meter.rate_sum -= self._rate(current, following)
+
+            if previous is not None:
+                meter.rate_sum += self._rate(previous, following)
+
+        if prev is None:
+            meter.head = None if next is None else next[0]
+
+        if next is None:
+            meter.tail = None if prev is None else prev[0]
+
+        # An emptied meter stays, as the key can still be in the index
+        meter.count -= 1
+
+    def adr(self, meterId):
+        meter = self._meter(meterId)
+
+        if meter.count == 0:
+            del self.meters[meterId]
+            return 0
+
+        return meter.rate_sum / meter.count
+
+    def window_adr(self, meterId, size):
+        """ADR of the most recent `size` readings, walking the index back from the tail."""
+        low, high = self._bounds(meterId)
+        points = []
+
+        for key, id in self.index.range(low, high, reverse=True):
+            if len(points) == size:
+                break
+
+            points.append(self.point(id))
+
+        if not points:
+            return 0
+
+        # The oldest reading of the window has no predecessor in it, so rate 0
+        rate_sum = 0.0
+
+        for i in range(len(points) - 1):
+            rate_sum += self._rate(points[i + 1], points[i])
+
+        return rate_sum / len(points)
+
+    def _meter(self, meterId):
+        meter = self.meters.get(meterId)
+
+        if meter is None:
+            meter = self.meters[meterId] = MeterAdr()
+            low, high = self._bounds(meterId)
+            previous = None
+
+            for key, id in self.index.range(low, high):
+                current = self.point(id)
+
+                if previous is None:
+                    meter.head = key
+                else:
+                    meter.rate_sum += self._rate(previous, current)
+
+                meter.tail = key
+                meter.count += 1
+                previous = current
+
+        return meter
+
+    def _bounds(self, meterId):
+        # Every index key of the meter, and nothing else, is in [low, high)
+        return meterId + self.sep, meterId + chr(ord(self.sep) + 1)
+
+    def _before(self, meterId, key):
+        """(key, id) of the meter's last index entry below `key`, or None."""
+        for entry in self.index.range(self._bounds(meterId)[0], key, reverse=True):
+            return entry
+
+        return None
+
+    def _after(self, meterId, key):
+        """(key, id) of the meter's first index entry above `key`, or None."""
+        for entry in self.index.range(key, self._bounds(meterId)[1]):
+            if entry[0] != key:
+                return entry
+
+        return None
+
+    def _rate(self, previous, current):
+        return self.adrHelper.daily_rate(previous[0], previous[1], current[0], current[1])
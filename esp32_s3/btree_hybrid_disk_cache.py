@@ -1,6 +1,9 @@
 import os
 import json
 import time
+from node_cache import CachedDiskStorage
+from node_codec import BinaryNodeCodec, JsonNodeCodec, EncodedValue
+from node_search import kv_bisect_left, kv_bisect_right, kv_insort
 
 def hinted_tuple_hook(obj):
     if '__tuple__' in obj:
@@ -13,10 +16,17 @@ class BTreeNode:
         self.is_leaf = is_leaf
         self.keys = []
         self.children = []
+        self.counts = []  # Entries under each child of an internal node
         self.disk_file = None
 
+    def size(self):
+        """Number of entries in this subtree; internal nodes hold entries too."""
+        return len(self.keys) + sum(self.counts)
+
     def custom_encode(self, obj):
         def hint_tuples(item):
+            if isinstance(item, EncodedValue):
+                return hint_tuples(item.decode())
             if isinstance(item, tuple):
                 return {'__tuple__': True, 'items': [hint_tuples(e) for e in item]}
             if isinstance(item, list):
@@ -43,18 +53,15 @@ class BTreeNode:
         parsed_obj = json.loads(json_data)
         return hinted_tuple_hook(parsed_obj)
     
-    def traverse_func(self, tree, filter_func, results):
-        for i in range(len(self.keys)):
-            if not self.is_leaf:
-                node = tree.load_node_from_disk(self.children[i])                
-                node.traverse_func(tree, filter_func, results)
-                
-            if filter_func(self.keys[i][1]):
-                results.append(self.keys[i][1])
-                
-        if not self.is_leaf:
-            node = tree.load_node_from_disk(self.children[-1])
-            node.traverse_func(tree, filter_func, results)
+    def get_value(self, index):
+        """Returns the value at `index`, decoding it on first access."""
+        key, value = self.keys[index]
+
+        if isinstance(value, EncodedValue):
+            value = value.decode()
+            self.keys[index] = (key, value)
+
+        return value
 
     def serialize(self):
         jsonstring = self.custom_encode(self.keys)        
@@ -62,7 +69,8 @@ class BTreeNode:
             'is_leaf': self.is_leaf,
             'keys': jsonstring,
             'disk_file': self.disk_file,            
-            'children': [child.disk_file if isinstance(child, BTreeNode) else child for child in self.children]
+            'children': [child.disk_file if isinstance(child, BTreeNode) else child for child in self.children],
+            'counts': self.counts
         }
         return data
 
@@ -83,29 +91,21 @@ class BTreeNode:
             node.disk_file = json_data['disk_file']
             for child_data in json_data['children']:
                 node.children.append(child_data)
+            node.counts = json_data.get('counts', [])
 #            print(f"Deserialized node with keys: {node.keys}")  # Debug print
             return node
         else:
             return json_data
         
-    def traverse_keys(self, root, results):
-        for i in range(len(self.keys)):
-            if not self.is_leaf:
-                node = root.load_node_from_disk(self.children[i])                    
-                node.traverse_keys(root, results)
-                
-            results.append(self.keys[i])
-            
-        if not self.is_leaf:
-            node = root.load_node_from_disk(self.children[-1])                                
-            node.traverse_keys(root, results)        
-
 class DiskStorage:
-    def __init__(self, directory):
+    def __init__(self, directory, codec=None):
         self.directory = directory
+        self.binary_codec = BinaryNodeCodec()
+        self.json_codec = JsonNodeCodec()
+        self.codec = codec if codec is not None else self.binary_codec
 
     def save_node(self, node):
-        data = json.dumps(node.serialize()).encode("utf-8")        
+        data = self.codec.encode(node)
 
         with open(node.disk_file, 'wb') as f:
             f.write(data)
@@ -113,18 +113,34 @@ class DiskStorage:
     def load_node(self, disk_file):
         with open(disk_file, 'rb') as f:
             data = f.read()
-            
-        return BTreeNode.deserialize(data)
+
+        # Nodes written by the JSON codec start with '{', so both formats load
+        codec = self.json_codec if data[:1] == b'{' else self.binary_codec
+        return codec.decode(data, BTreeNode)
 
 class BTree:
-    def __init__(self, t, cache_dir='btree_cache'):
+    # Trees sharing a cache_dir keep their node files apart by tree number
+    tree_count = 0
+
+    def __init__(self, t, cache_dir='btree_cache', cache_size=0, cache_bytes=None, codec=None):
+        self.tree_id = BTree.tree_count
+        BTree.tree_count += 1
         self.root = BTreeNode(True)
-        self.storage = DiskStorage(cache_dir)        
+        self.storage = DiskStorage(cache_dir, codec)
+        self.cache = None
+
+        if cache_size or cache_bytes:
+            self.storage = CachedDiskStorage(self.storage, cache_size or None, cache_bytes)
+            self.cache = self.storage.cache
+
         self.t = t
+        # Bumped by every change to the tree's shape, so range() can tell it must resume
+        self.version = 0
         self.cache_dir = cache_dir
         self.node_counter = 0
 
     def insert(self, key):
+        self.version += 1
         root = self.root
 #        print(f"Inserting key: {key}")  # Debug print
  #       self.print_tree(root)        
@@ -133,6 +149,7 @@ class BTree:
             temp = BTreeNode()
             self.root = temp
             temp.children.insert(0, root.disk_file)
+            temp.counts.insert(0, root.size())
   #          print(f"before splitting...{key}")
    #         self.print_tree(root)
 
@@ -156,21 +173,11 @@ class BTree:
 
     def insert_non_full(self, node, key):
         node = self.load_node_from_disk(node)                        
-        index = len(node.keys) - 1
 
         if node.is_leaf:
-            node.keys.append((None, None))
-
-            while index >= 0 and key[0] < node.keys[index][0]:
-                node.keys[index + 1] = node.keys[index]
-                index -= 1
-
-            node.keys[index + 1] = key
+            kv_insort(node.keys, key)
         else:
-            while index >= 0 and key[0] < node.keys[index][0]:
-                index -= 1
-
-            index += 1
+            index = kv_bisect_right(node.keys, key[0])
 
             child_node = self.load_node_from_disk(node.children[index])                
 
@@ -180,6 +187,7 @@ class BTree:
                 if key[0] > node.keys[index][0]:
                     index += 1
 
+            node.counts[index] += 1
             child_node = self.load_node_from_disk(node.children[index])                
             self.insert_non_full(child_node, key)
 
@@ -197,15 +205,20 @@ class BTree:
         if not y.is_leaf:
             z.children = y.children[t: 2 * t]
             y.children = y.children[0: t]
+            z.counts = y.counts[t: 2 * t]
+            y.counts = y.counts[0: t]
 
-        self.save_node_to_disk(y)
+        node.counts[index:index + 1] = [y.size(), z.size()]
+
+        # z first so it has a disk file before anything referencing it is written
         self.save_node_to_disk(z)
+        self.save_node_to_disk(y)
         self.save_node_to_disk(node)
 
     def save_node_to_disk(self, node):
         if node.disk_file is None:
-            file_id = id(node)
-            node.disk_file = f'{self.cache_dir}/node_{str(file_id)}.json'
+            # Named by a counter, id(node) is reused once a node object is freed.
+            node.disk_file = f'{self.cache_dir}/node_{self.tree_id}_{self.node_counter}.json'
             self.node_counter += 1
 
         self.storage.save_node(node=node)
@@ -244,11 +257,12 @@ class BTree:
         return count                
 
     def delete(self, node, key):
+        """Deletes key[0] below `node`; returns True if it was found."""
+        self.version += 1
         node = self.load_node_from_disk(node)
         t = self.t
-        i = 0
-        while i < len(node.keys) and key[0] > node.keys[i][0]:
-            i += 1
+        i = kv_bisect_left(node.keys, key[0])
+        deleted = True
 
         if i < len(node.keys) and node.keys[i][0] == key[0]:
             if node.is_leaf:
@@ -259,24 +273,29 @@ class BTree:
                     pred = self.get_pred(node, i)
                     node.keys[i] = pred
                     self.delete(node.children[i], pred)
+                    node.counts[i] -= 1
                 elif len(self.load_node_from_disk(node.children[i + 1]).keys) >= t:
                     succ = self.get_succ(node, i)
                     node.keys[i] = succ
                     self.delete(node.children[i + 1], succ)
+                    node.counts[i + 1] -= 1
                 else:
                     self.merge(node, i)
                     self.delete(node.children[i], k)
+                    node.counts[i] -= 1
         else:
             if node.is_leaf:
-                return
+                return False
             flag = (i == len(node.keys))
             if len(self.load_node_from_disk(node.children[i]).keys) < t:
                 self.fill(node, i)
             if flag and i > len(node.keys):
-                self.delete(node.children[i - 1], key)
-            else:
-                self.delete(node.children[i], key)
+                i -= 1
+            deleted = self.delete(node.children[i], key)
+            if deleted:
+                node.counts[i] -= 1
         self.save_node_to_disk(node)
+        return deleted
 
     def get_pred(self, node, idx):
         current = self.load_node_from_disk(node.children[idx])
@@ -301,9 +320,12 @@ class BTree:
 
         if not child.is_leaf:
             child.children.extend(sibling.children)
+            child.counts.extend(sibling.counts)
 
         node.keys.pop(idx)
         node.children.pop(idx + 1)
+        # The parent key moves down into the merged child
+        node.counts[idx] += 1 + node.counts.pop(idx + 1)
 
         self.save_node_to_disk(child)
         self.save_node_to_disk(node)
@@ -323,9 +345,14 @@ class BTree:
         child = self.load_node_from_disk(node.children[idx])
         sibling = self.load_node_from_disk(node.children[idx - 1])
         child.keys.insert(0, node.keys[idx - 1])
+        moved = 1
         if not child.is_leaf:
             child.children.insert(0, sibling.children.pop())
+            child.counts.insert(0, sibling.counts.pop())
+            moved += child.counts[0]
         node.keys[idx - 1] = sibling.keys.pop()
+        node.counts[idx - 1] -= moved
+        node.counts[idx] += moved
         self.save_node_to_disk(child)
         self.save_node_to_disk(sibling)
 
@@ -333,40 +360,171 @@ class BTree:
         child = self.load_node_from_disk(node.children[idx])
         sibling = self.load_node_from_disk(node.children[idx + 1])
         child.keys.append(node.keys[idx])
+        moved = 1
         if not child.is_leaf:
             child.children.append(sibling.children.pop(0))
+            child.counts.append(sibling.counts.pop(0))
+            moved += child.counts[-1]
         node.keys[idx] = sibling.keys.pop(0)
+        node.counts[idx] += moved
+        node.counts[idx + 1] -= moved
         self.save_node_to_disk(child)
         self.save_node_to_disk(sibling)
 
-    def traverse_keys(self):
-        results = []
+    def range(self, start_key=None, end_key=None, reverse=False):
+        """
+        Generator over the (key, value) entries with start_key <= key < end_key
+        in key order, or descending with reverse=True; a bound of None is
+        open. This is an in-order walk with an explicit stack, so only the
+        nodes on the current root-to-leaf path are loaded. If the tree is
+        modified while the generator is in use, it carries on from just past
+        the last key it yielded.
+        """
+        after = None
 
-        if self.root:
-            self.root.traverse_keys(self, results)
+        while True:
+            version = self.version
+
+            for key, value in self._range(start_key, end_key, reverse):
+                if key == after:
+                    continue
+
+                yield key, value
+
+                if version != self.version:
+                    break
+            else:
+                return
+
+            # Changed meanwhile: walk down again to just past the last key
+            if reverse:
+                end_key = key
+            else:
+                start_key = after = key
+
+    def _range(self, start_key, end_key, reverse):
+        """The walk behind range(); only valid while the tree is unchanged."""
+        # Each stack entry is [node, index of the next key to visit]; walking
+        # down, a reverse walk visits keys[index - 1] next instead.
+        stack = []
+        node = self.root
+
+        while node is not None:
+            node = self.load_node_from_disk(node)
+
+            if reverse:
+                i = len(node.keys) if end_key is None else kv_bisect_left(node.keys, end_key)
+            else:
+                i = 0 if start_key is None else kv_bisect_left(node.keys, start_key)
+
+            stack.append([node, i])
+            node = None if node.is_leaf else node.children[i]
+
+        while stack:
+            entry = stack[-1]
+            node, i = entry
+
+            if reverse:
+                if i == 0:
+                    stack.pop()
+                    continue
+
+                i -= 1
+                entry[1] = i
+                key = node.keys[i][0]
+
+                if start_key is not None and key < start_key:
+                    return
+
+                yield key, node.get_value(i)
+                self._push_edge(stack, node, i, True)
+            else:
+                if i == len(node.keys):
+                    stack.pop()
+                    continue
+
+                entry[1] = i + 1
+                key = node.keys[i][0]
+
+                if end_key is not None and key >= end_key:
+                    return
+
+                yield key, node.get_value(i)
+                self._push_edge(stack, node, i + 1, False)
+
+    def seek(self, key):
+        """Generator over the entries with keys >= key, in key order."""
+        return self.range(key)
+
+    def iter_items(self, offset=0, limit=None):
+        """
+        Generator over the (key, value) entries in key order, starting at
+        position `offset` and yielding at most `limit` of them. The start is
+        found through the subtree counts instead of by skipping entries.
+        """
+        if offset >= self.count_all():
+            return
+
+        for key, value in self.range(self.select(offset)[0] if offset > 0 else None):
+            if limit is not None:
+                if limit <= 0:
+                    return
+                limit -= 1
+            yield key, value
+
+    def iter_keys(self):
+        """Generator over every key in order."""
+        for key, value in self.range():
+            yield key
+
+    def iter_values(self, filter_func=None, offset=0, limit=None):
+        """
+        Generator over the values in key order, those accepted by filter_func
+        if given. With a filter, offset and limit count the accepted values.
+        """
+        if filter_func is None:
+            for key, value in self.iter_items(offset, limit):
+                yield value
+            return
+
+        for key, value in self.range():
+            if filter_func(value):
+                if offset > 0:
+                    offset -= 1
+                    continue
+                if limit is not None:
+                    if limit <= 0:
+                        return
+                    limit -= 1
+                yield value
+
+    def traverse_keys(self):
+        return list(self.iter_items())
 
-        return results
-    
     def traverse_func(self, filter_func):
-        results = []
+        return list(self.iter_values(filter_func))
+
+    def _push_edge(self, stack, node, index, reverse):
+        """Pushes the path to the last (reverse) or first key under children[index]."""
+        if node.is_leaf:
+            return
 
-        if self.root:
-            self.root.traverse_func(self, filter_func, results)
+        child = node.children[index]
 
-        return results
+        while child is not None:
+            child = self.load_node_from_disk(child)
+            stack.append([child, len(child.keys) if reverse else 0])
+            child = None if child.is_leaf else child.children[len(child.keys) if reverse else 0]
 
     def find(self, key):
         return self.search(self.root, key)
 
     def search(self, node, key):
-        index = 0        
         node = self.load_node_from_disk(node)
-
-        while index < len(node.keys) and key > node.keys[index][0]:
-            index += 1
+        index = kv_bisect_left(node.keys, key)
 
         if index < len(node.keys) and key == node.keys[index][0]:
-            return node.keys[index][1]
+            return node.get_value(index)
         
         elif node.is_leaf:
             return None
@@ -385,11 +543,8 @@ class BTree:
             return False
 
     def _find_node_and_index(self, node, key):
-        index = 0
         node = self.load_node_from_disk(node)
-
-        while index < len(node.keys) and key > node.keys[index][0]:
-            index += 1
+        index = kv_bisect_left(node.keys, key)
             
         if index < len(node.keys) and key == node.keys[index][0]:
             return node, index
@@ -412,15 +567,66 @@ class BTree:
         return count
         
     def count_all(self):
-        return self._count_all(self.root)
+        # Internal nodes keep the entry count of each child
+        return self.root.size()
 
-    def _count_all(self, node):
-        node = self.load_node_from_disk(node)        
-        count = len(node.keys)  # Count the number of keys in the current node
-        if not node.is_leaf:
-            for child in node.children:
-                count += self._count_all(child)
-        return count
+    def count_range(self, start_key=None, end_key=None):
+        """Number of entries with start_key <= key < end_key; None is open."""
+        end = self.count_all() if end_key is None else self.rank(end_key)
+        start = 0 if start_key is None else self.rank(start_key)
+        return max(0, end - start)
+
+    def rank(self, key):
+        """Number of entries with keys below `key`."""
+        node = self.root
+        rank = 0
+
+        while node is not None:
+            node = self.load_node_from_disk(node)
+            i = kv_bisect_left(node.keys, key)
+            # Keys below children[i]: the first i keys and the subtrees left of them
+            rank += i + sum(node.counts[:i])
+            node = None if node.is_leaf else node.children[i]
+
+        return rank
+
+    def select(self, index):
+        """Returns the (key, value) entry at 0-based position `index` in key order."""
+        if index < 0 or index >= self.count_all():
+            raise IndexError("select index out of range")
+
+        node = self.load_node_from_disk(self.root)
+
+        while not node.is_leaf:
+            i = 0
+
+            while index >= node.counts[i]:
+                if index == node.counts[i]:
+                    return node.keys[i][0], node.get_value(i)
+
+                index -= node.counts[i] + 1
+                i += 1
+
+            node = self.load_node_from_disk(node.children[i])
+
+        return node.keys[index][0], node.get_value(index)
 
     def delete_all(self):
+        self.version += 1
         self.root = BTreeNode(True)
+
+        if self.cache is not None:
+            self.storage.clear()
+
+    def sync(self):
+        """Writes back any nodes held dirty in the node cache."""
+        if self.cache is not None:
+            self.storage.sync()
+
+    def stats(self):
+        stats = {}
+
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+
+        return stats
@@ -0,0 +1,102 @@
+class BulkLoader:
+    """
+    Builds a B-tree of minimum degree `t` bottom-up from (key, value)
+    entries in ascending key order.
+
+    Leaves are filled left to right and every full node is passed to the
+    level above as soon as the node after it is full, so the input is read
+    once and each level holds at most two nodes' worth of entries. The last
+    node of a level is held back until the level ends so a short tail can
+    be evened out with it, which keeps every node at or above the minimum
+    fill and lets each node be stored exactly once.
+
+    `store(is_leaf, entries)` creates and stores one node and returns the
+    reference its parent keeps (a node or a node id). Leaf entries are the
+    input entries; internal entries are (min_key, max_key, child, count)
+    tuples, so each tree can pick its own routing keys and keep the entry
+    count of every subtree.
+    """
+    def __init__(self, t, fill_factor, store):
+        if not 0 < fill_factor <= 1:
+            raise ValueError("fill_factor must be in (0, 1]")
+
+        self.store = store
+        # Leaves hold t - 1 .. 2t - 1 entries, internal nodes t .. 2t children
+        self.limits = [(t - 1, 2 * t - 1), (t, 2 * t)]
+        self.sizes = [max(lo, int(hi * fill_factor)) for lo, hi in self.limits]
+        self.levels = []
+        self.last_key = None
+
+    def add(self, entry):
+        key = entry[0]
+
+        if self.levels and key <= self.last_key:
+            raise ValueError("bulk_load needs unique keys in ascending order")
+
+        self.last_key = key
+        self._push(0, entry)
+
+    def _level(self, depth):
+        if depth == len(self.levels):
+            # [entries of the node being filled, held back entries, nodes emitted]
+            self.levels.append([[], None, 0])
+
+        return self.levels[depth]
+
+    def _push(self, depth, entry):
+        level = self._level(depth)
+        level[0].append(entry)
+
+        if len(level[0]) == self.sizes[min(depth, 1)]:
+            if level[1] is not None:
+                self._emit(depth, level[1])
+
+            level[1] = level[0]
+            level[0] = []
+
+    def _emit(self, depth, entries):
+        ref = self.store(depth == 0, entries)
+        self.levels[depth][2] += 1
+
+        if depth == 0:
+            min_key, max_key, count = entries[0][0], entries[-1][0], len(entries)
+        else:
+            min_key, max_key = entries[0][0], entries[-1][1]
+            count = 0
+
+            for entry in entries:
+                count += entry[3]
+
+        self._push(depth + 1, (min_key, max_key, ref, count))
+
+    def finish(self):
+        """Stores the remaining nodes and returns the root, or None if empty."""
+        depth = 0
+
+        while depth < len(self.levels):
+            current, held, emitted = self.levels[depth]
+            groups = [group for group in (held, current) if group]
+            lo, hi = self.limits[min(depth, 1)]
+
+            if len(groups) == 2 and len(current) < lo:
+                combined = held + current
+
+                if len(combined) <= hi:
+                    groups = [combined]
+                else:
+                    half = len(combined) // 2
+                    groups = [combined[:half], combined[half:]]
+
+            if not groups:
+                return None
+
+            if emitted == 0 and len(groups) == 1:
+                # The only node of the top level is the root
+                return self.store(depth == 0, groups[0])
+
+            for group in groups:
+                self._emit(depth, group)
+
+            depth += 1
+
+        return None
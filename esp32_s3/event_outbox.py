@@ -0,0 +1,189 @@
+import ujson as json
+import ustruct as struct
+import uasyncio as asyncio
+
+# Batch encodings: a JSON array of the event messages, or each message
+# prefixed with its length as a big-endian unsigned short
+FRAMING_JSON = 'json'
+FRAMING_LENGTH = 'length'
+
+def entity_update_key(topic, message):
+    """
+    Coalescing key for the controllers' events: an Update of an entity is
+    superseded by a later Update of the same entity on the same topic.
+    Every controller puts the entity's id in its Update events as entityId;
+    Creates, Deletes and not-found Updates have none and are never coalesced.
+    """
+    event = json.loads(message)
+
+    if event.get("Operation") != "Update" or "entityId" not in event:
+        return None
+
+    return (topic, event.get("EntityType"), event["entityId"])
+
+class EventOutbox:
+    """
+    Asynchronous outbox in front of MqttConnectionPool.
+
+    Publish() has the pool's signature but only queues the message, so a
+    controller returns without waiting for a PUBACK. run() packs the queued
+    messages of each topic into batches, framed by `framing`, and publishes
+    a topic's batch once it reaches `batch_bytes` or its oldest message has
+    waited `flush_ms`. The queue holds at most `max_events`; Publish() waits
+    for room beyond that. With a `coalesce_key(topic, message)` function a
+    message replaces a still-queued one with the same key, and the older one
+    is never sent. A batch the pool fails to publish is retried after
+    `retry_ms`, holding back the rest of the queue behind it.
+    """
+    def __init__(self, pool, max_events=64, batch_bytes=1024, flush_ms=50,
+                 framing=FRAMING_JSON, coalesce_key=None, retry_ms=1000):
+        self.pool = pool
+        self.max_events = max_events
+        self.batch_bytes = batch_bytes
+        self.flush_ms = flush_ms
+        self.framing = framing
+        self.coalesce_key = coalesce_key
+        self.retry_ms = retry_ms
+        # Entries are [topic, key, message]; a coalesced one has message None
+        self.queue = []
+        self.keys = {}
+        self.count = 0
+        self.bytes = 0
+        self.ready = asyncio.Event()
+        self.full = asyncio.Event()
+        self.space = asyncio.Event()
+        self.empty = asyncio.Event()
+        self.empty.set()
+        self.published = 0
+        self.batches = 0
+        self.coalesced = 0
+        self.waits = 0
+        self.failures = 0
+
+    async def Publish(self, topic, message):
+        key = None if self.coalesce_key is None else self.coalesce_key(topic, message)
+
+        if key is not None:
+            entry = self.keys.get(key)
+
+            if entry is not None and entry[2] is not None:
+                # The queued message is out of date, drop it for this one
+                self.bytes -= len(entry[2])
+                entry[2] = None
+                self.count -= 1
+                self.coalesced += 1
+
+        while self.count >= self.max_events:
+            self.waits += 1
+            self.space.clear()
+            await self.space.wait()
+
+        entry = [topic, key, message]
+        self.queue.append(entry)
+
+        if key is not None:
+            self.keys[key] = entry
+
+        self.count += 1
+        self.bytes += len(message)
+        self.empty.clear()
+        self.ready.set()
+
+        if self.bytes >= self.batch_bytes:
+            self.full.set()
+
+    async def flush(self):
+        """Waits until every queued message has been published."""
+        while self.count:
+            self.full.set()
+            await self.empty.wait()
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+
+            if self.bytes < self.batch_bytes:
+                # Give the batch until its deadline to fill up
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.flush_ms / 1000)
+                except asyncio.TimeoutError:
+                    pass
+
+            self.full.clear()
+
+            while self.queue:
+                topic, entries = self._take_batch()
+
+                if entries:
+                    await self._publish(topic, entries)
+
+            self.empty.set()
+
+    def _take_batch(self):
+        """Removes the next batch: queued messages of the first entry's topic."""
+        topic = self.queue[0][0]
+        batch = []
+        rest = []
+        size = 0
+
+        for entry in self.queue:
+            if entry[2] is None:
+                continue
+
+            if entry[0] != topic or (batch and size + len(entry[2]) > self.batch_bytes):
+                rest.append(entry)
+                continue
+
+            batch.append(entry)
+            size += len(entry[2])
+
+            if entry[1] is not None:
+                # In flight now, so a newer message no longer replaces it
+                del self.keys[entry[1]]
+
+        self.queue = rest
+        return topic, batch
+
+    async def _publish(self, topic, entries):
+        messages = [entry[2] for entry in entries]
+
+        if self.framing == FRAMING_LENGTH:
+            frames = []
+
+            for message in messages:
+                message = message.encode()
+                frames.append(struct.pack('>H', len(message)))
+                frames.append(message)
+
+            payload = b''.join(frames)
+        else:
+            payload = '[' + ','.join(messages) + ']'
+
+        while True:
+            try:
+                await self.pool.Publish(topic, payload)
+                break
+            except Exception as e:
+                self.failures += 1
+                print("outbox publish failed: " + str(e))
+                await asyncio.sleep_ms(self.retry_ms)
+
+        for entry in entries:
+            self.bytes -= len(entry[2])
+
+        self.count -= len(entries)
+        self.published += len(entries)
+        self.batches += 1
+        self.space.set()
+
+    def stats(self):
+        return {
+            'queued': self.count,
+            'bytes': self.bytes,
+            'published': self.published,
+            'batches': self.batches,
+            'coalesced': self.coalesced,
+            'waits': self.waits,
+            'failures': self.failures
+        }
@@ -0,0 +1,83 @@
+import time
+import uasyncio as asyncio
+from nanoweb import Nanoweb
+
+REQUESTS = 100
+HOST = '127.0.0.1'
+PORT = 8081
+
+naw = Nanoweb(PORT)
+
+@naw.route("/ping")
+async def ping(request):
+    await request.write("HTTP/1.1 200 OK\r\n")
+    await request.write("Content-Type: application/json\r\n\r\n")
+    await request.write('{"status": true}')
+
+def get(close=False):
+    return ("GET /ping HTTP/1.1\r\nHost: %s\r\nConnection: %s\r\n\r\n" %
+            (HOST, 'close' if close else 'keep-alive')).encode()
+
+async def read_response(reader):
+    length = 0
+
+    while True:
+        line = await reader.readline()
+
+        if line in (b'\r\n', b''):
+            break
+
+        if line.lower().startswith(b'content-length:'):
+            length = int(line[15:])
+
+    return await reader.readexactly(length)
+
+async def send(writer, data):
+    writer.write(data)
+    await writer.drain()
+
+async def one_per_connection():
+    for i in range(REQUESTS):
+        reader, writer = await asyncio.open_connection(HOST, PORT)
+        await send(writer, get(close=True))
+        await read_response(reader)
+        writer.close()
+        await writer.wait_closed()
+
+async def keep_alive():
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+
+    for i in range(REQUESTS):
+        await send(writer, get(close=i == REQUESTS - 1))
+        await read_response(reader)
+
+    writer.close()
+    await writer.wait_closed()
+
+async def pipelined():
+    # Everything goes out before the first response is read
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    await send(writer, b''.join(get(close=i == REQUESTS - 1) for i in range(REQUESTS)))
+
+    for i in range(REQUESTS):
+        await read_response(reader)
+
+    writer.close()
+    await writer.wait_closed()
+
+async def bench(name, client):
+    start = time.ticks_ms()
+    await client()
+    elapsed_ms = time.ticks_diff(time.ticks_ms(), start)
+    print("%-18s %d requests: %6d ms  (%.0f/s)" %
+          (name, REQUESTS, elapsed_ms, REQUESTS * 1000 / max(1, elapsed_ms)))
+
+async def main():
+    naw.max_requests = REQUESTS
+    server = await naw.run()
+    await bench('one per connection', one_per_connection)
+    await bench('keep-alive', keep_alive)
+    await bench('pipelined', pipelined)
+    server.close()
+
+asyncio.run(main())
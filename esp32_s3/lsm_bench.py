@@ -0,0 +1,40 @@
+import time
+from btree_disk import BTree
+from lsm_tree import LSMTree
+
+BURST = 300
+TREE_DEPTH = 10
+BENCH_DIR = '/lsm_bench'
+
+def reading(i):
+    return {"id": str(1700000000000000000 + i), "meterId": i % 4, "reading": 1234.5 + i,
+            "readingOn": "2024-01-01T10:00:00", "version": 0}
+
+def bench(name, tree):
+    tree.delete_all()
+
+    # A burst of AddMeterReading style inserts, then the write-back
+    start = time.ticks_ms()
+
+    for i in range(BURST):
+        value = reading(i)
+        tree.insert((value["id"], value))
+
+    insert_ms = time.ticks_diff(time.ticks_ms(), start)
+    start = time.ticks_ms()
+    tree.sync()
+
+    if isinstance(tree, LSMTree):
+        tree.compact()
+
+    sync_ms = time.ticks_diff(time.ticks_ms(), start)
+    start = time.ticks_ms()
+    found = sum(1 for i in range(0, BURST, 10) if tree.find(reading(i)["id"]) is not None)
+    find_ms = time.ticks_diff(time.ticks_ms(), start)
+
+    print("%-6s %d inserts: %6d ms  (%.0f/s)  sync: %5d ms  %d finds: %5d ms  %s" %
+          (name, BURST, insert_ms, BURST * 1000 / max(1, insert_ms), sync_ms, found, find_ms, tree.stats()))
+
+bench('wal', BTree(TREE_DEPTH, BENCH_DIR + '_wal', 'bench.json', wal=True))
+bench('lsm', LSMTree(TREE_DEPTH, BENCH_DIR + '_lsm'))
+bench('lsm64', LSMTree(TREE_DEPTH, BENCH_DIR + '_lsm64', memtable_size=64))
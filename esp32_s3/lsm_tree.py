@@ -0,0 +1,581 @@
+import os
+import ujson as json
+import uasyncio as asyncio
+from btree_custom_mem import BTree
+from node_search import bisect_left, bisect_right
+from wal import WriteAheadLog
+
+# Marks a deleted key in the memtable; in a run file it is a [key] line.
+_TOMBSTONE = object()
+
+class RunWriter:
+    """
+    Writes one immutable sorted run: a file of [key, value] JSON lines in
+    ascending key order, plus a sparse index with the first key and file
+    offset of every block of `block_size` lines. The run becomes visible
+    only once the file is renamed into place.
+    """
+    def __init__(self, directory, run_id, tier, block_size):
+        self.path = f"{directory}/run_{run_id}"
+        self.run = {'id': run_id, 'tier': tier}
+        self.block_size = block_size
+        self.keys = []
+        self.offsets = []
+        self.entries = 0
+        self.offset = 0
+        self.last_key = None
+        self.f = open(self.path + '.tmp', 'wb')
+
+    def add(self, key, value):
+        if self.entries % self.block_size == 0:
+            self.keys.append(key)
+            self.offsets.append(self.offset)
+
+        line = (json.dumps([key] if value is _TOMBSTONE else [key, value]) + '\n').encode('utf-8')
+        self.f.write(line)
+        self.offset += len(line)
+        self.entries += 1
+        self.last_key = key
+
+    def finish(self):
+        self.f.close()
+        os.rename(self.path + '.tmp', self.path + '.run')
+        index = {'keys': self.keys, 'offsets': self.offsets, 'entries': self.entries,
+                 'max': self.last_key, 'block_size': self.block_size}
+
+        with open(self.path + '.idx', 'w') as f:
+            json.dump(index, f)
+
+        self.run['entries'] = self.entries
+        return self.run
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.path + '.tmp')
+
+class LSMTree:
+    """
+    Log-structured store for append-heavy data such as meter readings, with
+    the insert / find / update_value / delete / range / count_all surface
+    of the B-tree classes.
+
+    Writes go to a btree_custom_mem memtable and to a write-ahead log next
+    to the directory. A full memtable is written out sequentially as an
+    immutable sorted run, and runs are merged size-tiered: once a tier
+    holds `tier_size` runs they are merged into one run of the next tier,
+    by `compact()` or in the background by the `run()` task. Reads check
+    the memtable and then the runs from newest to oldest; deletes are
+    tombstones until a merge that includes the oldest run drops them.
+    """
+    def __init__(self, t, directory='./lsm_data', memtable_size=256, tier_size=4, block_size=32,
+                 wal_group_size=16, wal_group_ms=50):
+        self.t = t
+        self.directory = directory
+        self.memtable_size = memtable_size
+        self.tier_size = tier_size
+        self.block_size = block_size
+        self.manifest_path = f"{directory}/manifest.json"
+        self.generation = 0
+        # Bumped by every write and merge, so range() can tell it must pick up again
+        self.version = 0
+        self.compacting = False
+        self.flushes = 0
+        self.compactions = 0
+
+        try:
+            os.listdir(self.directory)
+        except OSError:
+            os.mkdir(self.directory)
+
+        self._load_manifest()
+        self.wal = WriteAheadLog(f"{directory}.wal", wal_group_size, wal_group_ms)
+        self._replay()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {'next_run': 0, 'count': 0, 'runs': []}
+
+        self.next_run = manifest['next_run']
+        # Live keys held by the runs; the memtable's changes are added on replay
+        self.run_count = manifest['count']
+        self.count = self.run_count
+        # Newest run first
+        self.runs = manifest['runs']
+        live = set()
+
+        for run in self.runs:
+            self._open_run(run)
+            live.add(f"run_{run['id']}")
+
+        # Runs left behind by an interrupted flush or merge
+        for filename in os.listdir(self.directory):
+            if filename.startswith('run_') and filename.split('.')[0] not in live:
+                os.remove(f"{self.directory}/{filename}")
+
+        self.memtable = BTree(self.t)
+        self.mem_count = 0
+
+    def _save_manifest(self):
+        manifest = {'next_run': self.next_run, 'count': self.run_count,
+                    'runs': [{'id': run['id'], 'tier': run['tier'], 'entries': run['entries']} for run in self.runs]}
+
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+
+        os.rename(self.manifest_path + '.tmp', self.manifest_path)
+
+    def _open_run(self, run):
+        path = f"{self.directory}/run_{run['id']}"
+
+        with open(path + '.idx', 'r') as f:
+            index = json.load(f)
+
+        run['keys'] = index['keys']
+        run['offsets'] = index['offsets']
+        run['max'] = index['max']
+        run['block_size'] = index['block_size']
+        run['f'] = open(path + '.run', 'rb')
+
+    def _close_run(self, run, remove):
+        run['f'].close()
+
+        if remove:
+            self._remove_run_files(run)
+
+    def _remove_run_files(self, run):
+        path = f"{self.directory}/run_{run['id']}"
+
+        for ext in ('.run', '.idx'):
+            try:
+                os.remove(path + ext)
+            except OSError:
+                pass
+
+    def _replay(self):
+        wal = self.wal
+        wal.replaying = True
+
+        try:
+            for record in wal.read():
+                op = record[0]
+
+                if op == 'i':
+                    self._put(record[1], record[2])
+                elif op == 'd':
+                    self._put(record[1], _TOMBSTONE)
+                elif op == 'c':
+                    self._clear()
+        finally:
+            wal.replaying = False
+
+        if self.mem_count >= self.memtable_size:
+            self.flush()
+
+    # --- Writes ---
+
+    def insert(self, key_value):
+        key, value = key_value[0], key_value[1]
+        self.wal.append(['i', key, value])
+        self._put(key, value)
+
+    def update_value(self, key, new_value):
+        if self.find(key) is None:
+            return False
+
+        self.insert((key, new_value))
+        return True
+
+    def delete(self, key):
+        if isinstance(key, tuple):
+            key = key[0]
+
+        if self.find(key) is None:
+            return False
+
+        self.wal.append(['d', key])
+        self._put(key, _TOMBSTONE)
+        return True
+
+    def _put(self, key, value):
+        # Keys are mostly new and above every run, so this is usually a
+        # memtable lookup only
+        found, old = self._lookup(key)
+        existed = found and old is not _TOMBSTONE
+        self.version += 1
+
+        if value is _TOMBSTONE:
+            if existed:
+                self.count -= 1
+        elif not existed:
+            self.count += 1
+
+        if self.memtable.update_value(key, value) == False:
+            self.memtable.insert((key, value))
+            self.mem_count += 1
+
+        # The log being replayed must not be emptied by a flush half way
+        if self.mem_count >= self.memtable_size and not self.wal.replaying:
+            self.flush()
+
+    def flush(self):
+        """Writes the memtable out as a new tier 0 run and empties the log."""
+        self.wal.commit()
+
+        if self.mem_count > 0:
+            writer = RunWriter(self.directory, self.next_run, 0, self.block_size)
+            self.next_run += 1
+
+            for key, value in self.memtable.range():
+                writer.add(key, value)
+
+            run = writer.finish()
+            self._open_run(run)
+            self.runs.insert(0, run)
+            self.memtable = BTree(self.t)
+            self.mem_count = 0
+            self.flushes += 1
+
+        self.run_count = self.count
+        self._save_manifest()
+        self.wal.reset()
+
+    def sync(self):
+        """Makes the logged writes durable; the memtable itself stays in RAM."""
+        self.wal.commit()
+
+    def delete_all(self):
+        # Logged first, so an interrupted delete is finished by the replay
+        self.wal.append(['c'])
+        self.wal.commit()
+        self._clear()
+        self.wal.reset()
+
+    def _clear(self):
+        self.generation += 1
+        self.version += 1
+        runs = self.runs
+        self.runs = []
+        self.count = 0
+        self.run_count = 0
+        self.memtable = BTree(self.t)
+        self.mem_count = 0
+        # The manifest goes first so it never lists a removed run
+        self._save_manifest()
+
+        for run in runs:
+            self._close_run(run, True)
+
+    def bulk_load(self, sorted_items, fill_factor=1.0):
+        """
+        Replaces the contents with `sorted_items`, (key, value) pairs in
+        ascending key order, written straight out as a single run.
+        """
+        self.delete_all()
+        writer = RunWriter(self.directory, self.next_run, 0, self.block_size)
+        self.next_run += 1
+        last_key = None
+
+        for key, value in sorted_items:
+            if last_key is not None and key <= last_key:
+                writer.f.close()
+                raise ValueError("bulk_load needs unique keys in ascending order")
+
+            writer.add(key, value)
+            last_key = key
+
+        run = writer.finish()
+
+        if run['entries'] > 0:
+            self._open_run(run)
+            self.runs.insert(0, run)
+            self.count = self.run_count = run['entries']
+        else:
+            self._remove_run_files(run)
+
+        self._save_manifest()
+
+    # --- Reads ---
+
+    def _read_block(self, run, block):
+        f = run['f']
+        f.seek(run['offsets'][block])
+        size = min(run['block_size'], run['entries'] - block * run['block_size'])
+        return [json.loads(f.readline()) for _ in range(size)]
+
+    def _lookup(self, key):
+        """Returns (found, value) with value _TOMBSTONE for a deleted key."""
+        node, index = self.memtable._find_node_and_index(self.memtable.root, key)
+
+        if node is not None:
+            return True, node.keys[index][1]
+
+        for run in self.runs:
+            keys = run['keys']
+
+            if not keys or key < keys[0] or key > run['max']:
+                continue
+
+            for entry in self._read_block(run, bisect_right(keys, key) - 1):
+                if entry[0] == key:
+                    return True, entry[1] if len(entry) > 1 else _TOMBSTONE
+
+        return False, None
+
+    def find(self, key):
+        found, value = self._lookup(key)
+        return None if value is _TOMBSTONE else value
+
+    def _scan(self, run, start_key, end_key, reverse):
+        """Generator over a run's entries in [start_key, end_key), one block at a time."""
+        keys = run['keys']
+
+        if reverse:
+            block = len(keys) - 1 if end_key is None else bisect_left(keys, end_key) - 1
+
+            while block >= 0:
+                entries = self._read_block(run, block)
+                block -= 1
+
+                for entry in reversed(entries):
+                    if start_key is not None and entry[0] < start_key:
+                        return
+                    if end_key is None or entry[0] < end_key:
+                        yield entry[0], entry[1] if len(entry) > 1 else _TOMBSTONE
+        else:
+            block = 0 if start_key is None else max(0, bisect_right(keys, start_key) - 1)
+
+            while block < len(keys):
+                entries = self._read_block(run, block)
+                block += 1
+
+                for entry in entries:
+                    if end_key is not None and entry[0] >= end_key:
+                        return
+                    if start_key is None or entry[0] >= start_key:
+                        yield entry[0], entry[1] if len(entry) > 1 else _TOMBSTONE
+
+    def _merge(self, sources, reverse):
+        """
+        Merges sorted (key, value) sources, newest first, into one sorted
+        stream; for a key held by several sources the newest value wins.
+        """
+        heads = []
+
+        for rank in range(len(sources)):
+            self._advance(heads, [None, rank, None, sources[rank]])
+
+        while heads:
+            best = heads[0]
+
+            for head in heads:
+                if head[0] == best[0]:
+                    if head[1] < best[1]:
+                        best = head
+                elif (head[0] > best[0]) if reverse else (head[0] < best[0]):
+                    best = head
+
+            key, value = best[0], best[2]
+            done = [head for head in heads if head[0] == key]
+            heads = [head for head in heads if head[0] != key]
+
+            for head in done:
+                self._advance(heads, head)
+
+            yield key, value
+
+    def _advance(self, heads, head):
+        for key, value in head[3]:
+            head[0] = key
+            head[2] = value
+            heads.append(head)
+            return
+
+    def range(self, start_key=None, end_key=None, reverse=False):
+        """
+        Generator over the (key, value) entries with start_key <= key < end_key
+        in key order, or descending with reverse=True; a bound of None is
+        open. Each run is read one block at a time. The tree may be written
+        to or compacted while the generator is in use: it then starts over
+        after the last key it yielded, from the current memtable and runs,
+        since a merge closes and removes the runs it was reading.
+        """
+        after = None
+
+        while True:
+            version = self.version
+            sources = [self.memtable.range(start_key, end_key, reverse)]
+            sources.extend(self._scan(run, start_key, end_key, reverse) for run in self.runs)
+
+            for key, value in self._merge(sources, reverse):
+                if value is _TOMBSTONE or key == after:
+                    continue
+
+                yield key, value
+
+                if version != self.version:
+                    break
+            else:
+                return
+
+            if reverse:
+                end_key = key
+            else:
+                start_key = after = key
+
+    def seek(self, key):
+        """Generator over the entries with keys >= key, in key order."""
+        return self.range(key)
+
+    def iter_items(self, offset=0, limit=None):
+        """
+        Generator over the (key, value) entries in key order, starting at
+        position `offset` and yielding at most `limit` of them. Runs keep no
+        counts, so the first `offset` entries are skipped over.
+        """
+        for key, value in self.range():
+            if offset > 0:
+                offset -= 1
+                continue
+            if limit is not None:
+                if limit <= 0:
+                    return
+                limit -= 1
+            yield key, value
+
+    def iter_keys(self):
+        """Generator over every key in order."""
+        for key, value in self.range():
+            yield key
+
+    def iter_values(self, filter_func=None, offset=0, limit=None):
+        """
+        Generator over the values in key order, those accepted by filter_func
+        if given. With a filter, offset and limit count the accepted values.
+        """
+        for key, value in self.range():
+            if filter_func is None or filter_func(value):
+                if offset > 0:
+                    offset -= 1
+                    continue
+                if limit is not None:
+                    if limit <= 0:
+                        return
+                    limit -= 1
+                yield value
+
+    def traverse_keys(self):
+        return list(self.iter_items())
+
+    def traverse_func(self, filter_func):
+        return list(self.iter_values(filter_func))
+
+    def count_all(self):
+        # Kept up to date on every write and saved in the manifest
+        return self.count
+
+    # --- Compaction ---
+
+    def _tier_to_merge(self):
+        tiers = {}
+
+        for run in self.runs:
+            tiers[run['tier']] = tiers.get(run['tier'], 0) + 1
+
+        for tier in sorted(tiers):
+            if tiers[tier] >= self.tier_size:
+                return tier
+
+        return None
+
+    def _compact_steps(self):
+        """Generator that merges full tiers, yielding after every block written."""
+        if self.compacting:
+            return
+
+        self.compacting = True
+
+        try:
+            yield from self._merge_tiers()
+        finally:
+            self.compacting = False
+
+    def _merge_tiers(self):
+        tier = self._tier_to_merge()
+
+        while tier is not None:
+            generation = self.generation
+            inputs = [run for run in self.runs if run['tier'] == tier]
+            # Tombstones can go once nothing older could still hold the key
+            drop_tombstones = inputs[-1] is self.runs[-1]
+            writer = RunWriter(self.directory, self.next_run, tier + 1, self.block_size)
+            self.next_run += 1
+
+            for key, value in self._merge([self._scan(run, None, None, False) for run in inputs], False):
+                if value is _TOMBSTONE and drop_tombstones:
+                    continue
+
+                writer.add(key, value)
+
+                if writer.entries % self.block_size == 0:
+                    yield
+
+                    if generation != self.generation:
+                        # delete_all ran meanwhile, the inputs are gone
+                        writer.abort()
+                        return
+
+            run = writer.finish()
+
+            # The merged run takes the place of the oldest input
+            position = self.runs.index(inputs[-1])
+
+            if run['entries'] > 0:
+                self._open_run(run)
+                self.runs.insert(position + 1, run)
+            else:
+                self._remove_run_files(run)
+
+            for old in inputs:
+                self.runs.remove(old)
+
+            self.version += 1
+            self._save_manifest()
+
+            for old in inputs:
+                self._close_run(old, True)
+
+            self.compactions += 1
+            tier = self._tier_to_merge()
+            yield
+
+    def compact(self):
+        """Merges every full tier now."""
+        for _ in self._compact_steps():
+            pass
+
+    async def run(self, interval_ms=1000):
+        """Background compaction; yields to other tasks after every block."""
+        while True:
+            await asyncio.sleep_ms(interval_ms)
+
+            for _ in self._compact_steps():
+                await asyncio.sleep_ms(0)
+
+    def stats(self):
+        tiers = {}
+
+        for run in self.runs:
+            tiers[run['tier']] = tiers.get(run['tier'], 0) + 1
+
+        return {
+            'count': self.count,
+            'memtable': self.mem_count,
+            'runs': len(self.runs),
+            'tiers': tiers,
+            'flushes': self.flushes,
+            'compactions': self.compactions,
+            'wal': self.wal.stats()
+        }
@@ -0,0 +1,207 @@
+import gc
+import time
+from array import array
+
+# Upper bounds of the latency buckets; one more bucket counts the rest
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = array('L', [0] * (len(buckets) + 1))
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        buckets = self.buckets
+        i = 0
+
+        while i < len(buckets) and value > buckets[i]:
+            i += 1
+
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+        if value > self.max:
+            self.max = value
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.sum, "max": self.max, "buckets": list(self.counts)}
+
+class CallStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+    def to_dict(self):
+        return {"calls": self.calls, "errors": self.errors, "latency_ms": self.latency.to_dict()}
+
+class RouteStats(CallStats):
+    def __init__(self):
+        super().__init__()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.heap_delta = 0
+
+    def to_dict(self):
+        stats = super().to_dict()
+        stats["bytes_in"] = self.bytes_in
+        stats["bytes_out"] = self.bytes_out
+        stats["heap_delta"] = self.heap_delta
+        return stats
+
+class Instrumented:
+    """
+    Stands in for a controller or DAO and times each of the coroutine
+    methods named in `methods` under "<name>.<method>". Every other
+    method and attribute passes straight through to the target, so
+    plain methods such as iterators and printDb keep working.
+    """
+    def __init__(self, target, metrics, name, methods):
+        self._target = target
+        self._metrics = metrics
+        self._name = name
+        self._methods = methods
+        self._timed = {}
+
+    def __getattr__(self, attr):
+        timed = self._timed.get(attr)
+
+        if timed is not None:
+            return timed
+
+        value = getattr(self._target, attr)
+
+        if attr not in self._methods:
+            return value
+
+        metrics = self._metrics
+        key = self._name + '.' + attr
+
+        async def timed(*args, **kwargs):
+            start = time.ticks_us()
+            failed = True
+
+            try:
+                result = await value(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                metrics.record_call(key, time.ticks_diff(time.ticks_us(), start) / 1000, failed)
+
+        self._timed[attr] = timed
+        return timed
+
+class Metrics:
+    """
+    Request and call instrumentation for the REST server.
+
+    Nanoweb feeds it one observe() per routed request, keyed by method and
+    route pattern: count, errors (an exception or a status of 400 and up),
+    a latency histogram, body bytes in and out and the change in allocated
+    heap. Controllers and DAOs wrapped with wrap() add call counts and
+    latencies for the coroutine methods named. Histograms count into
+    fixed buckets held in arrays, so their size does not grow with the
+    traffic.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.routes = {}
+        self.calls = {}
+        self.started = time.ticks_ms()
+
+    def wrap(self, target, name, methods):
+        """Proxy for `target` that times its coroutine methods named in `methods`."""
+        return Instrumented(target, self, name, methods)
+
+    def record_call(self, name, elapsed_ms, failed):
+        stats = self.calls.get(name)
+
+        if stats is None:
+            stats = self.calls[name] = CallStats()
+
+        stats.calls += 1
+        stats.latency.add(elapsed_ms)
+
+        if failed:
+            stats.errors += 1
+
+    async def observe(self, request, output):
+        """Awaits `output`, the handler's work, and records it for the route."""
+        key = request.method + ' ' + request.route
+        heap = gc.mem_alloc()
+        start = time.ticks_us()
+        failed = True
+
+        try:
+            result = await output
+            failed = False
+            return result
+        finally:
+            elapsed_ms = time.ticks_diff(time.ticks_us(), start) / 1000
+            stats = self.routes.get(key)
+
+            if stats is None:
+                stats = self.routes[key] = RouteStats()
+
+            response = request.response
+
+            if not failed and response is not None and response.status() >= 400:
+                failed = True
+
+            stats.calls += 1
+            stats.latency.add(elapsed_ms)
+            stats.bytes_in += int(request.headers.get('Content-Length', 0))
+            stats.bytes_out += 0 if response is None else response.bytes
+            stats.heap_delta += gc.mem_alloc() - heap
+
+            if failed:
+                stats.errors += 1
+
+    def to_dict(self):
+        return {
+            "uptime_ms": time.ticks_diff(time.ticks_ms(), self.started),
+            "buckets_ms": list(self.buckets),
+            "routes": dict((key, stats.to_dict()) for key, stats in self.routes.items()),
+            "calls": dict((key, stats.to_dict()) for key, stats in self.calls.items())
+        }
+
+    def prometheus_lines(self):
+        """The same data in Prometheus text format, one line at a time."""
+        for key, stats in self.routes.items():
+            label = 'route="%s"' % key
+            yield 'nanoweb_requests_total{%s} %d\n' % (label, stats.calls)
+            yield 'nanoweb_request_errors_total{%s} %d\n' % (label, stats.errors)
+            yield 'nanoweb_request_bytes_in_total{%s} %d\n' % (label, stats.bytes_in)
+            yield 'nanoweb_request_bytes_out_total{%s} %d\n' % (label, stats.bytes_out)
+            yield 'nanoweb_request_heap_delta_bytes_total{%s} %d\n' % (label, stats.heap_delta)
+
+            for line in self._histogram_lines('nanoweb_request_latency_ms', label, stats.latency):
+                yield line
+
+        for key, stats in self.calls.items():
+            label = 'call="%s"' % key
+            yield 'nanoweb_calls_total{%s} %d\n' % (label, stats.calls)
+            yield 'nanoweb_call_errors_total{%s} %d\n' % (label, stats.errors)
+
+            for line in self._histogram_lines('nanoweb_call_latency_ms', label, stats.latency):
+                yield line
+
+    def _histogram_lines(self, name, label, histogram):
+        total = 0
+
+        for i in range(len(histogram.counts)):
+            total += histogram.counts[i]
+            le = str(histogram.buckets[i]) if i < len(histogram.buckets) else '+Inf'
+            yield '%s_bucket{%s,le="%s"} %d\n' % (name, label, le, total)
+
+        yield '%s_sum{%s} %.3f\n' % (name, label, histogram.sum)
+        yield '%s_count{%s} %d\n' % (name, label, histogram.count)
+
+    def clear(self):
+        self.routes = {}
+        self.calls = {}
+        self.started = time.ticks_ms()
@@ -65,6 +65,9 @@ config = {
     'clean_init':    True,
     'clean':         True,
     'max_repubs':    4,
+    'max_inflight':  1,
+    'recv_buffer':   512,
+    'puback_cb':     None,
     'will':          None,
     'subs_cb':       lambda *_: None,
     'wifi_coro':     eliza,
@@ -85,6 +88,16 @@ def pid_gen():
         yield pid
 
 
+# Fields of an in-flight window slot
+_PID = const(0)
+_TOPIC = const(1)
+_MSG = const(2)
+_RETAIN = const(3)
+_SENT = const(4)  # ticks_ms of the last send. None: (re)send due, False: sending
+_REPUBS = const(5)
+_ACKED = const(6)
+
+
 def qos_check(qos):
     if not (qos == 0 or qos == 1):
         raise ValueError('Only qos 0 and 1 are supported.')
@@ -133,6 +146,12 @@ class MQTT_base:
         if self.server is None:
             raise ValueError('no server specified.')
         self._sock = None
+        # Receive buffer: bytes from _rx_start to _rx_end are read but unparsed
+        self._rx_buf = bytearray(config.get('recv_buffer', 512))
+        self._rx_view = memoryview(self._rx_buf)
+        self._rx_start = 0
+        self._rx_end = 0
+        self._puback = bytearray(b"\x40\x02\0\0")
         self._sta_if = WANConnect()
         self._sta_if.connect(self._ssid, self._wifi_pw)
 
@@ -140,6 +159,14 @@ class MQTT_base:
         self.rcv_pids = set()  # PUBACK and SUBACK pids awaiting ACK response
         self.last_rx = ticks_ms()  # Time of last communication from broker
         self.lock = asyncio.Lock()
+        # QoS 1 in-flight window. With the default of 1 publish() awaits each
+        # PUBACK; above that it returns the PID once the message is sent.
+        self._max_inflight = config.get('max_inflight', 1)
+        self._puback_cb = config.get('puback_cb')
+        self._window = [[0, None, None, False, None, 0, False] for _ in range(self._max_inflight)]
+        self._win_head = 0
+        self._win_count = 0
+        self._win_event = asyncio.Event()
 
     def _set_last_will(self, topic, msg, retain=False, qos=0):
         qos_check(qos)
@@ -208,26 +235,93 @@ class MQTT_base:
             if n:
                 t = ticks_ms()
                 bytes_wr = bytes_wr[n:]
-            await asyncio.sleep_ms(_SOCKET_POLL_DELAY)
+            if bytes_wr:  # Only wait while the socket is backed up
+                await asyncio.sleep_ms(_SOCKET_POLL_DELAY)
 
     async def _send_str(self, s):
         await self._as_write(struct.pack("!H", len(s)))
         await self._as_write(s)
 
-    async def _recv_len(self):
-        n = 0
-        sh = 0
-        while 1:
-            res = await self._as_read(1)
-            b = res[0]
-            n |= (b & 0x7f) << sh
-            if not b & 0x80:
-                return n
-            sh += 7
+    # Buffered receive on self._sock. Packets are parsed in place in the
+    # receive buffer, which is refilled with readinto. Only message topics
+    # and payloads, handed on to the callback, are copied out.
+    def _rx_fill(self):  # Non-blocking. Returns the number of bytes read.
+        start = self._rx_start
+        end = self._rx_end
+        if start == end:
+            start = end = 0
+        elif end == len(self._rx_buf):  # Move a partial packet to the front
+            self._rx_buf[:end - start] = bytes(self._rx_view[start:end])
+            end -= start
+            start = 0
+        self._rx_start = start
+        self._rx_end = end
+        try:
+            n = self._sock.readinto(self._rx_view[end:])
+        except OSError as e:  # ESP32 issues weird 119 errors here
+            if e.args[0] in BUSY_ERRORS:
+                return 0
+            raise
+        if n is None:
+            return 0
+        if n == 0:  # Connection closed by host
+            raise OSError(-1, 'Connection closed by host')
+        self._rx_end = end + n
+        self.last_rx = ticks_ms()
+        return n
+
+    async def _rx_need(self, n):  # Until n bytes are buffered. OSError caught by superclass
+        t = ticks_ms()
+        while self._rx_end - self._rx_start < n:
+            if self._timeout(t) or not self.isconnected():
+                raise OSError(-1, 'Timeout on socket read')
+            if self._rx_fill():
+                t = ticks_ms()
+            else:  # Yield only when the socket had nothing
+                await asyncio.sleep_ms(_SOCKET_POLL_DELAY)
+
+    def _rx_u16(self):
+        i = self._rx_start
+        self._rx_start = i + 2
+        return self._rx_buf[i] << 8 | self._rx_buf[i + 1]
+
+    async def _rx_bytes(self, n):
+        if n <= len(self._rx_buf):
+            if self._rx_end - self._rx_start < n:
+                await self._rx_need(n)
+            i = self._rx_start
+            self._rx_start = i + n
+            return bytearray(self._rx_view[i:i + n])
+        # Larger than the buffer: take what is buffered, read the rest in place
+        data = bytearray(n)
+        size = self._rx_end - self._rx_start
+        data[:size] = self._rx_view[self._rx_start:self._rx_end]
+        self._rx_start = self._rx_end = 0
+        buffer = memoryview(data)
+        t = ticks_ms()
+        while size < n:
+            if self._timeout(t) or not self.isconnected():
+                raise OSError(-1, 'Timeout on socket read')
+            try:
+                got = self._sock.readinto(buffer[size:])
+            except OSError as e:
+                got = None
+                if e.args[0] not in BUSY_ERRORS:
+                    raise
+            if got == 0:
+                raise OSError(-1, 'Connection closed by host')
+            if got:
+                size += got
+                t = ticks_ms()
+                self.last_rx = t
+            else:
+                await asyncio.sleep_ms(_SOCKET_POLL_DELAY)
+        return data
 
     async def _connect(self, clean):
         self._sock = socket.socket()
         self._sock.setblocking(False)
+        self._rx_start = self._rx_end = 0
         try:
             self._sock.connect(self._addr)
         except OSError as e:
@@ -271,7 +365,7 @@ class MQTT_base:
             await self._send_str(self._pswd)
         # Await CONNACK
         # read causes ECONNABORTED if broker is out; triggers a reconnect.
-        resp = await self._as_read(4)
+        resp = await self._rx_bytes(4)
         self.dprint('Connected to broker.')  # Got CONNACK
         if resp[3] != 0 or resp[0] != 0x20 or resp[1] != 0x02:
             raise OSError(-1, 'Bad CONNACK')  # Bad CONNACK e.g. authentication fail.
@@ -334,6 +428,9 @@ class MQTT_base:
         if self._sock is not None:
             self._sock.close()
 
+    def reset(self):  # API. Drop the connection; it is reconnected as after an outage.
+        self._reconnect()
+
     def close(self):  # API. See https://github.com/peterhinch/micropython-mqtt/issues/60
         self._close()
         try:
@@ -375,6 +472,72 @@ class MQTT_base:
             count += 1
             self.REPUB_COUNT += 1
 
+    # Windowed QoS 1: the messages awaiting PUBACK live in a ring of
+    # max_inflight slots, completed strictly in publication order.
+    async def _window_claim(self, topic, msg, retain):
+        while self._win_count >= self._max_inflight:
+            self._win_event.clear()
+            await self._win_event.wait()
+        pid = next(self.newpid)
+        slot = self._window[(self._win_head + self._win_count) % self._max_inflight]
+        slot[_PID] = pid
+        slot[_TOPIC] = topic
+        slot[_MSG] = msg
+        slot[_RETAIN] = retain
+        slot[_SENT] = False
+        slot[_REPUBS] = 0
+        slot[_ACKED] = False
+        self._win_count += 1
+        self.rcv_pids.add(pid)
+        return slot
+
+    async def _window_send(self, slot, dup):
+        slot[_SENT] = False
+        async with self.lock:
+            await self._publish(slot[_TOPIC], slot[_MSG], slot[_RETAIN], 1, dup, slot[_PID])
+        slot[_SENT] = ticks_ms()
+
+    def _window_ack(self, pid):
+        n = self._max_inflight
+        for i in range(self._win_count):
+            slot = self._window[(self._win_head + i) % n]
+            if slot[_PID] == pid:
+                slot[_ACKED] = True
+                break
+        # Complete in order: a PUBACK overtaking an earlier one waits for it
+        while self._win_count:
+            slot = self._window[self._win_head]
+            if not slot[_ACKED]:
+                break
+            slot[_TOPIC] = slot[_MSG] = None
+            self._win_head = (self._win_head + 1) % n
+            self._win_count -= 1
+            if self._puback_cb is not None:
+                self._puback_cb(slot[_PID])
+        self._win_event.set()
+
+    # Resend with DUP whatever got no PUBACK within response_time, and
+    # everything unsent. Raises OSError after max_repubs resends of a slot.
+    async def _window_retransmit(self):
+        n = self._max_inflight
+        for i in range(self._win_count):
+            slot = self._window[(self._win_head + i) % n]
+            sent = slot[_SENT]
+            if slot[_ACKED] or sent is False or (sent is not None and not self._timeout(sent)):
+                continue
+            if sent is not None:
+                if slot[_REPUBS] >= self._max_repubs:
+                    raise OSError(-1)
+                slot[_REPUBS] += 1
+                self.REPUB_COUNT += 1
+            await self._window_send(slot, 1)
+
+    # Awaits the PUBACKs of every windowed publish.
+    async def drain(self):
+        while self._win_count:
+            self._win_event.clear()
+            await self._win_event.wait()
+
     async def _publish(self, topic, msg, retain, qos, dup, pid):
         pkt = bytearray(b"\x30\0\0\0")
         pkt[0] |= qos << 1 | retain | dup << 3
@@ -415,66 +578,88 @@ class MQTT_base:
     # set by .setup() method. Other (internal) MQTT
     # messages processed internally.
     # Immediate return if no data available. Called from ._handle_msg().
+    # Returns True if a message was processed.
     async def wait_msg(self):
-        try:
-            res = self._sock.read(1)  # Throws OSError on WiFi fail
-        except OSError as e:
-            if e.args[0] in BUSY_ERRORS:  # Needed by RP2
-                await asyncio.sleep_ms(0)
-                return
-            raise
-            
-        if res is None:
+        if self._rx_start == self._rx_end and not self._rx_fill():
             return
-        if res == b'':
-            raise OSError(-1, 'Empty response')
+        buf = self._rx_buf
+        op = buf[self._rx_start]
+        # Fixed header: the type byte and a remaining length of 1 to 4 bytes
+        i = 1
+        sz = 0
+        sh = 0
+        while 1:
+            if self._rx_end - self._rx_start <= i:
+                await self._rx_need(i + 1)
+            b = buf[self._rx_start + i]
+            i += 1
+            sz |= (b & 0x7f) << sh
+            if not b & 0x80:
+                break
+            sh += 7
+        self._rx_start += i
 
-        if res == b"\xd0":  # PINGRESP
-            await self._as_read(1)  # Update .last_rx time
-            return
-        op = res[0]
+        if op == 0xd0:  # PINGRESP. Receipt updated .last_rx time
+            if sz:
+                raise OSError(-1, 'Invalid PINGRESP packet')
+            return True
 
         if op == 0x40:  # PUBACK: save pid
-            sz = await self._as_read(1)
-            if sz != b"\x02":
+            if sz != 2:
                 raise OSError(-1, 'Invalid PUBACK packet')
-            rcv_pid = await self._as_read(2)
-            pid = rcv_pid[0] << 8 | rcv_pid[1]
+            if self._rx_end - self._rx_start < 2:
+                await self._rx_need(2)
+            pid = self._rx_u16()
             if pid in self.rcv_pids:
                 self.rcv_pids.discard(pid)
+                if self._win_count:
+                    self._window_ack(pid)
             else:
                 raise OSError(-1, 'Invalid pid in PUBACK packet')
+            return True
 
         if op == 0x90:  # SUBACK
-            resp = await self._as_read(4)
-            if resp[3] == 0x80:
+            if sz != 3:
                 raise OSError(-1, 'Invalid SUBACK packet')
-            pid = resp[2] | (resp[1] << 8)
+            if self._rx_end - self._rx_start < 3:
+                await self._rx_need(3)
+            pid = self._rx_u16()
+            if buf[self._rx_start] == 0x80:
+                raise OSError(-1, 'Invalid SUBACK packet')
+            self._rx_start += 1
             if pid in self.rcv_pids:
                 self.rcv_pids.discard(pid)
             else:
                 raise OSError(-1, 'Invalid pid in SUBACK packet')
+            return True
 
-        if op & 0xf0 != 0x30:
-            return
-        sz = await self._recv_len()
-        topic_len = await self._as_read(2)
-        topic_len = (topic_len[0] << 8) | topic_len[1]
-        topic = await self._as_read(topic_len)
+        if op & 0xf0 != 0x30:  # Skip anything else
+            while sz:
+                if self._rx_start == self._rx_end:
+                    await self._rx_need(1)
+                n = min(sz, self._rx_end - self._rx_start)
+                self._rx_start += n
+                sz -= n
+            return True
+        if self._rx_end - self._rx_start < 2:
+            await self._rx_need(2)
+        topic_len = self._rx_u16()
+        topic = await self._rx_bytes(topic_len)
         sz -= topic_len + 2
         if op & 6:
-            pid = await self._as_read(2)
-            pid = pid[0] << 8 | pid[1]
+            if self._rx_end - self._rx_start < 2:
+                await self._rx_need(2)
+            pid = self._rx_u16()
             sz -= 2
-        msg = await self._as_read(sz)
+        msg = await self._rx_bytes(sz)
         retained = op & 0x01
         self._cb(topic, msg, bool(retained))
         if op & 6 == 2:  # qos 1
-            pkt = bytearray(b"\x40\x02\0\0")  # Send PUBACK
-            struct.pack_into("!H", pkt, 2, pid)
-            await self._as_write(pkt)
+            struct.pack_into("!H", self._puback, 2, pid)  # Send PUBACK
+            await self._as_write(self._puback)
         elif op & 6 == 4:  # qos 2 not supported
             raise OSError(-1, 'QoS 2 not supported')
+        return True
 
 
 # MQTTClient class. Handles issues relating to connectivity.
@@ -496,6 +681,10 @@ class MQTTClient(MQTT_base):
 
     async def wifi_connect(self, quick=False):
         s = self._sta_if
+        if not ESP8266 and network.WLAN(network.STA_IF).isconnected():
+            # Up already, e.g. brought up by another client: don't re-associate
+            s.active(True)
+            return
         if ESP8266:
             if s.isconnected():  # 1st attempt, already connected.
                 return
@@ -561,12 +750,19 @@ class MQTTClient(MQTT_base):
                 await asyncio.sleep(2)  # Wait for broker to disconnect
                 self.dprint("About to reconnect with unclean session.")
             await self._connect(self._clean)
-        except Exception:
+        except BaseException:  # Also a connect cancelled by a timeout
             self._close()
             self._in_connect = False  # Caller may run .isconnected()
             raise
         clean = self._clean if self._has_connected else self._clean_init
         self.rcv_pids.clear()
+        # Messages still in the window are sent again by _keep_window()
+        n = self._max_inflight
+        for i in range(self._win_count):
+            slot = self._window[(self._win_head + i) % n]
+            if not slot[_ACKED]:
+                self.rcv_pids.add(slot[_PID])
+                slot[_SENT] = None
         # If we get here without error broker/LAN must be up.
         self._isconnected = True
         self._in_connect = False  # Low level code can now check connectivity.
@@ -578,6 +774,8 @@ class MQTTClient(MQTT_base):
 
         asyncio.create_task(self._handle_msg())  # Tasks quit on connection fail.
         asyncio.create_task(self._keep_alive())
+        if self._max_inflight > 1:
+            asyncio.create_task(self._keep_window())
         if self.DEBUG:
             asyncio.create_task(self._memory())
         asyncio.create_task(self._connect_handler(self))  # User handler.
@@ -588,7 +786,9 @@ class MQTTClient(MQTT_base):
         try:
             while self.isconnected():
                 async with self.lock:
-                    await self.wait_msg()  # Immediate return if no message
+                    # Drain what has arrived, e.g. a window's worth of PUBACKs
+                    while await self.wait_msg():
+                        pass
                 await asyncio.sleep_ms(_DEFAULT_MS)  # Let other tasks get lock
 
         except OSError:
@@ -610,6 +810,16 @@ class MQTTClient(MQTT_base):
                 break
         self._reconnect()  # Broker or WiFi fail.
 
+    # Retransmits windowed publishes that are unsent or lack a PUBACK.
+    async def _keep_window(self):
+        try:
+            while self.isconnected():
+                await self._window_retransmit()
+                await asyncio.sleep_ms(100)
+        except OSError:
+            pass
+        self._reconnect()  # Broker or WiFi fail.
+
     # DEBUG: show RAM messages.
     async def _memory(self):
         count = 0
@@ -681,8 +891,20 @@ class MQTTClient(MQTT_base):
                 pass
             self._reconnect()  # Broker or WiFi fail.
 
+    # With max_inflight > 1 a QoS 1 publish returns its PID as soon as it
+    # is sent; a full window makes it wait. Completion is reported to
+    # puback_cb(pid) in publication order, and .drain() awaits it all.
     async def publish(self, topic, msg, retain=False, qos=0):
         qos_check(qos)
+        if qos and self._max_inflight > 1:
+            await self._connection()
+            slot = await self._window_claim(topic, msg, retain)
+            pid = slot[_PID]
+            try:
+                await self._window_send(slot, 0)
+            except OSError:
+                self._reconnect()  # Resent with DUP after reconnection.
+            return pid
         while 1:
             await self._connection()
             try:
@@ -0,0 +1,93 @@
+import time
+import uasyncio as asyncio
+from mqtt_as import MQTTClient, config
+
+MESSAGES = 200
+HOST = '127.0.0.1'
+PORT = 1884
+RTT_MS = 20
+WINDOWS = (1, 2, 4, 8, 16)
+
+async def read_packet(reader):
+    head = await reader.readexactly(1)
+    length = 0
+    shift = 0
+
+    while True:
+        b = (await reader.readexactly(1))[0]
+        length |= (b & 0x7f) << shift
+
+        if not b & 0x80:
+            break
+
+        shift += 7
+
+    return head[0], await reader.readexactly(length) if length else b''
+
+async def stand_in_broker(reader, writer):
+    # Just enough of a broker: CONNACK, PINGRESP and a PUBACK for every
+    # QoS 1 PUBLISH, sent RTT_MS after it arrives
+    pubacks = []
+    running = [True]
+
+    async def send_pubacks():
+        while running[0]:
+            now = time.ticks_ms()
+
+            while pubacks and time.ticks_diff(now, pubacks[0][0]) >= 0:
+                writer.write(pubacks.pop(0)[1])
+
+            await writer.drain()
+            await asyncio.sleep_ms(2)
+
+    task = asyncio.create_task(send_pubacks())
+
+    try:
+        while True:
+            op, body = await read_packet(reader)
+
+            if op & 0xf0 == 0x10:
+                writer.write(b'\x20\x02\x00\x00')
+            elif op & 0xf0 == 0xc0:
+                writer.write(b'\xd0\x00')
+            elif op & 0xf0 == 0xe0:
+                break
+            elif op & 0xf0 == 0x30 and op & 6:
+                i = 2 + (body[0] << 8 | body[1])
+                pubacks.append((time.ticks_add(time.ticks_ms(), RTT_MS), b'\x40\x02' + body[i:i + 2]))
+    except (OSError, EOFError):
+        pass
+    finally:
+        running[0] = False
+        await task
+        writer.close()
+
+async def bench(window):
+    cfg = dict(config)
+    cfg['server'] = HOST
+    cfg['port'] = PORT
+    cfg['max_inflight'] = window
+    client = MQTTClient(cfg)
+    await client.connect(quick=True)
+    message = b'x' * 64
+    start = time.ticks_ms()
+
+    for i in range(MESSAGES):
+        await client.publish(b'bench', message, qos=1)
+
+    await client.drain()
+    elapsed_ms = time.ticks_diff(time.ticks_ms(), start)
+    print("window %2d  %d messages: %6d ms  (%.0f msg/s)" %
+          (window, MESSAGES, elapsed_ms, MESSAGES * 1000 / max(1, elapsed_ms)))
+    await client.disconnect()
+
+async def main():
+    server = await asyncio.start_server(stand_in_broker, HOST, PORT)
+    print("stand-in broker, %d ms round trip" % RTT_MS)
+
+    for window in WINDOWS:
+        await bench(window)
+
+    server.close()
+
+asyncio.run(main())
@@ -0,0 +1,312 @@
+import os
+import time
+import ujson as json
+import uasyncio as asyncio
+
+# Segment records, one JSON list per line: [boot, queued_ms, topic,
+# message], boot being the number of the boot that queued it and
+# queued_ms the time.ticks_ms() of the Publish(). The wall clock is not
+# used, as nothing sets it. Segments are files named by sequence number
+# and only the newest one is appended to. cursor.json holds [segment,
+# offset] of the next record to send; every segment before the cursor's
+# has been sent and removed. boot.json holds the boot number.
+
+def _sync_fs():
+    # Some ports don't have os.sync()
+    try:
+        os.sync()
+    except AttributeError:
+        pass
+
+class StoreForwardQueue:
+    """
+    Durable outbound queue in front of MqttConnectionPool.
+
+    Publish() has the pool's signature but only appends the message to a
+    segment file under `directory`, so callers never wait on a broker.
+    Appends are committed in groups, like the B-tree write-ahead log, once
+    `group_size` are pending or the oldest has waited `group_ms`. run()
+    replays the segments in order whenever the pool has a broker, reading
+    `batch_size` records at a time and keeping up to `window` publishes
+    in flight, and saves the cursor after each batch, so a reboot resends
+    at most one batch. Segments roll over at `segment_bytes`. Once the
+    segments add up to more than `max_bytes` the oldest is dropped, sent
+    or not, and messages older than `max_age_s` are skipped, not sent.
+    Ages are only known for messages queued since this boot, so older
+    ones are sent whatever their age; `max_age_s` must stay below half
+    the ticks_ms period, about 6 days on most ports.
+    """
+    def __init__(self, pool, directory, segment_bytes=4096, max_bytes=65536, max_age_s=None,
+                 window=4, batch_size=16, group_size=8, group_ms=50, retry_ms=1000):
+        self.pool = pool
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.window = window
+        self.batch_size = batch_size
+        self.group_size = group_size
+        self.group_ms = group_ms
+        self.retry_ms = retry_ms
+        self.cursor_path = f"{directory}/cursor.json"
+        self.boot_path = f"{directory}/boot.json"
+        self.pending = []
+        self.pending_since = 0
+        self.f = None
+        self.ready = asyncio.Event()
+        self.queued = 0
+        self.forwarded = 0
+        self.expired = 0
+        self.dropped_bytes = 0
+        self.failures = 0
+        self.commits = 0
+
+        try:
+            os.listdir(directory)
+        except OSError:
+            os.mkdir(directory)
+
+        try:
+            with open(self.boot_path, 'r') as f:
+                self.boot = json.load(f) + 1
+        except (OSError, ValueError):
+            self.boot = 0
+
+        with open(self.boot_path + '.tmp', 'w') as f:
+            json.dump(self.boot, f)
+
+        os.rename(self.boot_path + '.tmp', self.boot_path)
+
+        self.segments = []
+        self.sizes = {}
+
+        for filename in os.listdir(directory):
+            if filename.endswith('.seg'):
+                seq = int(filename[:-4])
+                self.segments.append(seq)
+                self.sizes[seq] = os.stat(self._path(seq))[6]
+
+        self.segments.sort()
+        self.bytes = sum(self.sizes.values())
+
+        try:
+            with open(self.cursor_path, 'r') as f:
+                seq, offset = json.load(f)
+        except (OSError, ValueError):
+            seq, offset = -1, 0
+
+        # Sent before a reboot got to remove them
+        while self.segments and self.segments[0] < seq:
+            self._remove(self.segments[0])
+
+        # A new segment every boot, so a torn last record is never appended to
+        self.write_seq = max(self.segments[-1] if self.segments else 0, seq) + 1
+        self.segments.append(self.write_seq)
+        self.sizes[self.write_seq] = 0
+
+        if seq not in self.sizes:
+            seq, offset = self.segments[0], 0
+
+        self.cursor_seq = seq
+        self.cursor_offset = offset
+
+    def _path(self, seq):
+        return f"{self.directory}/{seq:08d}.seg"
+
+    async def Publish(self, topic, message):
+        if not self.pending:
+            self.pending_since = time.ticks_ms()
+
+        self.pending.append(json.dumps([self.boot, time.ticks_ms(), topic, message]))
+        self.queued += 1
+
+        if len(self.pending) >= self.group_size or \
+                time.ticks_diff(time.ticks_ms(), self.pending_since) >= self.group_ms:
+            self.commit()
+
+        self.ready.set()
+
+    def commit(self):
+        """Writes and flushes the pending group."""
+        if not self.pending:
+            return
+
+        if self.f is None:
+            self.f = open(self._path(self.write_seq), 'ab')
+
+        self.pending.append('')
+        data = '\n'.join(self.pending).encode('utf-8')
+        self.f.write(data)
+        self.f.flush()
+        _sync_fs()
+        self.pending = []
+        self.commits += 1
+        self.sizes[self.write_seq] += len(data)
+        self.bytes += len(data)
+
+        if self.sizes[self.write_seq] >= self.segment_bytes:
+            self.f.close()
+            self.f = None
+            self.write_seq += 1
+            self.segments.append(self.write_seq)
+            self.sizes[self.write_seq] = 0
+
+        while self.bytes > self.max_bytes and len(self.segments) > 1:
+            # Out of room: the oldest segment goes, whatever is left unsent
+            self.dropped_bytes += self.sizes[self.cursor_seq] - self.cursor_offset
+            self._remove(self.cursor_seq)
+            self._save_cursor(self.segments[0], 0)
+
+    def _remove(self, seq):
+        try:
+            os.remove(self._path(seq))
+        except OSError:
+            pass
+
+        self.segments.remove(seq)
+        self.bytes -= self.sizes.pop(seq)
+
+    def _save_cursor(self, seq, offset):
+        self.cursor_seq = seq
+        self.cursor_offset = offset
+
+        with open(self.cursor_path + '.tmp', 'w') as f:
+            json.dump([seq, offset], f)
+
+        os.rename(self.cursor_path + '.tmp', self.cursor_path)
+
+    def _unsent(self):
+        return self.cursor_seq != self.write_seq or self.cursor_offset < self.sizes[self.write_seq]
+
+    async def run(self):
+        while True:
+            if not self.pending and not self._unsent():
+                self.ready.clear()
+                await self.ready.wait()
+
+            # Give the group until its deadline to fill up
+            await asyncio.sleep_ms(self.group_ms)
+            self.commit()
+
+            if not self.pool.isconnected():
+                await asyncio.sleep_ms(self.retry_ms)
+                continue
+
+            if not await self._forward():
+                await asyncio.sleep_ms(self.retry_ms)
+
+    async def _forward(self):
+        """Sends everything committed; False if a publish failed."""
+        while self._unsent():
+            seq = self.cursor_seq
+            entries, done = self._read(seq, self.cursor_offset)
+            sent = await self._send(seq, entries)
+
+            if seq != self.cursor_seq:
+                # Dropped while it was being sent
+                continue
+
+            if not sent:
+                self._save_cursor(seq, self.cursor_offset)
+                return False
+
+            if done:
+                self._remove(seq)
+                self._save_cursor(self.segments[0], 0)
+            else:
+                self._save_cursor(seq, self.cursor_offset)
+
+        return True
+
+    def _read(self, seq, offset):
+        """
+        Up to batch_size (end offset, record) pairs from `offset`, and
+        whether the segment is finished with. A torn last line, left by a
+        crash, ends the segment.
+        """
+        limit = self.sizes[seq]
+        entries = []
+
+        try:
+            f = open(self._path(seq), 'rb')
+        except OSError:
+            return entries, seq != self.write_seq
+
+        with f:
+            f.seek(offset)
+
+            while len(entries) < self.batch_size and offset < limit:
+                line = f.readline()
+
+                if not line.endswith(b'\n'):
+                    offset = limit
+                    break
+
+                offset += len(line)
+
+                try:
+                    entries.append((offset, json.loads(line)))
+                except ValueError:
+                    pass
+
+        if not entries and offset > self.cursor_offset:
+            self.cursor_offset = offset
+
+        return entries, offset >= limit and seq != self.write_seq
+
+    async def _send(self, seq, entries):
+        """Publishes `window` records at a time, moving the cursor past each window sent."""
+        now = time.ticks_ms()
+        failed = []
+
+        async def publish(topic, message):
+            try:
+                await self.pool.Publish(topic, message)
+            except Exception as e:
+                failed.append(e)
+
+        for i in range(0, len(entries), self.window):
+            window = entries[i:i + self.window]
+            messages = []
+
+            for offset, record in window:
+                if self._expired(record, now):
+                    self.expired += 1
+                else:
+                    messages.append(publish(record[-2], record[-1]))
+
+            if messages:
+                await asyncio.gather(*messages)
+
+            if failed:
+                self.failures += 1
+                print("store and forward publish failed: " + str(failed[0]))
+                return False
+
+            if seq != self.cursor_seq:
+                break
+
+            self.cursor_offset = window[-1][0]
+            self.forwarded += len(messages)
+
+        return True
+
+    def _expired(self, record, now):
+        # Records of an earlier boot, or of the old [time, topic, message]
+        # layout, have no age that ticks_ms can tell
+        if self.max_age_s is None or len(record) != 4 or record[0] != self.boot:
+            return False
+
+        return time.ticks_diff(now, record[1]) > self.max_age_s * 1000
+
+    def stats(self):
+        return {
+            'queued': self.queued,
+            'forwarded': self.forwarded,
+            'expired': self.expired,
+            'dropped_bytes': self.dropped_bytes,
+            'failures': self.failures,
+            'segments': len(self.segments),
+            'bytes': self.bytes,
+            'pending': len(self.pending)
+        }
@@ -0,0 +1,263 @@
+import os
+import time
+import ujson as json
+import uasyncio as asyncio
+from node_cache import CachedNodeManager
+
+# Log records, one JSON list per line:
+#   ['i', key, value] insert        ['u', key, value] update
+#   ['d', key]        delete        ['c']             delete all
+#   ['n', node data]  node image written by a checkpoint
+#   ['m', meta, deleted node ids]   checkpoint complete
+# A checkpoint appends the image of every dirty node and the 'm' record
+# before anything is written in place, then empties the log.
+
+WAL_CACHE_SIZE = 32
+
+def _sync_fs():
+    # Some ports don't have os.sync()
+    try:
+        os.sync()
+    except AttributeError:
+        pass
+
+class WriteAheadLog:
+    """
+    Append-only redo log kept next to a disk B-tree's directory.
+
+    Records are buffered and written with one flush per group, once
+    `group_size` records are pending or the oldest has waited `group_ms`.
+    A crash loses at most the last group; everything committed is replayed
+    on the next mount.
+    """
+    def __init__(self, path, group_size=16, group_ms=50):
+        self.path = path
+        self.group_size = group_size
+        self.group_ms = group_ms
+        self.pending = []
+        self.pending_since = 0
+        self.replaying = False
+        self.logged = 0  # Records written since the log was last emptied
+        self.commits = 0
+        self.records = 0
+        self.checkpoints = 0
+        self.f = None
+
+    def _open(self):
+        if self.f is None:
+            self.f = open(self.path, 'ab')
+
+    def append(self, record):
+        if self.replaying:
+            return
+
+        if not self.pending:
+            self.pending_since = time.ticks_ms()
+
+        self.pending.append(json.dumps(record))
+
+        if len(self.pending) >= self.group_size or \
+                time.ticks_diff(time.ticks_ms(), self.pending_since) >= self.group_ms:
+            self.commit()
+
+    def commit(self):
+        """Writes and flushes the pending group."""
+        if not self.pending:
+            return
+
+        self._open()
+        self.pending.append('')
+        self.f.write('\n'.join(self.pending).encode('utf-8'))
+        self.f.flush()
+        _sync_fs()
+        self.records += len(self.pending) - 1
+        self.logged += len(self.pending) - 1
+        self.commits += 1
+        self.pending = []
+
+    async def run(self):
+        """Commits a waiting group every `group_ms`, for groups that never fill."""
+        while True:
+            await asyncio.sleep_ms(self.group_ms)
+            self.commit()
+
+    def reset(self):
+        """Empties the log once its changes are all written in place."""
+        self.pending = []
+        self.logged = 0
+
+        if self.f is not None:
+            self.f.close()
+
+        self.f = open(self.path, 'wb')
+        _sync_fs()
+
+    def read(self):
+        """Returns the committed records; a torn last line ends the log."""
+        records = []
+
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return records
+
+        with f:
+            while True:
+                line = f.readline()
+
+                if not line.endswith(b'\n'):
+                    break
+
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+
+        return records
+
+    def recover(self, manager):
+        """
+        Redoes the last completed checkpoint against the raw node manager
+        and returns the logical records that still have to be replayed.
+        """
+        records = self.read()
+        # Anything read is dropped by the checkpoint that follows the mount
+        self.logged = len(records)
+        marker = len(records) - 1
+
+        while marker >= 0 and records[marker][0] != 'm':
+            marker -= 1
+
+        if marker < 0:
+            # No completed checkpoint, so nothing was written in place since
+            # the last one; node images of an interrupted one are dropped
+            return [record for record in records if record[0] != 'n']
+
+        start = marker
+
+        while start > 0 and records[start - 1][0] == 'n':
+            start -= 1
+
+        for record in records[start:marker]:
+            manager.save_node(manager._node_from_data(record[1]))
+
+        manager.meta = records[marker][1]
+        manager._save_meta()
+
+        for node_id in records[marker][2]:
+            manager.delete_node(node_id)
+
+        return [record for record in records[marker + 1:] if record[0] != 'n']
+
+    def replay(self, tree, records):
+        """Applies logical records to the tree without logging them again."""
+        self.replaying = True
+
+        try:
+            for record in records:
+                op = record[0]
+
+                if op == 'i':
+                    tree.insert((record[1], record[2]))
+                elif op == 'u':
+                    tree.update_value(record[1], record[2])
+                elif op == 'd':
+                    tree.delete(record[1])
+                elif op == 'c':
+                    tree.delete_all()
+        finally:
+            self.replaying = False
+
+    def checkpoint(self, manager):
+        """Writes every change held by a LoggedNodeManager in place."""
+        if self.replaying or not (self.pending or self.logged or manager.dirty_count()):
+            return
+
+        self.commit()
+        cache = manager.cache
+        raw = manager.manager
+
+        for key in cache.dirty:
+            self.pending.append(json.dumps(['n', raw._node_to_data(cache.nodes[key])]))
+
+        self.pending.append(json.dumps(['m', raw.meta, manager.deleted]))
+        self.commit()
+
+        cache.sync()
+        raw._save_meta()
+
+        for node_id in manager.deleted:
+            raw.delete_node(node_id)
+
+        manager.deleted = []
+        self.checkpoints += 1
+        self.reset()
+
+    def close(self):
+        self.commit()
+
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def stats(self):
+        return {
+            'records': self.records,
+            'commits': self.commits,
+            'checkpoints': self.checkpoints,
+            'pending': len(self.pending)
+        }
+
+class LoggedNodeManager(CachedNodeManager):
+    """
+    CachedNodeManager for a tree with a write-ahead log. Dirty nodes, the
+    meta and node deletions are held in memory until the next checkpoint,
+    so the files on disk always hold the tree as of the last checkpoint.
+    While `direct` is set nodes are written straight through instead, which
+    bulk loads use after logging a delete-all.
+    """
+    def __init__(self, manager, log, max_nodes=WAL_CACHE_SIZE, max_bytes=None):
+        super().__init__(manager, max_nodes, max_bytes)
+        self.cache.hold_dirty = True
+        self.log = log
+        self.deleted = []
+        self.direct = False
+
+    def save_node(self, node):
+        if self.direct:
+            self.cache.discard(node.node_id)
+            self.manager.save_node(node)
+        else:
+            self.cache.put(node.node_id, node)
+
+    def delete_node(self, node_id):
+        self.cache.discard(node_id)
+
+        if self.direct:
+            self.manager.delete_node(node_id)
+        else:
+            self.deleted.append(node_id)
+
+    def get_new_node_id(self, save_meta=True):
+        return self.manager.get_new_node_id(save_meta=False)
+
+    def set_root_id(self, node_id):
+        self._pin_root(node_id)
+        self.manager.meta['root_id'] = node_id
+
+    def set_first_leaf_id(self, node_id):
+        self.manager.meta['first_leaf_id'] = node_id
+
+    def set_meta(self, name, value, save_meta=True):
+        self.manager.meta[name] = value
+
+    def dirty_count(self):
+        return len(self.cache.dirty) + len(self.deleted)
+
+    def sync(self):
+        self.log.checkpoint(self)
+
+    def delete_all(self):
+        self.cache.clear()
+        self.deleted = []
+        self.manager.delete_all()
@@ -7,14 +7,9 @@ class AdrHelper:
         return utime.mktime(d1) // (24*3600) - utime.mktime(d2) // (24*3600)
     
     def sort_json_objects_by_date(self, json_objects):
-        n = len(json_objects)
-        
-        for j in range(n - 1):
-            date1_timestamp = self.convert_to_epoch_seconds(json_objects[j]['readingOn'])
-            date2_timestamp = self.convert_to_epoch_seconds(json_objects[j + 1]['readingOn'])
-            
-            if date1_timestamp > date2_timestamp:
-                json_objects[j], json_objects[j + 1] = json_objects[j + 1], json_objects[j]
+        # Ties on the time are kept in id order, the order of the ADR aggregates
+        json_objects.sort(key=lambda json_object: (self.convert_to_epoch_seconds(json_object['readingOn']),
+                                                   json_object.get('id', '')))
         return json_objects
     
     def convert_to_epoch_seconds(self, date_str):
@@ -35,6 +30,21 @@ class AdrHelper:
         
         return int(non_scientific)
     
+    def daily_rate(self, previous_time, previous_reading, current_time, current_reading):
+        """Daily rate between two readings given as epoch seconds and reading values."""
+        delta_reading = current_reading - previous_reading
+
+        # Calculate days between as integer days (matching PostgreSQL DATE - DATE)
+        current_date = time.localtime(current_time)
+        previous_date = time.localtime(previous_time)
+        delta_days = self.days_between(current_date, previous_date)
+
+        if delta_days == 0:
+            # Division by zero case - PostgreSQL NULLIF makes this NULL, COALESCE makes it 0
+            return 0
+        else:
+            return delta_reading / delta_days
+    
     def calculate_average_daily_rate(self, meter_readings):
         if len(meter_readings) < 1:  # Changed from < 2 to match PostgreSQL behavior
             print("No readings...")
@@ -51,19 +61,9 @@ class AdrHelper:
             else:
                 previous = meter_readings[i - 1]
                 current = meter_readings[i]
-                delta_reading = current["reading"] - previous["reading"]
-                
-                # Calculate days between as integer days (matching PostgreSQL DATE - DATE)
-                current_date = time.localtime(self.convert_to_epoch_seconds(current["readingOn"]))
-                previous_date = time.localtime(self.convert_to_epoch_seconds(previous["readingOn"]))
-                delta_days = self.days_between(current_date, previous_date)
-                
-                if delta_days == 0:
-                    # Division by zero case - PostgreSQL NULLIF makes this NULL, COALESCE makes it 0
-                    daily_rates.append(0)
-                else:
-                    daily_rate = delta_reading / delta_days
-                    daily_rates.append(daily_rate)
+                daily_rates.append(self.daily_rate(
+                    self.convert_to_epoch_seconds(previous["readingOn"]), previous["reading"],
+                    self.convert_to_epoch_seconds(current["readingOn"]), current["reading"]))
         
         # Calculate average of all daily rates (including zeros)
         if len(daily_rates) == 0:
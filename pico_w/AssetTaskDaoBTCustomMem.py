@@ -36,19 +36,21 @@ class AssetTaskDaoBT:
         return savedAssetTask
 
     async def GetAllAssetTasks(self):
-        db = self.db
         result = []
         
-        for key in self.assetTaskDb:
-            assetTask = self.assetTaskDb[key]            
-            result.append(json.loads(assetTask))
+        for assetTask in self.IterAllAssetTasks():
+            result.append(assetTask)
             
         return result
 
+    def IterAllAssetTasks(self, offset=0, limit=None):
+        # One at a time in id order, for callers that stream the result
+        return self.db.iter_values(offset=offset, limit=limit)
+
     async def GetTasksForAsset(self, assetId):
         db = self.db
         filter_func = lambda task: str(task["assetId"]) == str(assetId)
-        tasks = db.traverse_func(filter_func)
+        tasks = list(db.iter_values(filter_func))
         
         return tasks
     
@@ -84,9 +86,12 @@ class AssetTaskDaoBT:
     async def GetTaskCountForAsset(self, assetId):
         db = self.db
         filter_func = lambda task: str(task["assetId"]) == str(assetId)
-        tasks = db.traverse_func(filter_func)
+        count = 0
+
+        for task in db.iter_values(filter_func):
+            count += 1
         
-        return len(tasks)
+        return count
 
     async def GetTaskIdsForAsset(self, assetId):
         taskCount = await self.GetTaskCountForAsset(assetId)
@@ -28,15 +28,17 @@ class MeterDaoBT:
         return savedMeter
 
     async def GetAllMeters(self):
-        db = self.db
         result = []
         
-        for key in db:
-            meter = db.get_value(key)
-            result.append(json.loads(meter))
+        for meter in self.IterAllMeters():
+            result.append(meter)
             
         return result
 
+    def IterAllMeters(self, offset=0, limit=None):
+        # One at a time in id order, for callers that stream the result
+        return self.db.iter_values(offset=offset, limit=limit)
+
     async def GetMeterCount(self):
         db = self.db
         return db.count_all()
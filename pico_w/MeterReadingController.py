@@ -72,7 +72,8 @@ class MeterReadingController:
                             "ClientId": savedMeterReading["clientId"],                                                                        
                             "EntityType":"MeterReading",
                             "Operation":"Update",                        
-                            "Entity" : json.dumps(result)                                                        
+                            "Entity" : json.dumps(result),
+                            "entityId": id
                           }
 
             
@@ -100,6 +101,13 @@ class MeterReadingController:
         result = await self.meterReadingDao.GetAllMeterReadings()
         return result
 
+    def IterAllMeterReadings(self, offset=0, limit=None):
+        return self.meterReadingDao.IterAllMeterReadings(offset, limit)
+
+    async def GetMeterReadingsInWindow(self, startNs, endNs):
+        result = await self.meterReadingDao.GetMeterReadingsInWindow(startNs, endNs)
+        return result
+
     async def GetReadingsForMeter(self, meterId):
         result = await self.meterReadingDao.GetReadingsForMeter(meterId)
         return result
@@ -94,6 +94,9 @@ class ToDoController:
         result = await self.todoDao.GetAllItems()            
         return result
 
+    def IterAllItems(self, offset=0, limit=None):
+        return self.todoDao.IterAllItems(offset, limit)
+
     async def DeleteAllItems(self):
         result = await self.todoDao.DeleteAllItems()
         return result
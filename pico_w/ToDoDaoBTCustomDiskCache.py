@@ -30,15 +30,17 @@ class ToDoDaoBT:
         return savedItem
 
     async def GetAllItems(self):
-        db = self.db
         result = []
         
-        for key in db:
-            item = db[key]            
-            result.append(json.loads(item))
+        for item in self.IterAllItems():
+            result.append(item)
             
         return result
 
+    def IterAllItems(self, offset=0, limit=None):
+        # One at a time in id order, for callers that stream the result
+        return self.db.iter_values(offset=offset, limit=limit)
+
     async def GetItemCount(self):
         db = self.db
         return db.count_all()
@@ -60,6 +62,16 @@ class ToDoDaoBT:
         result = "All Items deleted..."            
         return result                    
 
+    async def ImportItems(self, items):
+        db = self.db
+        db.delete_all()
+
+        # The hybrid tree has no bulk loader, so items are inserted in key order
+        for item in sorted(items, key=lambda item: item["id"]):
+            db.insert((item["id"], item))
+        
+        return db.count_all()
+
     def printDb(self, db):
         print("db content...")
         for key in db:
@@ -0,0 +1,195 @@
+import uos
+import ujson as json
+import uhashlib as hashlib
+from ubinascii import hexlify
+from collections import OrderedDict
+from nanoweb import FILE_BUFFER_SIZE, HttpError, give_buffer, send_file, take_buffer
+
+CONTENT_TYPES = {
+    'html': 'text/html',
+    'css': 'text/css',
+    'js': 'application/javascript',
+    'json': 'application/json',
+    'png': 'image/png',
+    'ico': 'image/x-icon',
+    'svg': 'image/svg+xml'
+}
+
+class AssetCache:
+    """
+    Static files served with ETags, precompressed variants and a small RAM
+    cache.
+
+    The ETag of a file is a hash of its content, kept with the size and
+    mtime it was computed for and persisted to `etag_file`, so a file is
+    only hashed again once it changes. Responses say no-cache, so browsers
+    revalidate with If-None-Match and get a bodiless 304 while the asset is
+    unchanged. A client accepting gzip gets the file's .gz sibling when
+    there is one. Files up to `max_item` bytes are kept in an LRU bounded
+    to `max_bytes`; larger ones stream from flash.
+    """
+    def __init__(self, etag_file=None, max_bytes=8192, max_item=2048, buffer_size=FILE_BUFFER_SIZE):
+        self.etag_file = etag_file
+        self.max_bytes = max_bytes
+        self.max_item = max_item
+        self.buffer_size = buffer_size
+        self.etags = {}
+        self.cache = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+        if etag_file is not None:
+            try:
+                with open(etag_file, 'r') as f:
+                    self.etags = json.load(f)
+            except (OSError, ValueError):
+                self.etags = {}
+
+    def content_type(self, path):
+        return CONTENT_TYPES.get(path.rsplit('.', 1)[-1], 'application/octet-stream')
+
+    def etag(self, path, stat):
+        size = stat[6]
+        mtime = stat[8]
+        entry = self.etags.get(path)
+
+        if entry is not None and entry[0] == size and entry[1] == mtime:
+            return entry[2]
+
+        digest = hashlib.sha256()
+        buf = take_buffer(self.buffer_size)
+        view = memoryview(buf)
+
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    n = f.readinto(buf)
+
+                    if not n:
+                        break
+
+                    digest.update(view[:n])
+        finally:
+            give_buffer(buf)
+
+        etag = '"%s"' % hexlify(digest.digest()[:8]).decode()
+        self.etags[path] = [size, mtime, etag]
+        self._save()
+        return etag
+
+    def _save(self):
+        if self.etag_file is None:
+            return
+
+        try:
+            with open(self.etag_file, 'w') as f:
+                json.dump(self.etags, f)
+        except OSError:
+            pass
+
+    def _stat(self, path):
+        try:
+            return uos.stat(path)
+        except OSError:
+            return None
+
+    async def send(self, request, path):
+        """Writes the whole response for the asset at `path`."""
+        variant = path
+        encoding = None
+        stat = None
+
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            stat = self._stat(path + '.gz')
+
+            if stat is not None:
+                variant = path + '.gz'
+                encoding = 'gzip'
+
+        if stat is None:
+            stat = self._stat(path)
+
+            if stat is None:
+                raise HttpError(request, 404, "File Not Found")
+
+        size = stat[6]
+        etag = self.etag(variant, stat)
+
+        if self._matches(request.headers.get('If-None-Match'), etag):
+            self.not_modified += 1
+            await request.write("HTTP/1.1 304 Not Modified\r\n")
+            await request.write("ETag: %s\r\n" % etag)
+            # No body follows a 304; the length is that of the 200
+            await request.write("Content-Length: %d\r\n\r\n" % size)
+            return
+
+        await request.write("HTTP/1.1 200 OK\r\n")
+        await request.write("Content-Type: %s\r\n" % self.content_type(path))
+        await request.write("ETag: %s\r\n" % etag)
+        await request.write("Cache-Control: no-cache\r\n")
+        await request.write("Vary: Accept-Encoding\r\n")
+
+        if encoding is not None:
+            await request.write("Content-Encoding: %s\r\n" % encoding)
+
+        await request.write("Content-Length: %d\r\n\r\n" % size)
+        await self._send_body(request, variant, etag, size)
+
+    def _matches(self, if_none_match, etag):
+        if not if_none_match:
+            return False
+
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+
+            if tag == '*' or tag == etag or tag == 'W/' + etag:
+                return True
+
+        return False
+
+    async def _send_body(self, request, path, etag, size):
+        entry = self.cache.pop(path, None)
+
+        if entry is not None and entry[0] == etag:
+            self.hits += 1
+            self.cache[path] = entry
+            await request.write(entry[1])
+            return
+
+        if entry is not None:
+            self.bytes -= len(entry[1])
+
+        self.misses += 1
+
+        if size > self.max_item:
+            await send_file(request, path, self.buffer_size)
+            return
+
+        with open(path, 'rb') as f:
+            body = f.read()
+
+        self.cache[path] = (etag, body)
+        self.bytes += len(body)
+
+        while self.bytes > self.max_bytes:
+            for key in self.cache:
+                break
+
+            self.bytes -= len(self.cache.pop(key)[1])
+
+        await request.write(body)
+
+    def clear(self):
+        self.cache = OrderedDict()
+        self.bytes = 0
+
+    def stats(self):
+        return {
+            'assets': len(self.cache),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified
+        }
@@ -1,5 +1,11 @@
 import os
 import ujson as json
+from paged_storage import PagedFile, PAGE_SIZE
+from node_cache import CachedNodeManager
+from wal import WriteAheadLog, LoggedNodeManager, WAL_CACHE_SIZE
+from node_search import bisect_left, bisect_right, kv_bisect_left, kv_find
+from bulk_loader import BulkLoader
+from bloom_filter import BloomFilter, BLOOM_HASHES
 
 class NodeManager:
     """
@@ -29,20 +35,18 @@ class NodeManager:
         with open(self.meta_path, 'w') as f:
             json.dump(self.meta, f)
 
-    def get_node(self, node_id):
-        node_path = f"{self.directory}/{node_id}.node"
-        with open(node_path, 'r') as f:
-            data = json.load(f)
-        
+    def _node_from_data(self, data):
         node = BPlusTreeNode(self, is_leaf=data['is_leaf'], node_id=data['node_id'])
         node.keys = data['keys']
         node.child_ids = data.get('child_ids', [])
+        # None for an internal node saved before subtree counts were kept;
+        # the tree rebuilds them when it is opened
+        node.counts = data.get('counts', [] if node.is_leaf else None)
         node.next_leaf_id = data.get('next_leaf_id')
         node.parent_id = data.get('parent_id') # Needed for deletion
         return node
 
-    def save_node(self, node):
-        node_path = f"{self.directory}/{node.node_id}.node"
+    def _node_to_data(self, node):
         data = {
             'node_id': node.node_id, 
             'is_leaf': node.is_leaf, 
@@ -51,11 +55,22 @@ class NodeManager:
         }
         if not node.is_leaf:
             data['child_ids'] = node.child_ids
+            data['counts'] = node.counts
         else:
             data['next_leaf_id'] = node.next_leaf_id
+        return data
+
+    def get_node(self, node_id):
+        node_path = f"{self.directory}/{node_id}.node"
+        with open(node_path, 'r') as f:
+            data = json.load(f)
+        
+        return self._node_from_data(data)
 
+    def save_node(self, node):
+        node_path = f"{self.directory}/{node.node_id}.node"
         with open(node_path, 'w') as f:
-            json.dump(data, f)
+            json.dump(self._node_to_data(node), f)
 
     def delete_node(self, node_id):
         node_path = f"{self.directory}/{node_id}.node"
@@ -64,10 +79,11 @@ class NodeManager:
         except OSError:
             pass
 
-    def get_new_node_id(self):
+    def get_new_node_id(self, save_meta=True):
         node_id = self.meta['next_node_id']
         self.meta['next_node_id'] += 1
-        self._save_meta()
+        if save_meta:
+            self._save_meta()
         return node_id
 
     def set_root_id(self, node_id):
@@ -83,6 +99,14 @@ class NodeManager:
 
     def get_first_leaf_id(self):
         return self.meta.get('first_leaf_id')
+
+    def get_meta(self, name):
+        return self.meta.get(name)
+
+    def set_meta(self, name, value, save_meta=True):
+        self.meta[name] = value
+        if save_meta:
+            self._save_meta()
         
     def delete_all(self):
         for filename in os.listdir(self.directory):
@@ -93,6 +117,62 @@ class NodeManager:
         self.meta = {'root_id': None, 'next_node_id': 0, 'first_leaf_id': None}
         self._save_meta()
 
+class PagedNodeManager(NodeManager):
+    """
+    Stores all B+ Tree nodes in one pre-allocated page file.
+
+    Node ids are page numbers inside the file and the meta (root id, first
+    leaf id, free list) is kept in the header page, so reading or writing a
+    node is a seek into an already open file.
+    """
+    def __init__(self, directory, dataFile, page_size=PAGE_SIZE):
+        self.directory = directory
+        self.meta_path = f"{directory}/{dataFile.split('.')[0]}.pages"
+
+        try:
+            os.listdir(self.directory)
+        except OSError:
+            os.mkdir(self.directory)
+        self.pages = PagedFile(self.meta_path, page_size)
+        self.meta = self._load_meta()
+
+    def _load_meta(self):
+        root_id = self.pages.root_id
+        first_leaf_id = self.pages.first_leaf_id
+        return {
+            'root_id': None if root_id < 0 else root_id,
+            'next_node_id': self.pages.next_page,
+            'first_leaf_id': None if first_leaf_id < 0 else first_leaf_id
+        }
+
+    def _save_meta(self):
+        root_id = self.meta['root_id']
+        first_leaf_id = self.meta['first_leaf_id']
+        self.pages.root_id = -1 if root_id is None else root_id
+        self.pages.first_leaf_id = -1 if first_leaf_id is None else first_leaf_id
+        self.pages.save_header()
+
+    def get_node(self, node_id):
+        return self._node_from_data(json.loads(self.pages.read_record(node_id)))
+
+    def save_node(self, node):
+        self.pages.write_record(node.node_id, json.dumps(self._node_to_data(node)).encode())
+
+    def delete_node(self, node_id):
+        self.pages.free_chain(node_id)
+        self.pages.save_header()
+
+    def get_new_node_id(self, save_meta=True):
+        node_id = self.pages.alloc_page()
+        self.meta['next_node_id'] = self.pages.next_page
+        if save_meta:
+            self._save_meta()
+        return node_id
+
+    def delete_all(self):
+        self.pages.reset()
+        self.meta = self._load_meta()
+
 class BPlusTreeNode:
     """
     Represents a single node in the B+ Tree.
@@ -102,12 +182,17 @@ class BPlusTreeNode:
         self.is_leaf = is_leaf
         self.keys = []
         self.child_ids = []
+        self.counts = []  # Entries under each child of an internal node
         self.next_leaf_id = None
         self.parent_id = None
         self.node_id = node_id if node_id is not None else self.manager.get_new_node_id()
     
     def save(self):
         self.manager.save_node(self)
+
+    def size(self):
+        """Returns the number of records in this node's subtree."""
+        return len(self.keys) if self.is_leaf else sum(self.counts)
     
     def get_child(self, index):
         child_node = self.manager.get_node(self.child_ids[index])
@@ -123,9 +208,97 @@ class BPlusTree:
     """
     An implementation of a B+ Tree that persists data to disk.
     """
-    def __init__(self, t, directory='./bplustree_data', dataFile='metadata.json'):
+    def __init__(self, t, directory='./bplustree_data', dataFile='metadata.json', paged=False,
+                 cache_size=0, cache_bytes=None, wal=False, wal_group_size=16, wal_group_ms=50,
+                 checkpoint_nodes=64, bloom_bits=0, bloom_hashes=BLOOM_HASHES):
         self.t = t
-        self.manager = NodeManager(directory, dataFile)
+        # Bumped by every change to the tree's shape, so range() can tell it must resume
+        self.version = 0
+
+        if paged:
+            self.manager = PagedNodeManager(directory, dataFile)
+        else:
+            self.manager = NodeManager(directory, dataFile)
+
+        # Optional LRU node cache; cache_size bounds the node count and
+        # cache_bytes the estimated serialized size of the cached nodes.
+        self.cache = None
+
+        # Optional write-ahead log next to the directory. Changes are logged
+        # and node writes held in the cache until a checkpoint, which starts
+        # once checkpoint_nodes nodes are dirty or on sync().
+        self.wal = None
+        self.checkpoint_nodes = checkpoint_nodes
+        records = []
+
+        if wal:
+            if paged:
+                raise ValueError("The write-ahead log needs the per-file node storage")
+
+            self.wal = WriteAheadLog(f"{directory}.wal", wal_group_size, wal_group_ms)
+            records = self.wal.recover(self.manager)
+            self.manager = LoggedNodeManager(self.manager, self.wal, cache_size or WAL_CACHE_SIZE, cache_bytes)
+            self.cache = self.manager.cache
+        elif cache_size or cache_bytes:
+            self.manager = CachedNodeManager(self.manager, cache_size or None, cache_bytes)
+            self.cache = self.manager.cache
+
+        self._init_root()
+
+        # Optional Bloom filter over the keys, so lookups of missing keys
+        # skip the tree. It is saved with the meta by sync() and rebuilt
+        # from the leaves on mount when the saved one is out of date.
+        self.bloom = None
+        self.bloom_saved = False
+
+        if bloom_bits:
+            self.bloom = BloomFilter(bloom_bits, bloom_hashes)
+            self._load_bloom()
+
+        if self.wal is not None:
+            self.wal.replay(self, records)
+            self.sync()
+
+    def _log(self, record):
+        if self.wal is not None:
+            self.wal.append(record)
+
+    def _logged(self):
+        # Checkpoints run between operations, when the tree is consistent
+        if self.wal is not None and self.manager.dirty_count() >= self.checkpoint_nodes:
+            self.sync()
+
+    def _load_bloom(self):
+        if self.bloom.load_meta(self.manager.get_meta('bloom') or {}):
+            self.bloom_saved = True
+            return
+
+        for key, value in self.range():
+            self.bloom.add(key)
+
+        self._save_bloom()
+
+    def _save_bloom(self):
+        self.manager.set_meta('bloom', self.bloom.to_meta())
+        self.bloom_saved = True
+
+    def _bloom_add(self, key):
+        if self.bloom_saved:
+            # The saved filter lacks this key, so it can't be used on mount
+            self.manager.set_meta('bloom', None)
+            self.bloom_saved = False
+
+        self.bloom.add(key)
+
+    def _bloom_miss(self, key):
+        """True if the Bloom filter rules the key out."""
+        return self.bloom is not None and not self.bloom.might_contain(key)
+
+    def _bloom_false_positive(self):
+        if self.bloom is not None:
+            self.bloom.false_positive()
+
+    def _init_root(self):
         root_id = self.manager.get_root_id()
 
         if root_id is None:
@@ -136,18 +309,38 @@ class BPlusTree:
             self.root_id = root.node_id
         else:
             self.root_id = root_id
+            root = self._get_root()
+
+            if root.counts is None:
+                self._rebuild_counts(root)
+
+    def _rebuild_counts(self, node):
+        """Stores the subtree counts of a tree saved without them."""
+        if node.is_leaf:
+            return len(node.keys)
+
+        node.counts = [self._rebuild_counts(node.get_child(i)) for i in range(len(node.child_ids))]
+        node.save()
+        return sum(node.counts)
 
     def _get_root(self):
         return self.manager.get_node(self.root_id)
 
     def insert(self, key_value):
+        self.version += 1
         key, value = key_value
+        self._log(['i', key, value])
+
+        if self.bloom is not None:
+            self._bloom_add(key)
+
         root = self._get_root()
 
         if len(root.keys) == (2 * self.t) - 1:
             old_root = root
             new_root = BPlusTreeNode(self.manager, is_leaf=False)
             new_root.child_ids.append(old_root.node_id)
+            new_root.counts.append(old_root.size())
             old_root.parent_id = new_root.node_id
             old_root.save()
             
@@ -159,17 +352,14 @@ class BPlusTree:
         else:
             self._insert_non_full(root, key, value)
 
+        self._logged()
+
     def _insert_non_full(self, node, key, value):
         if node.is_leaf:
-            i = 0
-            while i < len(node.keys) and key > node.keys[i][0]:
-                i += 1
-            node.keys.insert(i, [key, value])
+            node.keys.insert(kv_bisect_left(node.keys, key), [key, value])
             node.save()
         else:
-            i = 0
-            while i < len(node.keys) and key >= node.keys[i]:
-                i += 1
+            i = bisect_right(node.keys, key)
             
             child = node.get_child(i)
             if len(child.keys) == (2 * self.t) - 1:
@@ -177,6 +367,8 @@ class BPlusTree:
                 if key >= node.keys[i]:
                     i += 1
             
+            node.counts[i] += 1
+            node.save()
             child_for_insert = node.get_child(i)
             self._insert_non_full(child_for_insert, key, value)
 
@@ -206,6 +398,8 @@ class BPlusTree:
             
             new_sibling.child_ids = child_to_split.child_ids[t:]
             child_to_split.child_ids = child_to_split.child_ids[:t]
+            new_sibling.counts = child_to_split.counts[t:]
+            child_to_split.counts = child_to_split.counts[:t]
             
             parent_node.keys.insert(child_index, median_key)
             parent_node.child_ids.insert(child_index + 1, new_sibling.node_id)
@@ -215,38 +409,175 @@ class BPlusTree:
                 child_node.parent_id = new_sibling.node_id
                 child_node.save()
 
+        parent_node.counts[child_index:child_index + 1] = [child_to_split.size(), new_sibling.size()]
         new_sibling.save()
         child_to_split.save()
         parent_node.save()
 
     def find(self, key):
         if self.root_id is None: return None
-        return self._search(self._get_root(), key)
+        if self._bloom_miss(key): return None
+        value = self._search(self._get_root(), key)
+        if value is None: self._bloom_false_positive()
+        return value
 
     def _search(self, node, key):
         if node.is_leaf:
-            for k, v in node.keys:
-                if k == key: return v
-            return None
+            i = kv_find(node.keys, key)
+            return node.keys[i][1] if i >= 0 else None
         else:
-            i = 0
-            while i < len(node.keys) and key >= node.keys[i]:
-                i += 1
-            child_node = node.get_child(i)
+            child_node = node.get_child(bisect_right(node.keys, key))
             return self._search(child_node, key)
 
+    def range(self, start_key=None, end_key=None, reverse=False):
+        """
+        Generator over the (key, value) entries with start_key <= key < end_key
+        in key order, or descending with reverse=True; a bound of None is
+        open. Forward scans follow the leaf chain and reverse scans step back
+        through the parents on the path from the root, loading one leaf at a
+        time, so a full scan holds one leaf instead of a list of every record.
+        If the tree is modified while the generator is in use, it carries on
+        from just past the last key it yielded.
+        """
+        after = None
+
+        while True:
+            version = self.version
+
+            for key, value in self._range(start_key, end_key, reverse):
+                if key == after:
+                    continue
+
+                yield key, value
+
+                if version != self.version:
+                    break
+            else:
+                return
+
+            # Changed meanwhile: walk down again to just past the last key
+            if reverse:
+                end_key = key
+            else:
+                start_key = after = key
+
+    def _range(self, start_key, end_key, reverse):
+        """The walk behind range(); only valid while the tree is unchanged."""
+        stack = []
+
+        if reverse:
+            node = self._get_root()
+
+            while not node.is_leaf:
+                i = len(node.keys) if end_key is None else bisect_left(node.keys, end_key)
+                stack.append([node, i])
+                node = node.get_child(i)
+        elif start_key is None:
+            first_leaf_id = self.manager.get_first_leaf_id()
+            node = None if first_leaf_id is None else self.manager.get_node(first_leaf_id)
+        else:
+            node = self._find_leaf_node(start_key)
+
+        while node is not None:
+            items = node.keys
+
+            if reverse:
+                i = len(items) if end_key is None else kv_bisect_left(items, end_key)
+
+                while i > 0:
+                    i -= 1
+                    key, value = items[i]
+                    if start_key is not None and key < start_key:
+                        return
+                    yield key, value
+            else:
+                i = 0 if start_key is None else kv_bisect_left(items, start_key)
+
+                while i < len(items):
+                    key, value = items[i]
+                    if end_key is not None and key >= end_key:
+                        return
+                    yield key, value
+                    i += 1
+
+            node = self._next_leaf(node, stack, reverse)
+
+    def seek(self, key):
+        """Generator over the entries with keys >= key, in key order."""
+        return self.range(key)
+
+    def iter_items(self, offset=0, limit=None):
+        """
+        Generator over the (key, value) entries in key order, starting at
+        position `offset` and yielding at most `limit` of them. The start is
+        found through the subtree counts instead of by skipping entries.
+        """
+        if offset >= self.count_all():
+            return
+
+        for key, value in self.range(self.select(offset)[0] if offset > 0 else None):
+            if limit is not None:
+                if limit <= 0:
+                    return
+                limit -= 1
+            yield key, value
+
+    def iter_keys(self):
+        """Generator over every key in order."""
+        for key, value in self.range():
+            yield key
+
+    def iter_values(self, filter_func=None, offset=0, limit=None):
+        """
+        Generator over the values in key order, those accepted by filter_func
+        if given. With a filter, offset and limit count the accepted values.
+        """
+        if filter_func is None:
+            for key, value in self.iter_items(offset, limit):
+                yield value
+            return
+
+        for key, value in self.range():
+            if filter_func(value):
+                if offset > 0:
+                    offset -= 1
+                    continue
+                if limit is not None:
+                    if limit <= 0:
+                        return
+                    limit -= 1
+                yield value
+
     def traverse_keys(self):
-        results = []
-        first_leaf_id = self.manager.get_first_leaf_id()
-        if first_leaf_id is None: return results
-            
-        current_node = self.manager.get_node(first_leaf_id)
-        while current_node:
-            results.extend(current_node.keys)
-            if current_node.next_leaf_id:
-                current_node = self.manager.get_node(current_node.next_leaf_id)
-            else: break
-        return results
+        return list(self.iter_items())
+
+    def traverse_func(self, filter_func):
+        return list(self.iter_values(filter_func))
+
+    def _next_leaf(self, node, stack, reverse):
+        if not reverse:
+            if node.next_leaf_id is None:
+                return None
+            return self.manager.get_node(node.next_leaf_id)
+
+        # Leaves are only linked forward, so step back through the parents
+        while stack:
+            entry = stack[-1]
+            parent, i = entry
+
+            if i > 0:
+                entry[1] = i - 1
+                node = parent.get_child(i - 1)
+
+                while not node.is_leaf:
+                    stack.append([node, len(node.child_ids) - 1])
+                    node = node.get_child(len(node.child_ids) - 1)
+
+                return node
+
+            stack.pop()
+
+        return None
 
     # --- Start of Added/Fixed Methods ---
 
@@ -254,68 +585,93 @@ class BPlusTree:
         """Helper to find the leaf node where a key should exist."""
         node = self._get_root()
         while not node.is_leaf:
-            i = 0
-            while i < len(node.keys) and key >= node.keys[i]:
-                i += 1
-            node = node.get_child(i)
+            node = node.get_child(bisect_right(node.keys, key))
         return node
         
+    def _find_leaf_path(self, key):
+        """Returns the leaf for a key and the [node, child index] pairs above it."""
+        path = []
+        node = self._get_root()
+        while not node.is_leaf:
+            i = bisect_right(node.keys, key)
+            path.append([node, i])
+            node = node.get_child(i)
+        return node, path
+        
     def count_all(self):
-        """Counts all records by traversing the leaf nodes."""
-        count = 0
-        first_leaf_id = self.manager.get_first_leaf_id()
-        if first_leaf_id is None: return 0
-            
-        node = self.manager.get_node(first_leaf_id)
-        while node:
-            count += len(node.keys)
-            if node.next_leaf_id:
-                node = self.manager.get_node(node.next_leaf_id)
-            else: break
-        return count
+        """Counts all records from the subtree counts kept in the root."""
+        if self.root_id is None: return 0
+        return self._get_root().size()
+
+    def count_range(self, start_key=None, end_key=None):
+        """Counts the records with start_key <= key < end_key; None is open."""
+        end = self.count_all() if end_key is None else self.rank(end_key)
+        start = 0 if start_key is None else self.rank(start_key)
+        return max(0, end - start)
+
+    def rank(self, key):
+        """Returns the number of records with keys below `key`."""
+        leaf_node, path = self._find_leaf_path(key)
+        rank = kv_bisect_left(leaf_node.keys, key)
+        for node, i in path:
+            rank += sum(node.counts[:i])
+        return rank
+
+    def select(self, index):
+        """Returns the [key, value] record at 0-based position `index` in key order."""
+        if index < 0 or index >= self.count_all():
+            raise IndexError("select index out of range")
+
+        node = self._get_root()
+        while not node.is_leaf:
+            i = 0
+            while index >= node.counts[i]:
+                index -= node.counts[i]
+                i += 1
+            node = node.get_child(i)
+        return node.keys[index]
 
     def update_value(self, key, new_value):
         """Finds a key in a leaf and updates its value."""
+        if self._bloom_miss(key):
+            return False
+
         leaf_node = self._find_leaf_node(key)
-        for i, (k, v) in enumerate(leaf_node.keys):
-            if k == key:
-                leaf_node.keys[i] = [key, new_value]
-                leaf_node.save()
-                return True
+        i = kv_find(leaf_node.keys, key)
+        if i >= 0:
+            self._log(['u', key, new_value])
+            leaf_node.keys[i] = [key, new_value]
+            leaf_node.save()
+            self._logged()
+            return True
+        self._bloom_false_positive()
         return False
 
-    def traverse_func(self, filter_func):
-        """Traverses leaf nodes and returns values that match the filter function."""
-        results = []
-        first_leaf_id = self.manager.get_first_leaf_id()
-        if first_leaf_id is None: return results
-            
-        node = self.manager.get_node(first_leaf_id)
-        while node:
-            for k, v in node.keys:
-                if filter_func(v):
-                    results.append(v)
-            if node.next_leaf_id:
-                node = self.manager.get_node(node.next_leaf_id)
-            else: break
-        return results
-
     def delete(self, key):
         """Deletes a key-value pair from a leaf node."""
-        leaf_node = self._find_leaf_node(key)
+        self.version += 1
+
+        if self._bloom_miss(key):
+            return
+
+        leaf_node, path = self._find_leaf_path(key)
         
         # Find and remove the key from the leaf
-        key_found = False
-        for i, (k, v) in enumerate(leaf_node.keys):
-            if k == key:
-                leaf_node.keys.pop(i)
-                key_found = True
-                break
+        i = kv_find(leaf_node.keys, key)
         
-        if not key_found:
+        if i < 0:
+            self._bloom_false_positive()
             return # Key not in tree
             
+        self._log(['d', key])
+        leaf_node.keys.pop(i)
         leaf_node.save()
+
+        for node, i in path:
+            node.counts[i] -= 1
+            node.save()
+
+        self._logged()
         
         # Note: This is a simplified delete. A full implementation would handle
         # underflow by borrowing from or merging with siblings, and updating parent keys,
@@ -323,7 +679,116 @@ class BPlusTree:
         # as long as deletion doesn't cause underflow.
 
     def delete_all(self):
+        self.version += 1
+
+        if self.wal is not None:
+            # Logged before any file is removed so replay starts from empty
+            self._log(['c'])
+            self.wal.commit()
+
         self.manager.delete_all()
         # Re-initialize the tree state after deleting all files
-        self.__init__(self.t, self.manager.directory, self.manager.meta_path.split('/')[-1])
-        print("B+ Tree data has been deleted.")
\ No newline at end of file
+        self._init_root()
+
+        if self.bloom is not None:
+            self.bloom.clear()
+            self._save_bloom()
+
+        print("B+ Tree data has been deleted.")
+
+    def bulk_load(self, sorted_items, fill_factor=1.0):
+        """
+        Replaces the tree contents with `sorted_items`, (key, value) pairs in
+        ascending key order. Leaves are built and linked left to right, then
+        the internal levels above them; every node is written once. With
+        the log the items are logged after a delete-all and the nodes written
+        directly, so an interrupted load is replayed from the log.
+        """
+        self.version += 1
+
+        if self.wal is not None:
+            self._log(['c'])
+            self.wal.commit()
+            self.manager.direct = True
+
+        self.manager.delete_all()
+
+        if self.bloom is not None:
+            self.bloom.clear()
+
+        self._bulk_leaf = None
+        loader = BulkLoader(self.t, fill_factor, self._bulk_node)
+
+        for key, value in sorted_items:
+            self._log(['i', key, value])
+            loader.add([key, value])
+
+            if self.bloom is not None:
+                self.bloom.add(key)
+
+        root_id = loader.finish()
+
+        if self._bulk_leaf is not None:
+            self._bulk_leaf.save()
+            self._bulk_leaf = None
+
+        if root_id is None:
+            self._init_root()
+        else:
+            self.root_id = root_id
+            self.manager.set_root_id(root_id)
+
+        if self.bloom is not None:
+            self._save_bloom()
+
+        if self.wal is not None:
+            self.manager.direct = False
+            self.manager.sync()
+
+    def _bulk_node(self, is_leaf, entries):
+        node_id = self.manager.get_new_node_id(save_meta=False)
+        node = BPlusTreeNode(self.manager, is_leaf=is_leaf, node_id=node_id)
+
+        if is_leaf:
+            node.keys = entries
+
+            # A leaf is written once the id of the leaf after it is known
+            if self._bulk_leaf is None:
+                self.manager.set_first_leaf_id(node_id)
+            else:
+                self._bulk_leaf.next_leaf_id = node_id
+                self._bulk_leaf.save()
+
+            self._bulk_leaf = node
+        else:
+            node.keys = [entry[0] for entry in entries[1:]]
+            node.child_ids = [entry[2] for entry in entries]
+            node.counts = [entry[3] for entry in entries]
+            node.save()
+
+        return node_id
+
+    def sync(self):
+        """
+        Writes back any nodes held dirty in the node cache (a checkpoint with
+        the log) and saves the Bloom filter with the meta.
+        """
+        if self.bloom is not None and not self.bloom_saved:
+            self._save_bloom()
+
+        if self.cache is not None:
+            self.manager.sync()
+
+    def stats(self):
+        stats = {}
+
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+
+        if self.wal is not None:
+            stats['wal'] = self.wal.stats()
+
+        if self.bloom is not None:
+            stats['bloom'] = self.bloom.stats()
+
+        return stats
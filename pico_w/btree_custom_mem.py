@@ -1,3 +1,6 @@
+from node_search import bisect_left, kv_bisect_left, kv_find, kv_insort
+from bulk_loader import BulkLoader
+
 class BTreeNode:
     def __init__(self, is_leaf = False, name = 'root'):
         self.name = name
@@ -7,63 +10,41 @@ class BTreeNode:
         else:
             self.keys = []  # For internal nodes: [key1, key2, ...] (routing keys only)
         self.children = []
+        self.counts = []  # For internal nodes: entries under each child
 
-    def traverse_func(self, filter_func, results):
-        if self.is_leaf:
-            # Only leaf nodes contain actual data to filter
-            for key_value in self.keys:
-                if filter_func(key_value[1]):
-                    results.append(key_value[1])
-        else:
-            # Internal nodes: traverse children
-            for i in range(len(self.children)):
-                self.children[i].traverse_func(filter_func, results)
-
-    def traverse_keys(self, results):
-        if self.is_leaf:
-            # Only leaf nodes contain actual data
-            for key_value in self.keys:
-                results.append(key_value)
-        else:
-            # Internal nodes: traverse children
-            for child in self.children:
-                child.traverse_keys(results)
+    def size(self):
+        """Number of (key, value) entries in this subtree."""
+        return len(self.keys) if self.is_leaf else sum(self.counts)
 
 class BTree:
     def __init__(self, t):
         self.root = BTreeNode(True)
         self.t = t
+        # Bumped by every change to the tree's shape, so range() can tell it must resume
+        self.version = 0
 
     def insert(self, key):
+        self.version += 1
         root = self.root
 
         if len(root.keys) == (2 * self.t) - 1:
             temp = BTreeNode()
             self.root = temp
             temp.children.insert(0, root)
+            temp.counts.insert(0, root.size())
             self.split_child(temp, 0)
             self.insert_non_full(temp, key)
         else:
             self.insert_non_full(root, key)
 
     def insert_non_full(self, node, key):
-        index = len(node.keys) - 1
-        
         if node.is_leaf:
             # Leaf node: insert the (key, value) tuple
-            node.keys.append((None, None))
-            
-            while index >= 0 and key[0] < node.keys[index][0]:
-                node.keys[index + 1] = node.keys[index]
-                index -= 1
-                
-            node.keys[index + 1] = key
+            kv_insort(node.keys, key)
         else:
-            # Internal node: find correct child and insert routing key only
-            while index >= 0 and key[0] < node.keys[index]:
-                index -= 1
-                
-            index += 1
+            # Internal node: a routing key is the largest key of its left
+            # subtree, so keys equal to it route left as in search()
+            index = bisect_left(node.keys, key[0])
 
             if len(node.children[index].keys) == (2 * self.t) - 1:
                 self.split_child(node, index)
@@ -71,6 +52,7 @@ class BTree:
                 if key[0] > node.keys[index]:
                     index += 1
                     
+            node.counts[index] += 1
             self.insert_non_full(node.children[index], key)
 
     def split_child(self, node, index):
@@ -95,6 +77,10 @@ class BTree:
             # Move children
             z.children = y.children[t: 2 * t]
             y.children = y.children[0: t]
+            z.counts = y.counts[t: 2 * t]
+            y.counts = y.counts[0: t]
+
+        node.counts[index:index + 1] = [y.size(), z.size()]
 
     def print_tree(self, x, l=0):
         print("Level ", l, " ", len(x.keys), end=": ")
@@ -119,17 +105,11 @@ class BTree:
     def search(self, node, key):
         if node.is_leaf:
             # Leaf node: search for actual data
-            for key_value in node.keys:
-                if key_value[0] == key:
-                    return key_value[1]
-            return None
+            index = kv_find(node.keys, key)
+            return node.keys[index][1] if index >= 0 else None
         else:
             # Internal node: use routing keys to find correct child
-            index = 0
-            while index < len(node.keys) and key > node.keys[index]:
-                index += 1
-            
-            child = node.children[index]
+            child = node.children[bisect_left(node.keys, key)]
             return self.search(child, key)
 
     def find(self, key):
@@ -137,6 +117,8 @@ class BTree:
 
     def delete(self, key):
         """Public method to delete a key from the B-tree"""
+        self.version += 1
+
         if self.root is None:
             return False
             
@@ -156,27 +138,29 @@ class BTree:
         
         if node.is_leaf:
             # Leaf node: remove the actual data
-            for i, key_value in enumerate(node.keys):
-                if key_value[0] == search_key:
-                    node.keys.pop(i)
-                    return True
-            return False  # Key not found
+            i = kv_find(node.keys, search_key)
+
+            if i < 0:
+                return False  # Key not found
+
+            node.keys.pop(i)
+            return True
         else:
             # Internal node: find which child should contain the key
-            i = 0
-            while i < len(node.keys) and search_key > node.keys[i]:
-                i += 1
+            i = bisect_left(node.keys, search_key)
 
             # Ensure child has enough keys before descending
             if len(node.children[i].keys) < t:
                 self.fill(node, i)
                 
                 # After filling, recalculate index as structure may have changed
-                i = 0
-                while i < len(node.keys) and search_key > node.keys[i]:
-                    i += 1
+                i = bisect_left(node.keys, search_key)
                 
-            return self._delete(node.children[i], key)
+            if self._delete(node.children[i], key):
+                node.counts[i] -= 1
+                return True
+
+            return False
 
     def fill(self, node, idx):
         t = self.t
@@ -225,9 +209,11 @@ class BTree:
             child.keys.append(node.keys[idx])
             child.keys.extend(sibling.keys)
             child.children.extend(sibling.children)
+            child.counts.extend(sibling.counts)
             
         node.keys.pop(idx)
         node.children.pop(idx + 1)
+        node.counts[idx] += node.counts.pop(idx + 1)
 
 
 
@@ -239,15 +225,20 @@ class BTree:
             # Borrowing between leaf nodes
             borrowed_item = sibling.keys.pop()
             child.keys.insert(0, borrowed_item)
-            # Update parent's routing key to reflect the new minimum in child
-            node.keys[idx - 1] = child.keys[0][0]
+            # Routing key is the new largest key of the left sibling
+            node.keys[idx - 1] = sibling.keys[-1][0]
+            moved = 1
         else:
             # Borrowing between internal nodes
             child.keys.insert(0, node.keys[idx - 1])
-            if sibling.children:
-                child.children.insert(0, sibling.children.pop())
+            child.children.insert(0, sibling.children.pop())
+            moved = sibling.counts.pop()
+            child.counts.insert(0, moved)
             node.keys[idx - 1] = sibling.keys.pop()
 
+        node.counts[idx - 1] -= moved
+        node.counts[idx] += moved
+
     def borrow_from_next(self, node, idx):
         child = node.children[idx]
         sibling = node.children[idx + 1]
@@ -256,26 +247,160 @@ class BTree:
             # Borrowing between leaf nodes
             borrowed_item = sibling.keys.pop(0)
             child.keys.append(borrowed_item)
-            # Update parent's routing key to reflect the new minimum in sibling
-            node.keys[idx] = sibling.keys[0][0] if sibling.keys else borrowed_item[0]
+            # Routing key is the new largest key of the child
+            node.keys[idx] = borrowed_item[0]
+            moved = 1
         else:
             # Borrowing between internal nodes
             child.keys.append(node.keys[idx])
-            if sibling.children:
-                child.children.append(sibling.children.pop(0))
+            child.children.append(sibling.children.pop(0))
+            moved = sibling.counts.pop(0)
+            child.counts.append(moved)
             node.keys[idx] = sibling.keys.pop(0)
 
-    def traverse_func(self, filter_func):
-        results = []
-        if self.root:
-            self.root.traverse_func(filter_func, results)
-        return results
+        node.counts[idx] += moved
+        node.counts[idx + 1] -= moved
+
+    def range(self, start_key=None, end_key=None, reverse=False):
+        """
+        Generator over the (key, value) entries with start_key <= key < end_key
+        in key order, or descending with reverse=True; a bound of None is
+        open. Leaves are visited one at a time instead of collecting every
+        record in a list. If the tree is modified while the generator is in
+        use, it carries on from just past the last key it yielded.
+        """
+        after = None
+
+        while True:
+            version = self.version
+
+            for key, value in self._range(start_key, end_key, reverse):
+                if key == after:
+                    continue
+
+                yield key, value
+
+                if version != self.version:
+                    break
+            else:
+                return
+
+            # Changed meanwhile: walk down again to just past the last key
+            if reverse:
+                end_key = key
+            else:
+                start_key = after = key
+
+    def _range(self, start_key, end_key, reverse):
+        """The walk behind range(); only valid while the tree is unchanged."""
+        stack = []
+        node = self.root
+
+        while not node.is_leaf:
+            if reverse:
+                i = len(node.keys) if end_key is None else bisect_left(node.keys, end_key)
+            else:
+                i = 0 if start_key is None else bisect_left(node.keys, start_key)
+            stack.append([node, i])
+            node = node.children[i]
+
+        while node is not None:
+            items = node.keys
+
+            if reverse:
+                i = len(items) if end_key is None else kv_bisect_left(items, end_key)
+
+                while i > 0:
+                    i -= 1
+                    key, value = items[i]
+                    if start_key is not None and key < start_key:
+                        return
+                    yield key, value
+            else:
+                i = 0 if start_key is None else kv_bisect_left(items, start_key)
+
+                while i < len(items):
+                    key, value = items[i]
+                    if end_key is not None and key >= end_key:
+                        return
+                    yield key, value
+                    i += 1
+
+            node = self._next_leaf(stack, reverse)
+
+    def seek(self, key):
+        """Generator over the entries with keys >= key, in key order."""
+        return self.range(key)
+
+    def iter_items(self, offset=0, limit=None):
+        """
+        Generator over the (key, value) entries in key order, starting at
+        position `offset` and yielding at most `limit` of them. The start is
+        found through the subtree counts instead of by skipping entries.
+        """
+        if offset >= self.count_all():
+            return
+
+        for key, value in self.range(self.select(offset)[0] if offset > 0 else None):
+            if limit is not None:
+                if limit <= 0:
+                    return
+                limit -= 1
+            yield key, value
+
+    def iter_keys(self):
+        """Generator over every key in order."""
+        for key, value in self.range():
+            yield key
+
+    def iter_values(self, filter_func=None, offset=0, limit=None):
+        """
+        Generator over the values in key order, those accepted by filter_func
+        if given. With a filter, offset and limit count the accepted values.
+        """
+        if filter_func is None:
+            for key, value in self.iter_items(offset, limit):
+                yield value
+            return
+
+        for key, value in self.range():
+            if filter_func(value):
+                if offset > 0:
+                    offset -= 1
+                    continue
+                if limit is not None:
+                    if limit <= 0:
+                        return
+                    limit -= 1
+                yield value
 
     def traverse_keys(self):
-        results = []
-        if self.root:
-            self.root.traverse_keys(results)
-        return results
+        return list(self.iter_items())
+
+    def traverse_func(self, filter_func):
+        return list(self.iter_values(filter_func))
+
+    def _next_leaf(self, stack, reverse):
+        """Moves the root-to-leaf path in `stack` on to the neighbouring leaf."""
+        while stack:
+            entry = stack[-1]
+            parent, i = entry
+            i = i - 1 if reverse else i + 1
+
+            if 0 <= i < len(parent.children):
+                entry[1] = i
+                node = parent.children[i]
+
+                while not node.is_leaf:
+                    i = len(node.children) - 1 if reverse else 0
+                    stack.append([node, i])
+                    node = node.children[i]
+
+                return node
+
+            stack.pop()
+
+        return None
     
     def update_value(self, key, new_value):
         node, index = self._find_node_and_index(self.root, key)
@@ -289,30 +414,80 @@ class BTree:
     def _find_node_and_index(self, node, key):
         if node.is_leaf:
             # Leaf node: search for actual data
-            for i, key_value in enumerate(node.keys):
-                if key_value[0] == key:
-                    return node, i
-            return None, None
+            i = kv_find(node.keys, key)
+            return (node, i) if i >= 0 else (None, None)
         else:
             # Internal node: use routing keys to find correct child
-            index = 0
-            while index < len(node.keys) and key > node.keys[index]:
-                index += 1
-            
-            child = node.children[index]
+            child = node.children[bisect_left(node.keys, key)]
             return self._find_node_and_index(child, key)
         
     def count_all(self):
-        return self._count_all(self.root)
+        # Internal nodes keep the entry count of each child
+        return self.root.size()
 
-    def _count_all(self, node):
-        if node.is_leaf:
-            return len(node.keys)  # Count actual data entries
-        else:
-            count = 0
-            for child in node.children:
-                count += self._count_all(child)
-            return count
+    def count_range(self, start_key=None, end_key=None):
+        """Number of entries with start_key <= key < end_key; None is open."""
+        end = self.count_all() if end_key is None else self.rank(end_key)
+        start = 0 if start_key is None else self.rank(start_key)
+        return max(0, end - start)
+
+    def rank(self, key):
+        """Number of entries with keys below `key`."""
+        node = self.root
+        rank = 0
+
+        while not node.is_leaf:
+            i = bisect_left(node.keys, key)
+            rank += sum(node.counts[:i])
+            node = node.children[i]
+
+        return rank + kv_bisect_left(node.keys, key)
+
+    def select(self, index):
+        """Returns the (key, value) entry at 0-based position `index` in key order."""
+        if index < 0 or index >= self.count_all():
+            raise IndexError("select index out of range")
+
+        node = self.root
+
+        while not node.is_leaf:
+            i = 0
+
+            while index >= node.counts[i]:
+                index -= node.counts[i]
+                i += 1
+
+            node = node.children[i]
+
+        return node.keys[index]
 
     def delete_all(self):
-        self.root = BTreeNode(True)
\ No newline at end of file
+        self.version += 1
+        self.root = BTreeNode(True)
+
+    def bulk_load(self, sorted_items, fill_factor=1.0):
+        """
+        Replaces the tree contents with `sorted_items`, (key, value) tuples in
+        ascending key order, building the tree bottom-up in one pass.
+        """
+        self.version += 1
+        loader = BulkLoader(self.t, fill_factor, self._bulk_node)
+
+        for item in sorted_items:
+            loader.add(item)
+
+        root = loader.finish()
+        self.root = root if root is not None else BTreeNode(True)
+
+    def _bulk_node(self, is_leaf, entries):
+        node = BTreeNode(is_leaf)
+
+        if is_leaf:
+            node.keys = entries
+        else:
+            # Routing keys are the largest key of each left subtree
+            node.keys = [entry[1] for entry in entries[:-1]]
+            node.children = [entry[2] for entry in entries]
+            node.counts = [entry[3] for entry in entries]
+
+        return node
\ No newline at end of file
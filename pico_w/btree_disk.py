@@ -1,5 +1,11 @@
 import os
 import ujson as json
+from paged_storage import PagedFile, PAGE_SIZE
+from node_cache import CachedNodeManager
+from wal import WriteAheadLog, LoggedNodeManager, WAL_CACHE_SIZE
+from node_search import bisect_left, bisect_right, kv_bisect_left, kv_find, kv_insort
+from bulk_loader import BulkLoader
+from bloom_filter import BloomFilter, BLOOM_HASHES
 
 class NodeManager:
     def __init__(self, directory, dataFile):
@@ -24,21 +30,30 @@ class NodeManager:
         with open(self.meta_path, 'w') as f:
             json.dump(self.meta, f)
 
+    def _node_from_data(self, data):
+        node = BTreeNode(self, is_leaf=data['is_leaf'], node_id=data['node_id'])
+        node.keys = data['keys']
+        node.child_ids = data['child_ids']
+        # Trees written before subtree counts were kept have none; the
+        # BTree rebuilds them when it is opened
+        node.counts = data.get('counts')
+        return node
+
+    def _node_to_data(self, node):
+        return {'node_id': node.node_id, 'is_leaf': node.is_leaf, 'keys': node.keys, 'child_ids': node.child_ids,
+                'counts': node.counts}
+
     def get_node(self, node_id):
         node_path = f"{self.directory}/{node_id}.node"
         with open(node_path, 'r') as f:
             data = json.load(f)
         
-        node = BTreeNode(self, is_leaf=data['is_leaf'], node_id=data['node_id'])
-        node.keys = data['keys']
-        node.child_ids = data['child_ids']
-        return node
+        return self._node_from_data(data)
 
     def save_node(self, node):
         node_path = f"{self.directory}/{node.node_id}.node"
-        data = {'node_id': node.node_id, 'is_leaf': node.is_leaf, 'keys': node.keys, 'child_ids': node.child_ids}
         with open(node_path, 'w') as f:
-            json.dump(data, f)
+            json.dump(self._node_to_data(node), f)
 
     def delete_node(self, node_id):
         """Removes a node file from the disk."""
@@ -48,10 +63,11 @@ class NodeManager:
         except OSError:
             pass # Ignore if file doesn't exist
 
-    def get_new_node_id(self):
+    def get_new_node_id(self, save_meta=True):
         node_id = self.meta['next_node_id']
         self.meta['next_node_id'] += 1
-        self._save_meta()
+        if save_meta:
+            self._save_meta()
         return node_id
 
     def set_root_id(self, node_id):
@@ -61,6 +77,14 @@ class NodeManager:
     def get_root_id(self):
         return self.meta['root_id']
 
+    def get_meta(self, name):
+        return self.meta.get(name)
+
+    def set_meta(self, name, value, save_meta=True):
+        self.meta[name] = value
+        if save_meta:
+            self._save_meta()
+
     def delete_all(self):
         for filename in os.listdir(self.directory):
             try:
@@ -71,35 +95,160 @@ class NodeManager:
         self.meta = {'root_id': None, 'next_node_id': 0}
         self._save_meta()
 
+class PagedNodeManager(NodeManager):
+    """
+    NodeManager backend that keeps every node in one pre-allocated page file
+    instead of one file per node. The node id is the number of the node's
+    first page, and the meta lives in the file's header page.
+    """
+    def __init__(self, directory, dataFile, page_size=PAGE_SIZE):
+        self.directory = directory
+        self.meta_path = f"{directory}/{dataFile.split('.')[0]}.pages"
+
+        try:
+            print("PagedNodeManager: " + self.meta_path)
+            os.listdir(self.directory)
+        except OSError:
+            os.mkdir(self.directory)
+        self.pages = PagedFile(self.meta_path, page_size)
+        self.meta = self._load_meta()
+
+    def _load_meta(self):
+        root_id = self.pages.root_id
+        return {'root_id': None if root_id < 0 else root_id, 'next_node_id': self.pages.next_page}
+
+    def _save_meta(self):
+        root_id = self.meta['root_id']
+        self.pages.root_id = -1 if root_id is None else root_id
+        self.pages.save_header()
+
+    def get_node(self, node_id):
+        return self._node_from_data(json.loads(self.pages.read_record(node_id)))
+
+    def save_node(self, node):
+        self.pages.write_record(node.node_id, json.dumps(self._node_to_data(node)).encode())
+
+    def delete_node(self, node_id):
+        self.pages.free_chain(node_id)
+        self.pages.save_header()
+
+    def get_new_node_id(self, save_meta=True):
+        node_id = self.pages.alloc_page()
+        self.meta['next_node_id'] = self.pages.next_page
+        if save_meta:
+            self._save_meta()
+        return node_id
+
+    def delete_all(self):
+        self.pages.reset()
+        self.meta = self._load_meta()
+
 class BTreeNode:
     def __init__(self, manager, is_leaf=False, node_id=None):
         self.manager = manager
         self.is_leaf = is_leaf
         self.keys = []
         self.child_ids = []
+        self.counts = []  # Entries under each child of an internal node
         self.node_id = node_id if node_id is not None else self.manager.get_new_node_id()
     def save(self): self.manager.save_node(self)
+
+    def size(self): return len(self.keys) if self.is_leaf else sum(self.counts)
     
     def get_child(self, index): return self.manager.get_node(self.child_ids[index])
     
-    def traverse_keys(self, results):
-        if self.is_leaf:
-            results.extend(self.keys)
-        else:
-            for child_id in self.child_ids: self.manager.get_node(child_id).traverse_keys(results)
-            
-    def traverse_func(self, filter_func, results):
-        if self.is_leaf:
-            for k, v in self.keys:
-                if filter_func(v): results.append(v)
-        else:
-            for child_id in self.child_ids:
-                self.manager.get_node(child_id).traverse_func(filter_func, results)
-            
 class BTree:
-    def __init__(self, t, directory='./btree_data', dataFile = 'data.json'):
+    def __init__(self, t, directory='./btree_data', dataFile = 'data.json', paged=False,
+                 cache_size=0, cache_bytes=None, wal=False, wal_group_size=16, wal_group_ms=50,
+                 checkpoint_nodes=64, bloom_bits=0, bloom_hashes=BLOOM_HASHES):
         self.t = t
-        self.manager = NodeManager(directory, dataFile)
+        # Bumped by every change to the tree's shape, so range() can tell it must resume
+        self.version = 0
+
+        if paged:
+            self.manager = PagedNodeManager(directory, dataFile)
+        else:
+            self.manager = NodeManager(directory, dataFile)
+
+        # Optional LRU node cache; cache_size bounds the node count and
+        # cache_bytes the estimated serialized size of the cached nodes.
+        self.cache = None
+
+        # Optional write-ahead log next to the directory. Changes are logged
+        # and node writes held in the cache until a checkpoint, which starts
+        # once checkpoint_nodes nodes are dirty or on sync().
+        self.wal = None
+        self.checkpoint_nodes = checkpoint_nodes
+        records = []
+
+        if wal:
+            if paged:
+                raise ValueError("The write-ahead log needs the per-file node storage")
+
+            self.wal = WriteAheadLog(f"{directory}.wal", wal_group_size, wal_group_ms)
+            records = self.wal.recover(self.manager)
+            self.manager = LoggedNodeManager(self.manager, self.wal, cache_size or WAL_CACHE_SIZE, cache_bytes)
+            self.cache = self.manager.cache
+        elif cache_size or cache_bytes:
+            self.manager = CachedNodeManager(self.manager, cache_size or None, cache_bytes)
+            self.cache = self.manager.cache
+
+        self._init_root()
+
+        # Optional Bloom filter over the keys, so lookups of missing keys
+        # skip the tree. It is saved with the meta by sync() and rebuilt
+        # from the leaves on mount when the saved one is out of date.
+        self.bloom = None
+        self.bloom_saved = False
+
+        if bloom_bits:
+            self.bloom = BloomFilter(bloom_bits, bloom_hashes)
+            self._load_bloom()
+
+        if self.wal is not None:
+            self.wal.replay(self, records)
+            self.sync()
+
+    def _log(self, record):
+        if self.wal is not None:
+            self.wal.append(record)
+
+    def _logged(self):
+        # Checkpoints run between operations, when the tree is consistent
+        if self.wal is not None and self.manager.dirty_count() >= self.checkpoint_nodes:
+            self.sync()
+
+    def _load_bloom(self):
+        if self.bloom.load_meta(self.manager.get_meta('bloom') or {}):
+            self.bloom_saved = True
+            return
+
+        for key, value in self.range():
+            self.bloom.add(key)
+
+        self._save_bloom()
+
+    def _save_bloom(self):
+        self.manager.set_meta('bloom', self.bloom.to_meta())
+        self.bloom_saved = True
+
+    def _bloom_add(self, key):
+        if self.bloom_saved:
+            # The saved filter lacks this key, so it can't be used on mount
+            self.manager.set_meta('bloom', None)
+            self.bloom_saved = False
+
+        self.bloom.add(key)
+
+    def _bloom_miss(self, key):
+        """True if the Bloom filter rules the key out."""
+        return self.bloom is not None and not self.bloom.might_contain(key)
+
+    def _bloom_false_positive(self):
+        if self.bloom is not None:
+            self.bloom.false_positive()
+
+    def _init_root(self):
         root_id = self.manager.get_root_id()
 
         if root_id is None:
@@ -109,20 +258,41 @@ class BTree:
             self.root_id = root.node_id
         else:
             self.root_id = root_id
+            root = self._get_root()
+
+            if root.counts is None:
+                self._rebuild_counts(root)
+
+    def _rebuild_counts(self, node):
+        """Stores the subtree counts of a tree saved without them."""
+        if node.is_leaf:
+            return len(node.keys)
+
+        node.counts = [self._rebuild_counts(node.get_child(i)) for i in range(len(node.child_ids))]
+        node.save()
+        return sum(node.counts)
 
     def _get_root(self):
         return self.manager.get_node(self.root_id)
 
     def insert(self, key_value):
+        self.version += 1
+
         if not isinstance(key_value, list):
              key_value = list(key_value)
              
+        self._log(['i', key_value[0], key_value[1]])
+
+        if self.bloom is not None:
+            self._bloom_add(key_value[0])
+
         root = self._get_root()
         if len(root.keys) == (2 * self.t) - 1:
             old_root = root
             new_root_id = self.manager.get_new_node_id()
             new_root = BTreeNode(self.manager, is_leaf=False, node_id=new_root_id)
             new_root.child_ids.append(old_root.node_id)
+            new_root.counts.append(old_root.size())
             self._split_child(new_root, 0)
             
             self.root_id = new_root.node_id
@@ -132,29 +302,27 @@ class BTree:
         else:
             self._insert_non_full(root, key_value)
 
+        self._logged()
+
     def _insert_non_full(self, node, key_value):
-        i = len(node.keys) - 1
         key_to_insert = key_value[0]
 
         if node.is_leaf:
-            node.keys.append([None, None])
-            while i >= 0 and key_to_insert < node.keys[i][0]:
-                node.keys[i + 1] = node.keys[i]
-                i -= 1
-            node.keys[i + 1] = key_value
+            kv_insort(node.keys, key_value)
             node.save()
         else:
-            while i >= 0 and key_to_insert < node.keys[i]:
-                i -= 1
-            i += 1
+            # A routing key is the smallest key of its right subtree
+            i = bisect_right(node.keys, key_to_insert)
             
             child = node.get_child(i)
 
             if len(child.keys) == (2 * self.t) - 1:
                 self._split_child(node, i)
-                if key_to_insert > node.keys[i]:
+                if key_to_insert >= node.keys[i]:
                     i += 1
             
+            node.counts[i] += 1
+            node.save()
             child_for_insert = node.get_child(i)
             self._insert_non_full(child_for_insert, key_value)
 
@@ -176,28 +344,27 @@ class BTree:
             child_to_split.keys = child_to_split.keys[:t - 1]
             new_sibling.child_ids = child_to_split.child_ids[t:]
             child_to_split.child_ids = child_to_split.child_ids[:t]
+            new_sibling.counts = child_to_split.counts[t:]
+            child_to_split.counts = child_to_split.counts[:t]
 
+        parent_node.counts[child_index:child_index + 1] = [child_to_split.size(), new_sibling.size()]
         new_sibling.save()
         child_to_split.save()
         parent_node.save()
 
     def find(self, key):
         if self.root_id is None: return None
-        return self._search(self._get_root(), key)
+        if self._bloom_miss(key): return None
+        value = self._search(self._get_root(), key)
+        if value is None: self._bloom_false_positive()
+        return value
 
     def _search(self, node, key):
         if node.is_leaf:
-            for k, v in node.keys:
-                if k == key:
-                    return v
-            return None
+            i = kv_find(node.keys, key)
+            return node.keys[i][1] if i >= 0 else None
         else:
-            i = 0
-            
-            while i < len(node.keys) and key >= node.keys[i]:                
-                i += 1
-            
-            child_node = node.get_child(i)
+            child_node = node.get_child(bisect_right(node.keys, key))
             return self._search(child_node, key)
     
     def print_tree(self):
@@ -214,53 +381,288 @@ class BTree:
                 self._print_node(child_node, level + 1)
                 
     def delete_all(self):
+        self.version += 1
+
+        if self.wal is not None:
+            # Logged before any file is removed so replay starts from empty
+            self._log(['c'])
+            self.wal.commit()
+
         self.manager.delete_all()
-        self.__init__(self.t, self.manager.directory)
+        self._init_root()
+
+        if self.bloom is not None:
+            self.bloom.clear()
+            self._save_bloom()
+
         print("B-Tree data has been deleted.")
+
+    def bulk_load(self, sorted_items, fill_factor=1.0):
+        """
+        Replaces the tree contents with `sorted_items`, (key, value) pairs in
+        ascending key order. The tree is built bottom-up and every node is
+        written once; the meta is saved once at the end. With the log the
+        items are logged after a delete-all and the nodes written directly,
+        so an interrupted load is replayed from the log.
+        """
+        self.version += 1
+
+        if self.wal is not None:
+            self._log(['c'])
+            self.wal.commit()
+            self.manager.direct = True
+
+        self.manager.delete_all()
+
+        if self.bloom is not None:
+            self.bloom.clear()
+
+        loader = BulkLoader(self.t, fill_factor, self._bulk_node)
+
+        for key, value in sorted_items:
+            self._log(['i', key, value])
+            loader.add([key, value])
+
+            if self.bloom is not None:
+                self.bloom.add(key)
+
+        root_id = loader.finish()
+
+        if root_id is None:
+            self._init_root()
+        else:
+            self.root_id = root_id
+            self.manager.set_root_id(root_id)
+
+        if self.bloom is not None:
+            self._save_bloom()
+
+        if self.wal is not None:
+            self.manager.direct = False
+            self.manager.sync()
+
+    def _bulk_node(self, is_leaf, entries):
+        node_id = self.manager.get_new_node_id(save_meta=False)
+        node = BTreeNode(self.manager, is_leaf=is_leaf, node_id=node_id)
+
+        if is_leaf:
+            node.keys = entries
+        else:
+            # Routing keys are the smallest key of each right subtree
+            node.keys = [entry[0] for entry in entries[1:]]
+            node.child_ids = [entry[2] for entry in entries]
+            node.counts = [entry[3] for entry in entries]
+
+        node.save()
+        return node_id
+
+    def sync(self):
+        """
+        Writes back any nodes held dirty in the node cache (a checkpoint with
+        the log) and saves the Bloom filter with the meta.
+        """
+        if self.bloom is not None and not self.bloom_saved:
+            self._save_bloom()
+
+        if self.cache is not None:
+            self.manager.sync()
+
+    def stats(self):
+        stats = {}
+
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+
+        if self.wal is not None:
+            stats['wal'] = self.wal.stats()
+
+        if self.bloom is not None:
+            stats['bloom'] = self.bloom.stats()
+
+        return stats
         
+    def range(self, start_key=None, end_key=None, reverse=False):
+        """
+        Generator over the (key, value) entries with start_key <= key < end_key
+        in key order, or descending with reverse=True; a bound of None is
+        open. Leaves are loaded one at a time along the path from the root,
+        so a full scan holds one leaf instead of a list of every record.
+        If the tree is modified while the generator is in use, it carries on
+        from just past the last key it yielded.
+        """
+        after = None
+
+        while True:
+            version = self.version
+
+            for key, value in self._range(start_key, end_key, reverse):
+                if key == after:
+                    continue
+
+                yield key, value
+
+                if version != self.version:
+                    break
+            else:
+                return
+
+            # Changed meanwhile: walk down again to just past the last key
+            if reverse:
+                end_key = key
+            else:
+                start_key = after = key
+
+    def _range(self, start_key, end_key, reverse):
+        """The walk behind range(); only valid while the tree is unchanged."""
+        stack = []
+        node = self._get_root()
+
+        while not node.is_leaf:
+            if reverse:
+                i = len(node.keys) if end_key is None else bisect_left(node.keys, end_key)
+            else:
+                i = 0 if start_key is None else bisect_right(node.keys, start_key)
+            stack.append([node, i])
+            node = node.get_child(i)
+
+        while node is not None:
+            items = node.keys
+
+            if reverse:
+                i = len(items) if end_key is None else kv_bisect_left(items, end_key)
+
+                while i > 0:
+                    i -= 1
+                    key, value = items[i]
+                    if start_key is not None and key < start_key:
+                        return
+                    yield key, value
+            else:
+                i = 0 if start_key is None else kv_bisect_left(items, start_key)
+
+                while i < len(items):
+                    key, value = items[i]
+                    if end_key is not None and key >= end_key:
+                        return
+                    yield key, value
+                    i += 1
+
+            node = self._next_leaf(stack, reverse)
+
+    def seek(self, key):
+        """Generator over the entries with keys >= key, in key order."""
+        return self.range(key)
+
+    def iter_items(self, offset=0, limit=None):
+        """
+        Generator over the (key, value) entries in key order, starting at
+        position `offset` and yielding at most `limit` of them. The start is
+        found through the subtree counts instead of by skipping entries.
+        """
+        if offset >= self.count_all():
+            return
+
+        for key, value in self.range(self.select(offset)[0] if offset > 0 else None):
+            if limit is not None:
+                if limit <= 0:
+                    return
+                limit -= 1
+            yield key, value
+
+    def iter_keys(self):
+        """Generator over every key in order."""
+        for key, value in self.range():
+            yield key
+
+    def iter_values(self, filter_func=None, offset=0, limit=None):
+        """
+        Generator over the values in key order, those accepted by filter_func
+        if given. With a filter, offset and limit count the accepted values.
+        """
+        if filter_func is None:
+            for key, value in self.iter_items(offset, limit):
+                yield value
+            return
+
+        for key, value in self.range():
+            if filter_func(value):
+                if offset > 0:
+                    offset -= 1
+                    continue
+                if limit is not None:
+                    if limit <= 0:
+                        return
+                    limit -= 1
+                yield value
+
     def traverse_keys(self):
-        results = []
-        if self.root_id is not None:
-            self._get_root().traverse_keys(results)
-        return results        
+        return list(self.iter_items())
 
     def traverse_func(self, filter_func):
-        results = []
-        if self.root_id is not None:
-            self._get_root().traverse_func(filter_func, results)
-        return results
+        return list(self.iter_values(filter_func))
+
+    def _next_leaf(self, stack, reverse):
+        """Moves the root-to-leaf path in `stack` on to the neighbouring leaf."""
+        while stack:
+            entry = stack[-1]
+            parent, i = entry
+            i = i - 1 if reverse else i + 1
+
+            if 0 <= i < len(parent.child_ids):
+                entry[1] = i
+                node = parent.get_child(i)
+
+                while not node.is_leaf:
+                    i = len(node.child_ids) - 1 if reverse else 0
+                    stack.append([node, i])
+                    node = node.get_child(i)
+
+                return node
+
+            stack.pop()
+
+        return None
 
     def delete(self, key):
+        self.version += 1
+
         if self.root_id is None: return
-        self._delete(self._get_root(), key)
+        if self._bloom_miss(key): return
+        self._log(['d', key])
+        if not self._delete(self._get_root(), key): self._bloom_false_positive()
         root = self._get_root()
         if len(root.keys) == 0 and not root.is_leaf:
             new_root_id = root.child_ids[0]
             self.manager.delete_node(self.root_id)
             self.root_id = new_root_id
             self.manager.set_root_id(new_root_id)
+        self._logged()
 
     def _delete(self, node, key):
+        """Deletes `key` below `node`; returns True if it was found."""
         if node.is_leaf:
-            original_len = len(node.keys)
-            node.keys = [kv for kv in node.keys if kv[0] != key]
-            if len(node.keys) != original_len:
+            i = kv_find(node.keys, key)
+            if i >= 0:
+                node.keys.pop(i)
                 node.save()
-            return
-        i = 0
-        while i < len(node.keys) and key >= node.keys[i]:
-            i += 1
+                return True
+            return False
+        i = bisect_right(node.keys, key)
         
         child = node.get_child(i)
         if len(child.keys) < self.t:
             self._fill(node, i)
             # After fill, the path might have changed, re-find the correct child index
-            i = 0
-            while i < len(node.keys) and key >= node.keys[i]:
-                i += 1
+            i = bisect_right(node.keys, key)
         
         child_to_delete_from = node.get_child(i)
-        self._delete(child_to_delete_from, key)
+
+        if self._delete(child_to_delete_from, key):
+            node.counts[i] -= 1
+            node.save()
+            return True
+
+        return False
 
 
     def _fill(self, parent_node, child_idx):
@@ -282,19 +684,22 @@ class BTree:
     def _borrow_from_prev(self, parent_node, child_idx):
         child = parent_node.get_child(child_idx)
         sibling = parent_node.get_child(child_idx - 1)
-        borrowed_item = sibling.keys.pop()
-        child.keys.insert(0, borrowed_item)
-        
-        # --- Start of fix ---
+
         if child.is_leaf:
+            child.keys.insert(0, sibling.keys.pop())
             parent_node.keys[child_idx - 1] = child.keys[0][0]
+            moved = 1
         else:
-            parent_node.keys[child_idx - 1] = child.keys[0]
-        # --- End of fix ---
-
-        if not child.is_leaf:
-            borrowed_child_id = sibling.child_ids.pop()
-            child.child_ids.insert(0, borrowed_child_id)
+            # Rotate through the parent: its routing key moves down into the
+            # child and the sibling's last key replaces it
+            child.keys.insert(0, parent_node.keys[child_idx - 1])
+            parent_node.keys[child_idx - 1] = sibling.keys.pop()
+            child.child_ids.insert(0, sibling.child_ids.pop())
+            moved = sibling.counts.pop()
+            child.counts.insert(0, moved)
+
+        parent_node.counts[child_idx - 1] -= moved
+        parent_node.counts[child_idx] += moved
         
         child.save()
         sibling.save()
@@ -303,19 +708,20 @@ class BTree:
     def _borrow_from_next(self, parent_node, child_idx):
         child = parent_node.get_child(child_idx)
         sibling = parent_node.get_child(child_idx + 1)
-        borrowed_item = sibling.keys.pop(0)
-        child.keys.append(borrowed_item)
 
-        # --- Start of fix ---
-        if sibling.is_leaf:
+        if child.is_leaf:
+            child.keys.append(sibling.keys.pop(0))
             parent_node.keys[child_idx] = sibling.keys[0][0]
+            moved = 1
         else:
-            parent_node.keys[child_idx] = sibling.keys[0]
-        # --- End of fix ---
+            child.keys.append(parent_node.keys[child_idx])
+            parent_node.keys[child_idx] = sibling.keys.pop(0)
+            child.child_ids.append(sibling.child_ids.pop(0))
+            moved = sibling.counts.pop(0)
+            child.counts.append(moved)
 
-        if not child.is_leaf:
-            borrowed_child_id = sibling.child_ids.pop(0)
-            child.child_ids.append(borrowed_child_id)
+        parent_node.counts[child_idx] += moved
+        parent_node.counts[child_idx + 1] -= moved
 
         child.save()
         sibling.save()
@@ -324,55 +730,96 @@ class BTree:
     def _merge(self, parent_node, child_idx):
         child = parent_node.get_child(child_idx)
         sibling = parent_node.get_child(child_idx + 1)
-        child.keys.extend(sibling.keys)
         if not child.is_leaf:
+            # Internal nodes take the parent's routing key between the halves
+            child.keys.append(parent_node.keys[child_idx])
             child.child_ids.extend(sibling.child_ids)
+            child.counts.extend(sibling.counts)
+        child.keys.extend(sibling.keys)
         parent_node.keys.pop(child_idx)
         parent_node.child_ids.pop(child_idx + 1)
+        parent_node.counts[child_idx] += parent_node.counts.pop(child_idx + 1)
         child.save()
         parent_node.save()
         self.manager.delete_node(sibling.node_id)
 
     def count_all(self):
         """
-        Counts all data records in the tree in a memory-efficient way.
+        Counts all data records in the tree from the root alone, as every
+        internal node keeps the record count of each child.
         """
         if self.root_id is None:
             return 0
-        return self._count_all(self.manager.get_node(self.root_id))
+        return self._get_root().size()
 
-    def _count_all(self, node):
+    def count_range(self, start_key=None, end_key=None):
         """
-        Recursive helper that counts records starting from a given node.
+        Counts the records with start_key <= key < end_key, a bound of None
+        being open, reading one root-to-leaf path per bound.
         """
-        # If the node is a leaf, return the number of records it holds.
-        if node.is_leaf:
-            return len(node.keys)
-        
-        # If it's an internal node, sum the counts from all its children.
-        count = 0
-        for child_id in node.child_ids:
-            child_node = self.manager.get_node(child_id)
-            count += self._count_all(child_node)
-        return count
+        end = self.count_all() if end_key is None else self.rank(end_key)
+        start = 0 if start_key is None else self.rank(start_key)
+        return max(0, end - start)
+
+    def rank(self, key):
+        """
+        Returns the number of records with keys below `key`.
+        """
+        node = self._get_root()
+        rank = 0
+
+        while not node.is_leaf:
+            i = bisect_right(node.keys, key)
+            rank += sum(node.counts[:i])
+            node = node.get_child(i)
+
+        return rank + kv_bisect_left(node.keys, key)
+
+    def select(self, index):
+        """
+        Returns the [key, value] record at 0-based position `index` in key
+        order, skipping whole subtrees by their counts.
+        """
+        if index < 0 or index >= self.count_all():
+            raise IndexError("select index out of range")
+
+        node = self._get_root()
+
+        while not node.is_leaf:
+            i = 0
+
+            while index >= node.counts[i]:
+                index -= node.counts[i]
+                i += 1
+
+            node = node.get_child(i)
+
+        return node.keys[index]
 
     def update_value(self, key, new_value):
         """
         Finds a key in the tree and updates its value.
         The change is saved persistently to disk.
         """
+        if self._bloom_miss(key):
+            return False
+
         # Find the node containing the key and the key's index within that node.
         node, index = self._find_node_and_index(self._get_root(), key)
         
         if node is not None:
+            self._log(['u', key, new_value])
+
             # If found, update the value in the key-value pair.
             # Note: We use a list, as ujson serializes tuples to lists anyway.
             node.keys[index] = [key, new_value]
             
             # *** Crucially, save the modified node back to disk. ***
             node.save()
+            self._logged()
             return True  # Update successful
         else:
+            self._bloom_false_positive()
             return False # Key not found
 
     def _find_node_and_index(self, node, key):
@@ -382,15 +829,13 @@ class BTree:
         """
         if node.is_leaf:
             # In a leaf, search for the key directly.
-            for i, key_value in enumerate(node.keys):
-                if key_value[0] == key:
-                    return node, i # Return the node object and the index
+            i = kv_find(node.keys, key)
+            if i >= 0:
+                return node, i # Return the node object and the index
             return None, None # Not found in this leaf
         else:
             # In an internal node, find the correct child to descend into.
-            i = 0
-            while i < len(node.keys) and key >= node.keys[i]:
-                i += 1
+            i = bisect_right(node.keys, key)
             
             # Load the child from disk and continue the search.
             child_node = node.get_child(i)
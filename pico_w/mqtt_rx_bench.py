@@ -0,0 +1,113 @@
+import gc
+import time
+import uasyncio as asyncio
+from mqtt_as import MQTTClient, config
+
+MESSAGES = 200
+PAYLOAD = 64
+HOST = '127.0.0.1'
+PORT = 1885
+QOS = (0, 1)
+
+async def read_packet(reader):
+    head = await reader.readexactly(1)
+    length = 0
+    shift = 0
+
+    while True:
+        b = (await reader.readexactly(1))[0]
+        length |= (b & 0x7f) << shift
+
+        if not b & 0x80:
+            break
+
+        shift += 7
+
+    return head[0], await reader.readexactly(length) if length else b''
+
+def publish_packet(qos, pid):
+    # Payload starts with the ticks_us it was sent at
+    payload = ('%d ' % time.ticks_us()).encode()
+    payload += b'x' * (PAYLOAD - len(payload))
+    topic = b'bench'
+    body = bytes((0, len(topic))) + topic
+
+    if qos:
+        body += bytes((pid >> 8, pid & 0xff))
+
+    body += payload
+    return bytes((0x30 | qos << 1, len(body))) + body
+
+async def stand_in_broker(reader, writer):
+    # Answers a SUBSCRIBE by streaming MESSAGES publishes at its QoS
+    try:
+        while True:
+            op, body = await read_packet(reader)
+
+            if op & 0xf0 == 0x10:
+                writer.write(b'\x20\x02\x00\x00')
+                await writer.drain()
+            elif op & 0xf0 == 0x80:
+                qos = body[-1]
+                writer.write(b'\x90\x03' + body[:2] + bytes((qos,)))
+
+                for i in range(MESSAGES):
+                    writer.write(publish_packet(qos, i + 1))
+
+                    if i % 16 == 15:
+                        await writer.drain()
+
+                await writer.drain()
+            elif op & 0xf0 == 0xc0:
+                writer.write(b'\xd0\x00')
+                await writer.drain()
+            elif op & 0xf0 == 0xe0:
+                break
+    except (OSError, EOFError):
+        pass
+    finally:
+        writer.close()
+
+async def bench(qos):
+    received = []
+    done = asyncio.Event()
+
+    def callback(topic, msg, retained):
+        received.append(time.ticks_diff(time.ticks_us(), int(bytes(msg[:msg.index(b' ')]))))
+
+        if len(received) == MESSAGES:
+            done.set()
+
+    cfg = dict(config)
+    cfg['server'] = HOST
+    cfg['port'] = PORT
+    cfg['subs_cb'] = callback
+    client = MQTTClient(cfg)
+    await client.connect(quick=True)
+    gc.collect()
+    gc.disable()
+    heap = gc.mem_alloc()
+    start = time.ticks_ms()
+
+    try:
+        await client.subscribe(b'bench', qos)
+        await done.wait()
+        elapsed_ms = time.ticks_diff(time.ticks_ms(), start)
+        allocated = gc.mem_alloc() - heap
+    finally:
+        gc.enable()
+
+    print("qos %d  %d messages: %5d ms  (%.0f msg/s)  latency avg %d us  max %d us  heap %d B/msg" %
+          (qos, MESSAGES, elapsed_ms, MESSAGES * 1000 / max(1, elapsed_ms),
+           sum(received) // MESSAGES, max(received), allocated // MESSAGES))
+    await client.disconnect()
+
+async def main():
+    server = await asyncio.start_server(stand_in_broker, HOST, PORT)
+
+    for qos in QOS:
+        await bench(qos)
+
+    server.close()
+
+asyncio.run(main())
@@ -0,0 +1,187 @@
+import ujson as json
+import ustruct as struct
+
+# Binary node layout (little endian):
+#   header   : magic 'BN', version, flags (bit 0 = leaf), key count, child count
+#   disk_file: u16 length + utf-8
+#   children : per child u16 length + utf-8 disk file
+#   counts   : per child u32 entry count of its subtree (version 2 and up)
+#   key types: one type code per key
+#   keys     : int -> q, float -> d, str/json -> u16 length + utf-8
+#   offsets  : key count + 1 u32 offsets into the value area
+#   values   : JSON blobs, decoded only when a value is actually read
+# JSON keys and values hint tuples as {"__tuple__": true, "items": [...]},
+# as the JSON codec does, so they come back as tuples and not lists.
+_MAGIC = b'BN'
+_VERSION = 2
+_HEADER_FMT = '<2sBBHH'
+_HEADER_SIZE = struct.calcsize(_HEADER_FMT)
+
+_KEY_INT = 0
+_KEY_FLOAT = 1
+_KEY_STR = 2
+_KEY_JSON = 3
+
+_INT_MIN = -(1 << 63)
+_INT_MAX = (1 << 63) - 1
+
+def _hint_tuples(item):
+    if isinstance(item, tuple):
+        return {'__tuple__': True, 'items': [_hint_tuples(e) for e in item]}
+    if isinstance(item, list):
+        return [_hint_tuples(e) for e in item]
+    if isinstance(item, dict):
+        return {key: _hint_tuples(value) for key, value in item.items()}
+    return item
+
+def _restore_tuples(obj):
+    if isinstance(obj, dict):
+        if '__tuple__' in obj:
+            return tuple(_restore_tuples(e) for e in obj['items'])
+        return {key: _restore_tuples(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_restore_tuples(e) for e in obj]
+    return obj
+
+def _dumps(obj):
+    return json.dumps(_hint_tuples(obj))
+
+def _loads_value(data):
+    obj = json.loads(data)
+    # Most values hold no tuple, so skip the walk unless one was hinted
+    return _restore_tuples(obj) if b'__tuple__' in data else obj
+
+class EncodedValue:
+    """
+    A value still in its encoded form inside a node buffer. Nodes hold these
+    until the value is read, so a search only decodes the value it returns
+    and unchanged values are written back without being re-encoded.
+    """
+    def __init__(self, buf, start, end):
+        self.buf = buf
+        self.start = start
+        self.end = end
+
+    def raw(self):
+        return self.buf[self.start:self.end]
+
+    def decode(self):
+        return _loads_value(self.buf[self.start:self.end])
+
+class JsonNodeCodec:
+    """The original nested JSON format, kept as a readable debug format."""
+    name = 'json'
+
+    def encode(self, node):
+        return json.dumps(node.serialize()).encode("utf-8")
+
+    def decode(self, data, node_class):
+        return node_class.deserialize(data)
+
+class BinaryNodeCodec:
+    """Length-prefixed binary node format with lazily decoded values."""
+    name = 'binary'
+
+    def _pack_str(self, parts, text):
+        data = text.encode('utf-8')
+        parts.append(struct.pack('<H', len(data)))
+        parts.append(data)
+
+    def encode(self, node):
+        keys = node.keys
+        disk_file = node.disk_file or ''
+        children = [child.disk_file if hasattr(child, 'disk_file') else child for child in node.children]
+
+        parts = [struct.pack(_HEADER_FMT, _MAGIC, _VERSION, 1 if node.is_leaf else 0,
+                             len(keys), len(children))]
+        self._pack_str(parts, disk_file)
+
+        for child in children:
+            self._pack_str(parts, child)
+
+        parts.append(struct.pack('<%dI' % len(children), *node.counts[:len(children)]))
+
+        types = bytearray(len(keys))
+        key_parts = []
+        values = []
+
+        for i in range(len(keys)):
+            key, value = keys[i]
+
+            if isinstance(key, int) and _INT_MIN <= key <= _INT_MAX:
+                types[i] = _KEY_INT
+                key_parts.append(struct.pack('<q', key))
+            elif isinstance(key, float):
+                types[i] = _KEY_FLOAT
+                key_parts.append(struct.pack('<d', key))
+            elif isinstance(key, str):
+                types[i] = _KEY_STR
+                self._pack_str(key_parts, key)
+            else:
+                types[i] = _KEY_JSON
+                self._pack_str(key_parts, _dumps(key))
+
+            if isinstance(value, EncodedValue):
+                values.append(value.raw())
+            else:
+                values.append(_dumps(value).encode('utf-8'))
+
+        parts.append(bytes(types))
+        parts.extend(key_parts)
+
+        offsets = [0]
+
+        for value in values:
+            offsets.append(offsets[-1] + len(value))
+
+        parts.append(struct.pack('<%dI' % len(offsets), *offsets))
+        parts.extend(values)
+        return b''.join(parts)
+
+    def _unpack_str(self, data, pos):
+        length = struct.unpack_from('<H', data, pos)[0]
+        pos += 2
+        return data[pos:pos + length].decode('utf-8'), pos + length
+
+    def decode(self, data, node_class):
+        magic, version, flags, key_count, child_count = struct.unpack_from(_HEADER_FMT, data, 0)
+
+        if magic != _MAGIC or not 1 <= version <= _VERSION:
+            raise ValueError("Unknown node format")
+
+        node = node_class(is_leaf=bool(flags & 1))
+        disk_file, pos = self._unpack_str(data, _HEADER_SIZE)
+        node.disk_file = disk_file or None
+
+        for i in range(child_count):
+            child, pos = self._unpack_str(data, pos)
+            node.children.append(child)
+
+        if version >= 2:
+            node.counts = list(struct.unpack_from('<%dI' % child_count, data, pos))
+            pos += 4 * child_count
+
+        types = data[pos:pos + key_count]
+        pos += key_count
+        keys = []
+
+        for key_type in types:
+            if key_type == _KEY_INT:
+                keys.append(struct.unpack_from('<q', data, pos)[0])
+                pos += 8
+            elif key_type == _KEY_FLOAT:
+                keys.append(struct.unpack_from('<d', data, pos)[0])
+                pos += 8
+            elif key_type == _KEY_STR:
+                key, pos = self._unpack_str(data, pos)
+                keys.append(key)
+            else:
+                key, pos = self._unpack_str(data, pos)
+                keys.append(_restore_tuples(json.loads(key)))
+
+        offsets = struct.unpack_from('<%dI' % (key_count + 1), data, pos)
+        base = pos + 4 * (key_count + 1)
+
+        node.keys = [(keys[i], EncodedValue(data, base + offsets[i], base + offsets[i + 1]))
+                     for i in range(key_count)]
+        return node
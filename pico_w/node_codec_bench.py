@@ -0,0 +1,52 @@
+import gc
+import time
+from btree_hybrid_disk_cache import BTreeNode
+from node_codec import BinaryNodeCodec, JsonNodeCodec
+
+ROUNDS = 200
+KEY_COUNT = 9
+
+def make_node():
+    node = BTreeNode(True)
+    node.disk_file = 'btree_cache/node_1.json'
+
+    for i in range(KEY_COUNT):
+        key = 1700000000000000000 + i
+        node.keys.append((key, {"id": key, "meterId": 3, "reading": 1234.5 + i,
+                                "readingOn": "2024-01-01T10:00:00", "version": 0}))
+
+    return node
+
+def bench(codec, node):
+    data = codec.encode(node)
+
+    gc.collect()
+    free = gc.mem_free()
+    start = time.ticks_us()
+
+    for _ in range(ROUNDS):
+        codec.encode(node)
+
+    encode_us = time.ticks_diff(time.ticks_us(), start) // ROUNDS
+    start = time.ticks_us()
+
+    for _ in range(ROUNDS):
+        codec.decode(data, BTreeNode)
+
+    decode_us = time.ticks_diff(time.ticks_us(), start) // ROUNDS
+    start = time.ticks_us()
+
+    # A point lookup decodes the node and one value only
+    for _ in range(ROUNDS):
+        codec.decode(data, BTreeNode).get_value(KEY_COUNT // 2)
+
+    lookup_us = time.ticks_diff(time.ticks_us(), start) // ROUNDS
+    allocated = free - gc.mem_free()
+
+    print("%-6s size: %5d bytes  encode: %6d us  decode: %6d us  lookup: %6d us  alloc: %d" %
+          (codec.name, len(data), encode_us, decode_us, lookup_us, allocated))
+
+node = make_node()
+
+for codec in (JsonNodeCodec(), BinaryNodeCodec()):
+    bench(codec, node)
@@ -0,0 +1,85 @@
+import time
+from btree_custom_mem import BTree
+from node_search import kv_bisect_left, kv_insort
+
+ROUNDS = 2000
+TREE_DEPTH = 10
+TREE_KEYS = 2000
+
+def linear_find(items, key):
+    i = 0
+
+    while i < len(items) and key > items[i][0]:
+        i += 1
+
+    return i
+
+def linear_insert(items, item):
+    i = len(items) - 1
+    items.append((None, None))
+
+    while i >= 0 and item[0] < items[i][0]:
+        items[i + 1] = items[i]
+        i -= 1
+
+    items[i + 1] = item
+
+def per_op_us(start, ops):
+    return time.ticks_diff(time.ticks_us(), start) / ops
+
+def bench_node():
+    # A full node at the app's tree depth, 2t - 1 keys
+    node_size = 2 * TREE_DEPTH - 1
+    items = [(i * 2, i) for i in range(node_size)]
+    probes = [i % (node_size * 2) for i in range(ROUNDS)]
+
+    start = time.ticks_us()
+    for key in probes:
+        linear_find(items, key)
+    linear_us = per_op_us(start, ROUNDS)
+
+    start = time.ticks_us()
+    for key in probes:
+        kv_bisect_left(items, key)
+    bisect_us = per_op_us(start, ROUNDS)
+
+    print("node search (%d keys)  linear: %.2f us  bisect: %.2f us" % (node_size, linear_us, bisect_us))
+
+    start = time.ticks_us()
+    for key in probes:
+        node = items[:node_size - 1]
+        linear_insert(node, (key, 0))
+    linear_us = per_op_us(start, ROUNDS)
+
+    start = time.ticks_us()
+    for key in probes:
+        node = items[:node_size - 1]
+        kv_insort(node, (key, 0))
+    bisect_us = per_op_us(start, ROUNDS)
+
+    print("leaf insert (%d keys)  shift: %.2f us  insort: %.2f us" % (node_size - 1, linear_us, bisect_us))
+
+def bench_tree():
+    tree = BTree(TREE_DEPTH)
+    keys = [(i * 7919) % TREE_KEYS for i in range(TREE_KEYS)]
+
+    start = time.ticks_us()
+    for key in keys:
+        tree.insert((key, key))
+    insert_us = per_op_us(start, TREE_KEYS)
+
+    start = time.ticks_us()
+    for key in keys:
+        tree.find(key)
+    find_us = per_op_us(start, TREE_KEYS)
+
+    start = time.ticks_us()
+    for key in keys:
+        tree.delete((key,))
+    delete_us = per_op_us(start, TREE_KEYS)
+
+    print("btree_custom_mem (%d keys)  insert: %.2f us  find: %.2f us  delete: %.2f us" %
+          (TREE_KEYS, insert_us, find_us, delete_us))
+
+bench_node()
+bench_tree()
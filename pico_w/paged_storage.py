@@ -0,0 +1,186 @@
+import ustruct as struct
+
+PAGE_SIZE = 512
+
+_MAGIC = b'BTPG'
+_VERSION = 1
+
+# Header page: magic, version, page size, allocated pages, high-water page,
+# overflow free list head, root id, first leaf id, free slots in use.
+_HEADER_FMT = '<4sHHIIIiiH'
+_HEADER_SIZE = struct.calcsize(_HEADER_FMT)
+
+# Every data page starts with the next page of its chain (0 = end of chain)
+# and the number of payload bytes used in this page.
+_PAGE_FMT = '<IH'
+_PAGE_HDR_SIZE = struct.calcsize(_PAGE_FMT)
+
+class PagedFile:
+    """
+    Single pre-allocated file made of fixed-size pages.
+
+    Page 0 is the header page holding the tree meta and the free list.
+    A record (one serialized node) is stored in a chain of pages and is
+    identified by the number of its first page, so a node id can be used
+    directly as a page number and every access is a seek instead of a
+    directory lookup.
+    """
+    def __init__(self, path, page_size=PAGE_SIZE, initial_pages=64, grow_pages=16):
+        self.path = path
+        self.page_size = page_size
+        self.payload_size = page_size - _PAGE_HDR_SIZE
+        self.initial_pages = initial_pages
+        self.grow_pages = grow_pages
+        self.free_capacity = (page_size - _HEADER_SIZE) // 4
+        self._zero_page = bytes(page_size)
+
+        try:
+            self.f = open(path, 'r+b')
+            self._read_header()
+        except OSError:
+            self._create()
+
+    def _create(self):
+        self.f = open(self.path, 'w+b')
+        self.page_count = 0
+        self.next_page = 1
+        self.overflow_free_head = 0
+        self.root_id = -1
+        self.first_leaf_id = -1
+        self.free_pages = []
+        self._grow(self.initial_pages)
+        self.save_header()
+
+    def _read_header(self):
+        self.f.seek(0)
+        data = self.f.read(self.page_size)
+
+        if len(data) < _HEADER_SIZE:
+            raise OSError("Paged file header truncated: " + self.path)
+
+        (magic, version, page_size, self.page_count, self.next_page,
+         self.overflow_free_head, self.root_id, self.first_leaf_id,
+         free_count) = struct.unpack_from(_HEADER_FMT, data, 0)
+
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("Not a paged B-tree file: " + self.path)
+
+        if page_size != self.page_size:
+            raise ValueError("Page size mismatch: " + str(page_size))
+
+        self.free_pages = list(struct.unpack_from('<%dI' % free_count, data, _HEADER_SIZE))
+
+    def save_header(self):
+        free_count = len(self.free_pages)
+        header = bytearray(self.page_size)
+        struct.pack_into(_HEADER_FMT, header, 0, _MAGIC, _VERSION, self.page_size,
+                         self.page_count, self.next_page, self.overflow_free_head,
+                         self.root_id, self.first_leaf_id, free_count)
+        struct.pack_into('<%dI' % free_count, header, _HEADER_SIZE, *self.free_pages)
+        self.f.seek(0)
+        self.f.write(header)
+        self.f.flush()
+
+    def _grow(self, pages):
+        # Zero-filled pages are valid empty records (next = 0, used = 0), so
+        # pages taken from the end of the file need no extra write before use.
+        self.f.seek(self.page_count * self.page_size)
+
+        for i in range(pages):
+            self.f.write(self._zero_page)
+
+        self.page_count += pages
+
+    def _read_page_header(self, page):
+        self.f.seek(page * self.page_size)
+        return struct.unpack(_PAGE_FMT, self.f.read(_PAGE_HDR_SIZE))
+
+    def _write_page(self, page, next_page, payload):
+        self.f.seek(page * self.page_size)
+        self.f.write(struct.pack(_PAGE_FMT, next_page, len(payload)))
+        self.f.write(payload)
+
+    def alloc_page(self):
+        """Returns a free page, reusing freed pages before extending the file."""
+        if self.free_pages:
+            page = self.free_pages.pop()
+            self._write_page(page, 0, b'')
+        elif self.overflow_free_head:
+            page = self.overflow_free_head
+            self.overflow_free_head = self._read_page_header(page)[0]
+            self._write_page(page, 0, b'')
+        else:
+            page = self.next_page
+            self.next_page += 1
+
+            if page >= self.page_count:
+                self._grow(self.grow_pages)
+
+        return page
+
+    def free_page(self, page):
+        if len(self.free_pages) < self.free_capacity:
+            self.free_pages.append(page)
+        else:
+            # Header is full, link the page into the overflow free list.
+            self._write_page(page, self.overflow_free_head, b'')
+            self.overflow_free_head = page
+
+    def free_chain(self, page):
+        while page:
+            next_page = self._read_page_header(page)[0]
+            self.free_page(page)
+            page = next_page
+
+    def read_record(self, page):
+        chunks = []
+
+        while page:
+            self.f.seek(page * self.page_size)
+            next_page, used = struct.unpack(_PAGE_FMT, self.f.read(_PAGE_HDR_SIZE))
+            chunks.append(self.f.read(used))
+            page = next_page
+
+        return b''.join(chunks)
+
+    def write_record(self, page, data):
+        """
+        Writes `data` into the chain starting at `page`, reusing the pages
+        already in the chain and allocating or freeing the difference.
+        """
+        view = memoryview(data)
+        offset = 0
+        payload = self.payload_size
+        header_dirty = False
+
+        while True:
+            next_page = self._read_page_header(page)[0]
+            chunk = view[offset:offset + payload]
+            offset += len(chunk)
+
+            if offset < len(data):
+                if not next_page:
+                    next_page = self.alloc_page()
+                    header_dirty = True
+                self._write_page(page, next_page, chunk)
+                page = next_page
+            else:
+                self._write_page(page, 0, chunk)
+
+                if next_page:
+                    self.free_chain(next_page)
+                    header_dirty = True
+                break
+
+        if header_dirty:
+            self.save_header()
+        else:
+            self.f.flush()
+
+    def reset(self):
+        """Drops every record and shrinks the file back to its initial size."""
+        self.f.close()
+        self._create()
+
+    def close(self):
+        self.f.close()
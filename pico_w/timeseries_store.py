@@ -0,0 +1,247 @@
+from array import array
+from node_search import bisect_left, bisect_right
+
+SEGMENT_SIZE = 64
+
+class Segment:
+    """
+    Up to SEGMENT_SIZE readings of one meter, packed into parallel arrays
+    ordered by time and id. The header (min/max time and sum) lets whole
+    segments be skipped or counted without touching the arrays.
+    """
+    def __init__(self):
+        self.times = array('q')
+        self.values = array('d')
+        self.ids = array('q')
+        self.min_time = 0
+        self.max_time = 0
+        self.sum = 0.0
+
+    def __len__(self):
+        return len(self.times)
+
+    def last_key(self):
+        return (self.times[-1], self.ids[-1])
+
+    def position(self, time, id):
+        """Index of the first reading at or after (time, id)."""
+        times = self.times
+        i = bisect_left(times, time)
+
+        while i < len(times) and times[i] == time and self.ids[i] < id:
+            i += 1
+
+        return i
+
+    def append(self, time, value, id):
+        if not self.times:
+            self.min_time = time
+
+        self.times.append(time)
+        self.values.append(value)
+        self.ids.append(id)
+        self.max_time = time
+        self.sum += value
+
+    def insert(self, i, time, value, id):
+        self.times = self.times[:i] + array('q', [time]) + self.times[i:]
+        self.values = self.values[:i] + array('d', [value]) + self.values[i:]
+        self.ids = self.ids[:i] + array('q', [id]) + self.ids[i:]
+        self._refresh()
+
+    def remove(self, i):
+        self.times = self.times[:i] + self.times[i + 1:]
+        self.values = self.values[:i] + self.values[i + 1:]
+        self.ids = self.ids[:i] + self.ids[i + 1:]
+        self._refresh()
+
+    def split(self):
+        """Moves the upper half into a new segment and returns it."""
+        half = len(self.times) // 2
+        upper = Segment()
+        upper.times = self.times[half:]
+        upper.values = self.values[half:]
+        upper.ids = self.ids[half:]
+        self.times = self.times[:half]
+        self.values = self.values[:half]
+        self.ids = self.ids[:half]
+        self._refresh()
+        upper._refresh()
+        return upper
+
+    def bounds(self, start_time, end_time):
+        """Index range of the readings with start_time <= time <= end_time."""
+        lo = 0 if start_time is None or start_time <= self.min_time else bisect_left(self.times, start_time)
+        hi = len(self.times) if end_time is None or end_time >= self.max_time else bisect_right(self.times, end_time)
+        return lo, hi
+
+    def _refresh(self):
+        if self.times:
+            self.min_time = self.times[0]
+            self.max_time = self.times[-1]
+        else:
+            self.min_time = 0
+            self.max_time = 0
+
+        self.sum = sum(self.values)
+
+class TimeSeriesStore:
+    """
+    Per-meter reading history as lists of packed segments. Readings that
+    arrive in time order are appended to the last segment; an out-of-order
+    reading is inserted into the segment covering its time, which splits
+    once it grows past twice SEGMENT_SIZE. Times are epoch seconds, ids the
+    integer reading ids.
+    """
+    def __init__(self, segment_size=SEGMENT_SIZE):
+        self.segment_size = segment_size
+        self.series = {}
+
+    def clear(self):
+        self.series = {}
+
+    def add(self, meter_id, time, value, id):
+        segments = self.series.get(meter_id)
+
+        if segments is None:
+            segments = self.series[meter_id] = [Segment()]
+
+        last = segments[-1]
+
+        if not len(last) or last.last_key() <= (time, id):
+            if len(last) >= self.segment_size:
+                last = Segment()
+                segments.append(last)
+
+            last.append(time, value, id)
+            return
+
+        s = self._segment_index(segments, time, id)
+        segment = segments[s]
+        segment.insert(segment.position(time, id), time, value, id)
+
+        if len(segment) > 2 * self.segment_size:
+            segments.insert(s + 1, segment.split())
+
+    def remove(self, meter_id, time, id):
+        segments = self.series.get(meter_id)
+
+        if segments is None:
+            return False
+
+        s = self._segment_index(segments, time, id)
+        segment = segments[s]
+        i = segment.position(time, id)
+
+        if i >= len(segment) or segment.times[i] != time or segment.ids[i] != id:
+            return False
+
+        segment.remove(i)
+
+        if not len(segment):
+            del segments[s]
+
+            if not segments:
+                del self.series[meter_id]
+
+        return True
+
+    def count(self, meter_id, start_time=None, end_time=None):
+        count = 0
+
+        for segment in self._segments(meter_id, start_time, end_time):
+            lo, hi = segment.bounds(start_time, end_time)
+            count += hi - lo
+
+        return count
+
+    def stats(self, meter_id, start_time=None, end_time=None):
+        """Count, sum, first and last reading value in the window."""
+        count = 0
+        total = 0.0
+        first = None
+        last = None
+
+        for segment in self._segments(meter_id, start_time, end_time):
+            lo, hi = segment.bounds(start_time, end_time)
+
+            if lo >= hi:
+                continue
+
+            if hi - lo == len(segment):
+                total += segment.sum
+            else:
+                values = segment.values
+
+                for i in range(lo, hi):
+                    total += values[i]
+
+            if first is None:
+                first = segment.values[lo]
+
+            last = segment.values[hi - 1]
+            count += hi - lo
+
+        return {"count": count, "sum": total, "first": first, "last": last}
+
+    def ids(self, meter_id, start_time=None, end_time=None):
+        """Reading ids in time order."""
+        for segment in self._segments(meter_id, start_time, end_time):
+            lo, hi = segment.bounds(start_time, end_time)
+            ids = segment.ids
+
+            for i in range(lo, hi):
+                yield ids[i]
+
+    def average_daily_rate(self, meter_id, daily_rate):
+        """
+        AdrHelper.calculate_average_daily_rate over the packed readings, with
+        daily_rate(previous time, previous value, time, value) giving each
+        rate; the first reading counts as a rate of 0.
+        """
+        count = 0
+        total = 0.0
+        previous_time = 0
+        previous_value = 0.0
+
+        for segment in self.series.get(meter_id, ()):
+            times = segment.times
+            values = segment.values
+
+            for i in range(len(times)):
+                if count > 0:
+                    total += daily_rate(previous_time, previous_value, times[i], values[i])
+
+                previous_time = times[i]
+                previous_value = values[i]
+                count += 1
+
+        if count == 0:
+            return 0
+
+        return total / count
+
+    def _segments(self, meter_id, start_time, end_time):
+        for segment in self.series.get(meter_id, ()):
+            if start_time is not None and segment.max_time < start_time:
+                continue
+
+            if end_time is not None and segment.min_time > end_time:
+                break
+
+            yield segment
+
+    def _segment_index(self, segments, time, id):
+        # First segment whose last reading is at or after (time, id)
+        lo = 0
+        hi = len(segments) - 1
+
+        while lo < hi:
+            mid = (lo + hi) >> 1
+
+            if segments[mid].last_key() < (time, id):
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
@@ -63,7 +63,8 @@ class AssetController:
                             "ClientId": savedAsset["clientId"],                                                                        
                             "EntityType":"Asset",
                             "Operation":"Update",                        
-                            "Entity" : json.dumps(result)                            
+                            "Entity" : json.dumps(result),
+                            "entityId": id
                           }
             
             for topic in self.topics:
@@ -88,6 +89,9 @@ class AssetController:
         result = await self.assetDao.GetAllAssets()
         return result
 
+    def IterAllAssets(self, offset=0, limit=None):
+        return self.assetDao.IterAllAssets(offset, limit)
+
     async def DeleteAllAssets(self):
         result = await self.assetDao.DeleteAllAssets()
         return result
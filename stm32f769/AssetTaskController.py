@@ -62,7 +62,8 @@ class AssetTaskController:
                             "ClientId": savedAssetTask["clientId"],                                                                        
                             "EntityType":"AssetTask",
                             "Operation":"Update",                        
-                            "Entity" : json.dumps(result)                            
+                            "Entity" : json.dumps(result),
+                            "entityId": id
                           }
             
             for topic in self.topics:
@@ -87,6 +88,9 @@ class AssetTaskController:
         result = await self.assetTaskDao.GetAllAssetTasks()
         return result
 
+    def IterAllAssetTasks(self, offset=0, limit=None):
+        return self.assetTaskDao.IterAllAssetTasks(offset, limit)
+
     async def DeleteAllAssetTasks(self):
         print("Deleting all Asset Tasks...")
         result = await self.assetTaskDao.DeleteAllAssetTasks()
@@ -3,23 +3,49 @@ from MeterReading import MeterReading
 from btree_hybrid_disk_cache import BTree
 import time, utime
 from AdrHelperNew import AdrHelper
+from adr_aggregates import AdrAggregates
+
+# Separates the parts of a secondary index key; it sorts below every
+# printable character, so all keys of one meter form one contiguous range.
+INDEX_SEP = '\x1f'
 
 class MeterReadingDaoBT:
     def __init__(self, treeDepth, dir):
         self.db = BTree(t = treeDepth, cache_dir=dir)
+        # Secondary index keyed by meterId, readingOn and id
+        self.indexDb = BTree(t = treeDepth, cache_dir=dir)
         self.adrHelper = AdrHelper()                
+        # Running per-meter ADR, each meter loaded from the index on first use
+        self.adrAggregates = AdrAggregates(self.adrHelper, self.indexDb, self._adrEntryById, INDEX_SEP)
        
     async def AddMeterReading(self, meterReading):
         db = self.db
         meterReading["id"] = str(time.time_ns())                
         db.insert((meterReading["id"], meterReading))
+        self._addToAdr(meterReading)
+        self.indexDb.insert((self._indexKey(meterReading), meterReading["id"]))
         newMeterReading = await self.GetMeterReadingById(meterReading["id"])
         
         return newMeterReading
 
     async def UpdateMeterReading(self, id, meterReading):
         db = self.db
-        db.update_value(id, meterReading)        
+        savedMeterReading = db.find(id)
+
+        if (savedMeterReading != None):
+            self._removeFromAdr(savedMeterReading)
+            db.update_value(id, meterReading)
+            oldKey = self._indexKey(savedMeterReading)
+            newKey = self._indexKey(meterReading)
+
+            if (oldKey != newKey):
+                self.indexDb.delete(self.indexDb.root, (oldKey,))
+
+            self._addToAdr(meterReading)
+
+            if (oldKey != newKey):
+                self.indexDb.insert((newKey, id))
+        
         
         updatedMeterReading = await self.GetMeterReadingById(id)
         
@@ -31,12 +57,24 @@ class MeterReadingDaoBT:
         return savedMeterReading
 
     async def GetAllMeterReadings(self):
-        db = self.db
         result = []
         
-        for key in db:
-            meter = db.find(key)
-            result.append(json.loads(meter))
+        for meterReading in self.IterAllMeterReadings():
+            result.append(meterReading)
+            
+        return result
+
+    def IterAllMeterReadings(self, offset=0, limit=None):
+        # One at a time in id order, for callers that stream the result
+        return self.db.iter_values(offset=offset, limit=limit)
+
+    async def GetMeterReadingsInWindow(self, startNs, endNs):
+        db = self.db
+        result = []
+
+        # Reading ids are insert times in ns, so a time window is a key range
+        for key, meterReading in db.range(str(startNs), str(endNs)):
+            result.append(meterReading)
             
         return result
 
@@ -47,9 +85,12 @@ class MeterReadingDaoBT:
     async def DeleteMeterReading(self, id):
         db = self.db        
         result = "MeterReading not found..."
+        savedMeterReading = db.find(id)
 
-        if (db.find(id) != None):
+        if (savedMeterReading != None):
+            self._removeFromAdr(savedMeterReading)
             db.delete(db.root, (id,))                            
+            self.indexDb.delete(self.indexDb.root, (self._indexKey(savedMeterReading),))
             result = "MeterReading deleted..."            
 
         return result                    
@@ -57,39 +98,93 @@ class MeterReadingDaoBT:
     async def DeleteAllMeterReadings(self):
         db = self.db        
         db.delete_all()
+        self.indexDb.delete_all()
+        self.adrAggregates.clear()
         
         result = "All MeterReadings deleted..."            
         return result
+
+    async def ImportMeterReadings(self, meterReadings):
+        db = self.db
+        db.delete_all()
+
+        # The hybrid tree has no bulk loader, so readings are inserted in key order
+        for meterReading in sorted(meterReadings, key=lambda meterReading: meterReading["id"]):
+            db.insert((meterReading["id"], meterReading))
+
+        self.RebuildIndex()
+        
+        return db.count_all()
     
     async def GetReadingsForMeter(self, meterId):
         db = self.db
-        filter_func = lambda reading: str(reading["meterId"]) == str(meterId)
-        meter_readings = db.traverse_func(filter_func)
+        meter_readings = []
+
+        # Index order is by readingOn within the meter
+        for key, id in self._indexRange(meterId):
+            meter_readings.append(db.find(id))
         
         return meter_readings
     
     async def GetReadingIdsForMeter(self, meterId):
-        readingCount = await self.GetReadingCountForMeter(meterId)
-        
-        if (readingCount <= 0):
-            return None
-        
-        readings = await self.GetReadingsForMeter(meterId)        
         readingIds = []
 
-        for reading in readings:
-            readingIds.append(reading["id"])
+        for key, id in self._indexRange(meterId):
+            readingIds.append(id)
+
+        if (len(readingIds) <= 0):
+            return None
 
         return readingIds
     
     async def GetReadingCountForMeter(self, meterId):
-        db = self.db
-        filter_func = lambda reading: str(reading["meterId"]) == str(meterId)
-        readings = db.traverse_func(filter_func)
-        
-        return len(readings)
+        # Subtree counts make this O(log n) whatever the meter's size
+        return self.indexDb.count_range(*self._indexBounds(meterId))
+
+    def RebuildIndex(self):
+        index = self.indexDb
+        index.delete_all()
+
+        for key, meterReading in self.db.range():
+            index.insert((self._indexKey(meterReading), key))
+
+        # Meters are loaded again from the new index when next used
+        self.adrAggregates.clear()
+
+    def _adrEntry(self, meterReading):
+        try:
+            readingTime = self.adrHelper.convert_to_epoch_seconds(meterReading["readingOn"])
+        except (KeyError, ValueError):
+            readingTime = 0
+
+        return (readingTime, meterReading["reading"])
+
+    def _adrEntryById(self, id):
+        return self._adrEntry(self.db.find(id))
+
+    def _addToAdr(self, meterReading):
+        # Before the reading's key goes into the index
+        self.adrAggregates.add(str(meterReading["meterId"]), self._indexKey(meterReading), *self._adrEntry(meterReading))
+
+    def _removeFromAdr(self, meterReading):
+        # While the reading and its index key are still stored
+        self.adrAggregates.remove(str(meterReading["meterId"]), self._indexKey(meterReading), *self._adrEntry(meterReading))
+
+    def _indexKey(self, meterReading):
+        return INDEX_SEP.join((str(meterReading["meterId"]), str(meterReading.get("readingOn", "")), meterReading["id"]))
+
+    def _indexBounds(self, meterId):
+        meterId = str(meterId)
+        return meterId + INDEX_SEP, meterId + chr(ord(INDEX_SEP) + 1)
+
+    def _indexRange(self, meterId):
+        return self.indexDb.range(*self._indexBounds(meterId))
 
     async def GetAdr(self, meterId):    
+        return self.adrAggregates.adr(str(meterId))
+
+    async def RecomputeAdr(self, meterId):
+        # Full recompute from the stored readings, to verify the aggregates
         meterReadings = await self.GetReadingsForMeter(meterId)
         meterReadings = self.adrHelper.sort_json_objects_by_date(meterReadings)
         adr = self.adrHelper.calculate_average_daily_rate(meterReadings)
@@ -0,0 +1,166 @@
+import json
+from MeterReading import MeterReading
+import time
+import utime
+from AdrHelper import AdrHelper
+from timeseries_store import TimeSeriesStore
+
+class MeterReadingDaoTS:
+    def __init__(self, btree, meterDao):
+        # The tree keeps the full readings by id; the series store holds the
+        # time and value of each, packed per meter, for the history queries
+        self.db = btree
+        self.meterDao = meterDao
+        self.series = TimeSeriesStore()
+        self.seriesChecked = False
+        self.adrHelper = AdrHelper()
+
+    async def AddMeterReading(self, meterReading):
+        db = self.db
+        meterReading["id"] = str(time.time_ns())
+        meter = await self.meterDao.GetMeterById(str(meterReading["meterId"]))
+
+        if (meter == None):
+            newMeterReading = None
+        else:
+            self._checkSeries()
+            db.insert((meterReading["id"], meterReading))
+            self._addToSeries(meterReading)
+            newMeterReading = await self.GetMeterReadingById(meterReading["id"])
+
+        return newMeterReading
+
+    async def UpdateMeterReading(self, id, meterReading):
+        db = self.db
+        self._checkSeries()
+        savedMeterReading = db.find(id)
+
+        if (db.update_value(id, meterReading) == True):
+            self._removeFromSeries(savedMeterReading)
+            self._addToSeries(meterReading)
+
+        updatedMeterReading = await self.GetMeterReadingById(id)
+
+        return updatedMeterReading
+
+    async def GetMeterReadingById(self, id):
+        db = self.db
+        savedMeterReading = db.find(id)
+        return savedMeterReading
+
+    async def GetAllMeterReadings(self):
+        result = []
+
+        for meterReading in self.IterAllMeterReadings():
+            result.append(meterReading)
+
+        return result
+
+    def IterAllMeterReadings(self, offset=0, limit=None):
+        # One at a time in id order, for callers that stream the result
+        return self.db.iter_values(offset=offset, limit=limit)
+
+    async def GetMeterReadingsInWindow(self, startNs, endNs):
+        db = self.db
+        result = []
+
+        # Reading ids are insert times in ns, so a time window is a key range
+        for key, meterReading in db.range(str(startNs), str(endNs)):
+            result.append(meterReading)
+
+        return result
+
+    async def GetMeterReadingCount(self):
+        db = self.db
+        return db.count_all()
+
+    async def DeleteMeterReading(self, id):
+        db = self.db
+        result = "MeterReading not found..."
+        self._checkSeries()
+        savedMeterReading = db.find(id)
+
+        if (savedMeterReading != None):
+            db.delete(id)
+            self._removeFromSeries(savedMeterReading)
+            result = "MeterReading deleted..."
+
+        return result
+
+    async def DeleteAllMeterReadings(self):
+        db = self.db
+        db.delete_all()
+        self.series.clear()
+
+        result = "All MeterReadings deleted..."
+        return result
+
+    async def ImportMeterReadings(self, meterReadings):
+        db = self.db
+        meterReadings = sorted(meterReadings, key=lambda meterReading: meterReading["id"])
+        db.bulk_load((meterReading["id"], meterReading) for meterReading in meterReadings)
+        self.RebuildSeries()
+
+        return db.count_all()
+
+    async def GetReadingsForMeter(self, meterId):
+        db = self.db
+        meter_readings = []
+        self._checkSeries()
+
+        for id in self.series.ids(str(meterId)):
+            meter_readings.append(db.find(str(id)))
+
+        return meter_readings
+
+    async def GetAdr(self, meterId):
+        self._checkSeries()
+        adr = self.series.average_daily_rate(str(meterId), self.adrHelper.daily_rate)
+        return adr
+
+    async def GetReadingCountForMeter(self, meterId):
+        self._checkSeries()
+        return self.series.count(str(meterId))
+
+    async def GetReadingIdsForMeter(self, meterId):
+        self._checkSeries()
+        readingIds = [str(id) for id in self.series.ids(str(meterId))]
+
+        if (len(readingIds) <= 0):
+            return None
+
+        return readingIds
+
+    async def GetReadingStatsForMeter(self, meterId, startTime=None, endTime=None):
+        # Times are epoch seconds, both ends inclusive
+        self._checkSeries()
+        stats = self.series.stats(str(meterId), startTime, endTime)
+        stats["meterId"] = meterId
+        return stats
+
+    def RebuildSeries(self):
+        self.series.clear()
+
+        for key, meterReading in self.db.range():
+            self._addToSeries(meterReading)
+
+        self.seriesChecked = True
+
+    def _checkSeries(self):
+        # The series live in memory only and are built from the tree once
+        if (self.seriesChecked == False):
+            self.RebuildSeries()
+
+    def _readingTime(self, meterReading):
+        try:
+            return self.adrHelper.convert_to_epoch_seconds(meterReading["readingOn"])
+        except (KeyError, ValueError):
+            return 0
+
+    def _addToSeries(self, meterReading):
+        self.series.add(str(meterReading["meterId"]), self._readingTime(meterReading),
+                        float(meterReading["reading"]), int(meterReading["id"]))
+
+    def _removeFromSeries(self, meterReading):
+        self.series.remove(str(meterReading["meterId"]), self._readingTime(meterReading),
+                           int(meterReading["id"]))
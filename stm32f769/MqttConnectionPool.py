@@ -1,20 +1,236 @@
 from mqtt_as_latest import MQTTClient, config
 import random
+import time
+import uasyncio as asyncio
+
+# Circuit breaker states of a broker
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class BrokerState:
+    def __init__(self, broker, client):
+        self.broker = broker
+        self.client = client
+        self.has_connected = False
+        self.in_flight = 0
+        self.latency_ms = 0.0
+        self.published = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.circuit = CLOSED
+        self.opened_at = 0
+        self.probing = False
+
+    def connected(self):
+        return self.has_connected and self.client.isconnected()
+
+    def to_dict(self):
+        return {
+            'connected': self.connected(),
+            'circuit': self.circuit,
+            'in_flight': self.in_flight,
+            'latency_ms': self.latency_ms,
+            'published': self.published,
+            'failures': self.failures
+        }
 
 class MqttConnectionPool:
-    def __init__(self, mqttBrokers):
+    """
+    Publishes over one connection per broker, routed by broker health.
+
+    Initialise() connects the brokers in turn until one is up, which also
+    brings up Wi-Fi, then the rest at once; the pool starts as long as one
+    of them is up. Publish() takes the better of two random healthy
+    brokers, the one with fewer publishes in flight and then the lower
+    average (EWMA) latency. A publish that fails or has no PUBACK within
+    `publish_timeout_ms` is retried on the next broker. After
+    `failure_threshold` failures in a row a broker's circuit opens and it
+    gets no traffic for `open_ms`; then a single publish probes it, and
+    closes the circuit again if it succeeds. Brokers never reached are
+    left out of Publish() entirely; run() retries their connect every
+    `open_ms`, bounded by `connect_timeout_ms`.
+    """
+    def __init__(self, mqttBrokers, publish_timeout_ms=5000, failure_threshold=3, open_ms=10000, latency_weight=0.2,
+                 connect_timeout_ms=30000):
         self.mqttBrokers = mqttBrokers
         self.mqttConnectionPool = {}
+        self.publish_timeout_ms = publish_timeout_ms
+        self.connect_timeout_ms = connect_timeout_ms
+        self.failure_threshold = failure_threshold
+        self.open_ms = open_ms
+        self.latency_weight = latency_weight
+        self.brokers = {}
+        self.failovers = 0
 
     async def Initialise(self):
         for broker in self.mqttBrokers:
-            config['server'] = broker
-            mqtt_client = MQTTClient(config)
-            await mqtt_client.connect()
-            print("Connected to broker: " + str(broker))
-            self.mqttConnectionPool[broker] = mqtt_client
-                        
+            # Each client keeps its own copy, the module config is shared
+            brokerConfig = dict(config)
+            brokerConfig['server'] = broker
+            self.brokers[broker] = BrokerState(broker, MQTTClient(brokerConfig))
+
+        states = list(self.brokers.values())
+
+        # One at a time until Wi-Fi is up, so the clients don't all bring it up
+        while states and not await self._connect(states.pop(0)):
+            pass
+
+        await asyncio.gather(*[self._connect(state) for state in states])
+
+        if not self.mqttConnectionPool:
+            raise OSError("no MQTT broker connected")
+
+    async def run(self):
+        """Reconnects brokers that were never reached, off the publish path."""
+        while True:
+            await asyncio.sleep_ms(self.open_ms)
+            now = time.ticks_ms()
+
+            for state in self.brokers.values():
+                if not state.has_connected and time.ticks_diff(now, state.opened_at) >= self.open_ms:
+                    await self._connect(state)
+
+    async def _connect(self, state):
+        try:
+            await asyncio.wait_for(state.client.connect(), self.connect_timeout_ms / 1000)
+        except (OSError, asyncio.TimeoutError) as e:
+            print("failed to connect to broker:" + str(state.broker) + " " + repr(e))
+            self._failed(state)
+            return False
+
+        print("Connected to broker: " + str(state.broker))
+        state.has_connected = True
+        state.consecutive_failures = 0
+        state.circuit = CLOSED
+        self.mqttConnectionPool[state.broker] = state.client
+        return True
+
     async def Publish(self, topic, message):
-        brokerIndex = random.randint(0, len(self.mqttBrokers) - 1)
-        mqttClient = self.mqttConnectionPool[self.mqttBrokers[brokerIndex]]
-        await mqttClient.publish(topic, message, qos = 1)            
+        tried = []
+        waited_ms = 0
+
+        while True:
+            state = self._choose(tried)
+
+            if state is None:
+                if tried or waited_ms >= self.publish_timeout_ms:
+                    raise OSError("no MQTT broker available")
+
+                # Every broker is down or reconnecting, give them a moment
+                await asyncio.sleep_ms(100)
+                waited_ms += 100
+                continue
+
+            if tried:
+                self.failovers += 1
+
+            tried.append(state)
+
+            if await self._publish(state, topic, message):
+                return
+
+    def isconnected(self):
+        """True while Publish() has a broker to send to or to probe."""
+        now = time.ticks_ms()
+
+        for state in self.brokers.values():
+            if not state.has_connected:
+                continue
+
+            if state.circuit == CLOSED:
+                if state.connected():
+                    return True
+            elif state.circuit == HALF_OPEN:
+                if not state.probing:
+                    return True
+            elif time.ticks_diff(now, state.opened_at) >= self.open_ms:
+                return True
+
+        return False
+
+    def _choose(self, tried):
+        now = time.ticks_ms()
+        healthy = []
+
+        for state in self.brokers.values():
+            if state in tried or not state.has_connected:
+                continue
+
+            if state.circuit == OPEN and time.ticks_diff(now, state.opened_at) >= self.open_ms:
+                state.circuit = HALF_OPEN
+
+            if state.circuit == HALF_OPEN:
+                if not state.probing:
+                    state.probing = True
+                    return state
+            elif state.connected():
+                healthy.append(state)
+
+        if len(healthy) < 2:
+            return healthy[0] if healthy else None
+
+        # Power of two choices: compare two brokers picked at random
+        i = random.randint(0, len(healthy) - 1)
+        j = random.randint(0, len(healthy) - 2)
+
+        if j >= i:
+            j += 1
+
+        a = healthy[i]
+        b = healthy[j]
+
+        if (b.in_flight, b.latency_ms) < (a.in_flight, a.latency_ms):
+            return b
+
+        return a
+
+    async def _publish(self, state, topic, message):
+        state.in_flight += 1
+        start = time.ticks_ms()
+
+        try:
+            await asyncio.wait_for(state.client.publish(topic, message, qos = 1), self.publish_timeout_ms / 1000)
+        except (OSError, asyncio.TimeoutError) as e:
+            print("publish to broker:" + str(state.broker) + " failed " + repr(e))
+
+            if isinstance(e, asyncio.TimeoutError):
+                # The cancelled publish may have stopped halfway through a
+                # packet; drop the connection so mqtt_as starts a clean one
+                state.client.reset()
+
+            self._failed(state)
+            return False
+        finally:
+            state.in_flight -= 1
+
+        elapsed_ms = time.ticks_diff(time.ticks_ms(), start)
+
+        if state.published == 0:
+            state.latency_ms = elapsed_ms
+        else:
+            state.latency_ms += self.latency_weight * (elapsed_ms - state.latency_ms)
+
+        state.published += 1
+        state.consecutive_failures = 0
+        state.circuit = CLOSED
+        state.probing = False
+        return True
+
+    def _failed(self, state):
+        state.failures += 1
+        state.consecutive_failures += 1
+
+        # A broker never reached is not reconnected by its client, only by run()
+        if (state.circuit == HALF_OPEN or not state.has_connected or
+                state.consecutive_failures >= self.failure_threshold):
+            state.circuit = OPEN
+            state.opened_at = time.ticks_ms()
+
+        state.probing = False
+
+    def stats(self):
+        return {
+            'failovers': self.failovers,
+            'brokers': dict((broker, state.to_dict()) for broker, state in self.brokers.items())
+        }
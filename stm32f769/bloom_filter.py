@@ -0,0 +1,103 @@
+import math
+import ujson as json
+import uhashlib as hashlib
+from ubinascii import a2b_base64, b2a_base64
+
+BLOOM_HASHES = 4
+
+class BloomFilter:
+    """
+    Bit array answering "definitely absent" or "maybe present" for a key.
+
+    The trees consult it before walking root to leaf, so a lookup of a
+    missing key usually costs no node reads. Bit positions come from one
+    sha256 of the key by double hashing. Deleted keys stay set, which only
+    raises the false-positive rate until the next rebuild.
+    """
+    def __init__(self, bits, hashes=BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray((bits + 7) // 8)
+        self.entries = 0
+        self.checks = 0
+        self.negatives = 0
+        self.false_positives = 0
+
+    def _positions(self, key):
+        if isinstance(key, float) and key == int(key):
+            # 1.0 and 1 are the same key to the trees
+            key = int(key)
+
+        data = key.encode('utf-8') if isinstance(key, str) else json.dumps(key).encode('utf-8')
+        digest = hashlib.sha256(data).digest()
+        h1 = digest[0] | digest[1] << 8 | digest[2] << 16
+        h2 = digest[3] | digest[4] << 8 | digest[5] << 16 | 1
+
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, key):
+        data = self.data
+
+        for position in self._positions(key):
+            data[position >> 3] |= 1 << (position & 7)
+
+        self.entries += 1
+
+    def might_contain(self, key):
+        data = self.data
+        self.checks += 1
+
+        for position in self._positions(key):
+            if not data[position >> 3] & (1 << (position & 7)):
+                self.negatives += 1
+                return False
+
+        return True
+
+    def false_positive(self):
+        """Records a 'maybe present' answer for a key the tree did not have."""
+        self.false_positives += 1
+
+    def clear(self):
+        self.data = bytearray(len(self.data))
+        self.entries = 0
+
+    def to_meta(self):
+        return {
+            'bits': self.bits,
+            'hashes': self.hashes,
+            'entries': self.entries,
+            'data': b2a_base64(self.data).decode().strip()
+        }
+
+    def load_meta(self, meta):
+        """Takes the filter saved by to_meta; returns False if it doesn't fit."""
+        if meta.get('bits') != self.bits or meta.get('hashes') != self.hashes:
+            return False
+
+        data = a2b_base64(meta['data'])
+
+        if len(data) != len(self.data):
+            return False
+
+        self.data = bytearray(data)
+        self.entries = meta['entries']
+        return True
+
+    def estimated_fp_rate(self):
+        return (1 - math.exp(-self.hashes * self.entries / self.bits)) ** self.hashes
+
+    def stats(self):
+        lookups = self.negatives + self.false_positives
+
+        return {
+            'bits': self.bits,
+            'entries': self.entries,
+            'checks': self.checks,
+            'negatives': self.negatives,
+            'false_positives': self.false_positives,
+            # Share of lookups for missing keys that still reached the tree
+            'fp_rate': self.false_positives / lookups if lookups else 0.0,
+            'estimated_fp_rate': self.estimated_fp_rate()
+        }
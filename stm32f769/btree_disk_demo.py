@@ -41,6 +41,7 @@ data.append('i')
 data.append('j')
 
 useRam = True
+usePaged = False
 
 if (useRam == True):
     rootDir = '/rb'    
@@ -57,7 +58,7 @@ else:
 
 ramBefore = free(True)
 start = time.time()
-B = BTree(5, dir)
+B = BTree(5, dir, paged=usePaged)
 itemCount = 1
 idList = []
 reading = 1
@@ -455,6 +455,9 @@ class MQTT_base:
         if self._sock is not None:
             self._sock.close()
 
+    def reset(self):  # API. Drop the connection; it is reconnected as after an outage.
+        self._reconnect()
+
     def close(self):  # API. See https://github.com/peterhinch/micropython-mqtt/issues/60
         self._close()
         try:
@@ -805,7 +808,7 @@ class MQTTClient(MQTT_base):
                     await asyncio.sleep(2)  # Wait for broker to disconnect
                     self.dprint("About to reconnect with unclean session.")
             await self._connect(is_clean)
-        except Exception:
+        except BaseException:  # Also a connect cancelled by a timeout
             self._close()
             self._in_connect = False  # Caller may run .isconnected()
             raise
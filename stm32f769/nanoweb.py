@@ -1,6 +1,9 @@
 import uasyncio as asyncio
 import uerrno
 import ujson
+import uos
+
+FILE_BUFFER_SIZE = 1024
 
 class HttpError(Exception):
     pass
@@ -13,8 +16,14 @@ class Request:
         self.headers = {}
         self.body = {}    
         self.route = ""
+        self.query = {}
+        self.params = {}
+        self.version = ""
+        self.body_left = 0
         self.read = None
+        self.readinto = None
         self.write = None
+        self.response = None
         self.close = None
 
 
@@ -29,23 +38,497 @@ async def error(request, code, reason):
     await request.write("<h1>%s</h1>" % (reason))
 
 
-async def send_file(request, filename, segment=64, binary=False):
+def parse_query(request):
+    """Moves a ?name=value&... query string off request.url into request.query."""
+    url, sep, query = request.url.partition('?')
+    request.url = url
+
+    for pair in query.split('&'):
+        if pair:
+            name, sep, value = pair.partition('=')
+            request.query[name] = value
+
+
+class JsonArrayWriter:
+    """
+    Writes a JSON array one element at a time through a fixed bytearray,
+    so a large result is never held as one string. With `chunked` every
+    flush is framed as an HTTP/1.1 chunk.
+    """
+    def __init__(self, request, chunked=True, buffer_size=512):
+        self.request = request
+        self.chunked = chunked
+        self.buf = bytearray(buffer_size)
+        self.view = memoryview(self.buf)
+        self.pos = 0
+        self.count = 0
+
+    async def flush(self):
+        if self.pos:
+            await self._send(self.view[:self.pos])
+            self.pos = 0
+
+    async def _send(self, data):
+        if self.chunked:
+            await self.request.write("%x\r\n" % len(data))
+            await self.request.write(data)
+            await self.request.write("\r\n")
+        else:
+            await self.request.write(data)
+
+    async def _put(self, data):
+        if self.pos + len(data) > len(self.buf):
+            await self.flush()
+
+            if len(data) > len(self.buf):
+                # Larger than the whole buffer, so it goes out on its own
+                await self._send(data)
+                return
+
+        self.buf[self.pos:self.pos + len(data)] = data
+        self.pos += len(data)
+
+    async def start(self):
+        await self._put(b'[')
+
+    async def add(self, item):
+        if self.count:
+            await self._put(b',')
+
+        await self._put(ujson.dumps(item).encode('utf-8'))
+        self.count += 1
+
+    async def end(self):
+        await self._put(b']')
+        await self.flush()
+
+        if self.chunked:
+            await self.request.write("0\r\n\r\n")
+
+
+async def send_json_array(request, items, buffer_size=512):
+    """
+    Sends `items`, any iterable such as a tree iterator, as a 200 JSON array
+    response serialised one element at a time. HTTP/1.1 clients get chunked
+    transfer encoding; HTTP/1.0 ones read until the connection closes.
+    Other requests can write to the tree while this one is sent; its
+    iterators then carry on after the last key sent, so each entity goes
+    out once and in key order.
+    """
+    chunked = request.version == "HTTP/1.1"
+    await request.write("HTTP/1.1 200 OK\r\n")
+    await request.write("Content-Type: application/json\r\n")
+
+    if chunked:
+        await request.write("Transfer-Encoding: chunked\r\n")
+
+    await request.write("\r\n")
+    writer = JsonArrayWriter(request, chunked, buffer_size)
+    await writer.start()
+
+    for item in items:
+        await writer.add(item)
+
+    await writer.end()
+
+
+# Spare file buffers, so streaming a file allocates nothing once warmed up
+file_buffers = []
+
+
+def take_buffer(size):
+    for i in range(len(file_buffers)):
+        if len(file_buffers[i]) == size:
+            return file_buffers.pop(i)
+
+    return bytearray(size)
+
+
+def give_buffer(buf):
+    if len(file_buffers) < 2:
+        file_buffers.append(buf)
+
+
+async def send_file(request, filename, segment=FILE_BUFFER_SIZE, binary=True, start=0, length=None):
+    """
+    Streams `length` bytes of the file from `start`, or all of it, through
+    one reused buffer of `segment` bytes filled by readinto. Each write
+    waits for the socket to drain before the buffer is refilled. The file
+    is always read as bytes; `binary` is kept for existing callers.
+    """
+    buf = take_buffer(segment)
+    view = memoryview(buf)
+
     try:
-        with open(filename, 'rb' if binary else 'r') as f:
-            while True:
-                data = f.read(segment)
-                if not data:
+        with open(filename, 'rb') as f:
+            if start:
+                f.seek(start)
+
+            while length is None or length > 0:
+                n = f.readinto(view if length is None or length >= segment else view[:length])
+
+                if not n:
                     break
-                await request.write(data)
+
+                await request.write(view[:n])
+
+                if length is not None:
+                    length -= n
     except OSError as e:
         if e.args[0] != uerrno.ENOENT:
             raise
         raise HttpError(request, 404, "File Not Found")
+    finally:
+        give_buffer(buf)
+
+
+def parse_range(value, size):
+    """
+    Inclusive (start, end) of a single 'bytes=' Range header clipped to
+    `size`; None if the header is malformed or asks for several ranges, so
+    the whole file is sent, and () if the range lies past the end.
+    """
+    unit, sep, spec = value.partition('=')
+
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+
+    first, sep, last = spec.strip().partition('-')
+
+    if not sep:
+        return None
+
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+
+            if start >= size:
+                return ()
+
+            if end < start:
+                return None
+        else:
+            suffix = int(last)
+
+            if suffix == 0:
+                return ()
+
+            start = max(0, size - suffix)
+            end = size - 1
+    except ValueError:
+        return None
+
+    return start, min(end, size - 1)
+
+
+async def serve_file(request, filename, content_type='application/octet-stream', headers=None,
+                     buffer_size=FILE_BUFFER_SIZE):
+    """
+    Sends a file as a complete response with its Content-Length, or the
+    206 part asked for by a Range header so an interrupted download can
+    resume. `headers` is a dict of extra response headers.
+    """
+    try:
+        size = uos.stat(filename)[6]
+    except OSError:
+        raise HttpError(request, 404, "File Not Found")
+
+    start = 0
+    end = size - 1
+    byte_range = request.headers.get('Range')
+
+    if byte_range:
+        byte_range = parse_range(byte_range, size)
+
+        if byte_range == ():
+            await request.write("HTTP/1.1 416 Range Not Satisfiable\r\n")
+            await request.write("Content-Range: bytes */%d\r\n\r\n" % size)
+            return
+
+    if byte_range:
+        start, end = byte_range
+        await request.write("HTTP/1.1 206 Partial Content\r\n")
+        await request.write("Content-Range: bytes %d-%d/%d\r\n" % (start, end, size))
+    else:
+        await request.write("HTTP/1.1 200 OK\r\n")
+
+    await request.write("Content-Type: %s\r\n" % content_type)
+    await request.write("Accept-Ranges: bytes\r\n")
+
+    if headers:
+        for name, value in headers.items():
+            await request.write("%s: %s\r\n" % (name, value))
+
+    await request.write("Content-Length: %d\r\n\r\n" % (end - start + 1))
+    await send_file(request, filename, buffer_size, start=start, length=end - start + 1)
+
+
+async def receive_file(request, f, buffer_size=FILE_BUFFER_SIZE):
+    """
+    Copies the rest of a streamed request body, request.body_left bytes,
+    into the open file `f` through one reused buffer filled by readinto.
+    """
+    buf = take_buffer(buffer_size)
+    view = memoryview(buf)
+
+    try:
+        while request.body_left > 0:
+            n = await request.readinto(view[:min(request.body_left, buffer_size)])
+
+            if not n:
+                raise HttpError(request, 400, "Bad Request")
+
+            f.write(view[:n])
+            request.body_left -= n
+    finally:
+        give_buffer(buf)
+
+
+def wants_keep_alive(request):
+    connection = request.headers.get('Connection', '').lower()
+
+    if request.version == "HTTP/1.1":
+        return connection != 'close'
+
+    return connection == 'keep-alive'
+
+
+class ResponseWriter:
+    """
+    Frames a handler's response for a persistent connection. Handlers
+    still write the status line and headers themselves; the header block
+    is held until it is complete, then a response carrying its own
+    Content-Length or chunked encoding streams straight through. Any other
+    body is buffered up to `buffer_size` bytes so finish() can send it with
+    a Content-Length; a larger one goes out as is and the connection
+    closes after it, as does raw output with no status line.
+    """
+    def __init__(self, writer, buffer_size=1024):
+        self.writer = writer
+        self.buffer_size = buffer_size
+        self.keep_alive = False
+        self.head = b''
+        self.body = None
+        self.streaming = False
+        self.bytes = 0
+
+    async def write(self, data):
+        if type(data) == str:
+            data = data.encode()
+
+        self.bytes += len(data)
+
+        if self.streaming:
+            await self.writer.awrite(data)
+            return
+
+        if self.body is None:
+            if not self.head and not b'HTTP/'.startswith(bytes(data[:5])):
+                self.keep_alive = False
+                self.streaming = True
+                await self.writer.awrite(data)
+                return
+
+            self.head += bytes(data)
+            end = self.head.find(b'\r\n\r\n')
+
+            if end < 0:
+                return
+
+            data = self.head[end + 4:]
+            self.head = self.head[:end]
+            self.body = bytearray()
+            headers = self.head.lower()
+
+            if b'\r\ncontent-length:' in headers or b'\r\ntransfer-encoding: chunked' in headers:
+                await self._start(data)
+                return
+
+        if len(self.body) + len(data) > self.buffer_size:
+            # Too big to measure, so nothing but closing marks its end
+            self.keep_alive = False
+            await self._start(self.body)
+            await self.writer.awrite(data)
+            return
+
+        self.body.extend(data)
+
+    async def _start(self, data):
+        self.streaming = True
+        await self.writer.awrite(self.head)
+        await self.writer.awrite("\r\nConnection: %s\r\n\r\n" % (
+            'keep-alive' if self.keep_alive else 'close'))
+
+        if data:
+            await self.writer.awrite(data)
+
+    def status(self):
+        """Status code the handler wrote, or 0 before a status line."""
+        try:
+            return int(self.head[9:12]) if self.head.startswith(b'HTTP/') else 0
+        except ValueError:
+            return 0
+
+    def discard(self):
+        """Drops a response not sent yet, so an error response can replace it."""
+        if self.streaming:
+            self.keep_alive = False
+        else:
+            self.head = b''
+            self.body = None
+
+    async def finish(self):
+        """Sends what is held back; returns True if the connection stays open."""
+        if not self.streaming:
+            if self.body is None:
+                # No complete header block, so nothing marks where it ends
+                self.keep_alive = False
+                self.streaming = True
+
+                if self.head:
+                    await self.writer.awrite(self.head)
+
+                return False
+
+            self.head += ("\r\nContent-Length: %d" % len(self.body)).encode()
+            await self._start(self.body)
+
+        return self.keep_alive
+
+
+ROUTE_CONVERTERS = {'str': str, 'int': int}
+
+
+class RouteNode:
+    def __init__(self):
+        self.children = {}
+        self.params = []
+        self.handler = None
+        self.wildcard = None
+        self.slash_wildcard = None
+
+
+def split_path(path):
+    return (path[1:] if path.startswith('/') else path).split('/')
+
+
+class RouteTrie:
+    """
+    Routes compiled into a tree of url segments. A segment matches
+    literally, or binds a path parameter when written {name} or
+    {name:int}; a route ending in /* matches anything below its prefix.
+    With slash_wildcards, as handle_x uses, a route ending in / also
+    matches anything below it and the url without the trailing slash.
+    match() walks the url once, trying literal segments before parameters
+    and the deepest wildcard last, and returns (route, handler, params).
+    """
+    def __init__(self):
+        self.root = RouteNode()
+        # Wildcards that cut a segment, such as /api/dl*, stay a prefix scan
+        self.partial = []
+
+    def add(self, route, handler):
+        if route.endswith('*'):
+            prefix = route[:-1]
+
+            if prefix.endswith('/'):
+                self._node(split_path(prefix)[:-1]).wildcard = (route, handler)
+            else:
+                self.partial.append((prefix, route, handler))
+            return
+
+        segments = split_path(route)
+        self._node(segments).handler = (route, handler)
+
+        if route.endswith('/'):
+            # handle_x also treats /api/items/ as /api/items/* and /api/items
+            self._node(segments[:-1]).slash_wildcard = (route, handler)
+
+    def _node(self, segments):
+        node = self.root
+
+        for segment in segments:
+            if segment.startswith('{') and segment.endswith('}'):
+                name, sep, kind = segment[1:-1].partition(':')
+                convert = ROUTE_CONVERTERS[kind or 'str']
+
+                for param in node.params:
+                    if param[0] == name and param[1] is convert:
+                        node = param[2]
+                        break
+                else:
+                    child = RouteNode()
+                    node.params.append((name, convert, child))
+                    node = child
+            else:
+                child = node.children.get(segment)
+
+                if child is None:
+                    child = node.children[segment] = RouteNode()
+
+                node = child
+
+        return node
+
+    def match(self, url, slash_wildcards=False):
+        match = self._match(self.root, split_path(url), 0, {}, slash_wildcards)
+
+        if match is None:
+            for prefix, route, handler in self.partial:
+                if url.startswith(prefix):
+                    return route, handler, {}
+
+        return match
+
+    def _match(self, node, segments, i, params, slash_wildcards):
+        if i == len(segments):
+            if node.handler is not None:
+                return node.handler + (params,)
+
+            # handle_x also routed the bare /api/items to /api/items/
+            if slash_wildcards and node.slash_wildcard is not None:
+                return node.slash_wildcard + (params,)
+
+            return None
+
+        segment = segments[i]
+        child = node.children.get(segment)
+
+        if child is not None:
+            match = self._match(child, segments, i + 1, params, slash_wildcards)
+
+            if match is not None:
+                return match
+
+        if segment:
+            for name, convert, child in node.params:
+                try:
+                    params[name] = convert(segment)
+                except ValueError:
+                    continue
+
+                match = self._match(child, segments, i + 1, params, slash_wildcards)
+
+                if match is not None:
+                    return match
+
+                del params[name]
+
+        wildcard = node.wildcard
+
+        if wildcard is None and slash_wildcards:
+            wildcard = node.slash_wildcard
+
+        return None if wildcard is None else wildcard + (params,)
 
 
 class Nanoweb:
-    extract_headers = ('Authorization', 'Content-Length', 'Content-Type')
-    routes = {}
+    extract_headers = ('Accept-Encoding', 'Authorization', 'Connection', 'Content-Length',
+                       'Content-Type', 'If-None-Match', 'Range')
+    # Bodies of these types are left for the handler to stream, e.g. with
+    # receive_file(); any other body is read and parsed as JSON up front
+    stream_content_types = ('application/octet-stream',)
     assets_extensions = ('html', 'css', 'js')
 
     callback_request = None
@@ -54,17 +537,55 @@ class Nanoweb:
     STATIC_DIR = './'
     INDEX_FILE = STATIC_DIR + 'index.html'
 
+    # A metrics.Metrics here times and counts every routed request
+    metrics = None
+
+    # An asset_cache.AssetCache here serves the index and static files with
+    # headers, ETags and gzip variants instead of as raw file contents
+    asset_cache = None
+
+    # Persistent connections: seconds to wait for the next request, requests
+    # answered per connection, and the largest body given a Content-Length
+    keep_alive_timeout = 5
+    max_requests = 20
+    response_buffer = 1024
+
     def __init__(self, port=80, address='0.0.0.0'):
         self.port = port
         self.address = address
+        self.routes = {}
+
+    @property
+    def routes(self):
+        return self._routes
+
+    @routes.setter
+    def routes(self, routes):
+        """Replaces all routes, compiling them into a new trie"""
+        self._routes = {}
+        self.route_trie = RouteTrie()
+
+        for route, handler in routes.items():
+            self.add_route(route, handler)
+
+    def add_route(self, route, handler):
+        """Registers a route; routes added to the dict directly are not seen"""
+        self._routes[route] = handler
+        self.route_trie.add(route, handler)
 
     def route(self, route):
         """Route decorator"""
         def decorator(func):
-            self.routes[route] = func
+            self.add_route(route, func)
             return func
         return decorator
 
+    async def send_asset(self, request, path):
+        if self.asset_cache is not None:
+            await self.asset_cache.send(request, path)
+        else:
+            await send_file(request, path, binary=True)
+
     async def generate_output(self, request, handler):
         """Generate output from handler
         `handler` can be :
@@ -74,6 +595,12 @@ class Nanoweb:
            is the template context
          * callable, the output of which is sent to the client
         """
+        if self.metrics is not None:
+            return await self.metrics.observe(request, self.render_output(request, handler))
+
+        return await self.render_output(request, handler)
+
+    async def render_output(self, request, handler):
         while True:
             if isinstance(handler, dict):
                 self.logMsg("generate_output...dict")                                            
@@ -109,193 +636,229 @@ class Nanoweb:
         return
         print(msg)
         
+    async def serve(self, reader, writer, handle_request):
+        """
+        Answers requests on one connection until the client or a response
+        asks to close, it has been idle for keep_alive_timeout seconds or it
+        has served max_requests. Pipelined requests are read and answered
+        one after another, so their responses keep the request order.
+        """
+        served = 0
+
+        try:
+            while True:
+                if served:
+                    try:
+                        items = await asyncio.wait_for(reader.readline(), self.keep_alive_timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    items = await reader.readline()
+
+                served += 1
+
+                if not await handle_request(reader, writer, items, served < self.max_requests):
+                    break
+        except OSError as e:
+            # Skip ECONNRESET error (client abort request)
+            if e.args[0] != uerrno.ECONNRESET:
+                raise
+        finally:
+            await writer.aclose()
+
     async def handle_x(self, reader, writer):
-        items = await reader.readline()
+        await self.serve(reader, writer, self.handle_x_request)
+
+    async def handle_x_request(self, reader, writer, items, more):
         self.logMsg("Reader...first readline" + str(items))        
         items = items.decode('ascii').split()
         
         if len(items) != 3:
-            return
+            return False
 
         request = Request()
+        response = ResponseWriter(writer, self.response_buffer)
         #self.logMsg("new request...headers")
         #self.logMsg(request.headers)
         request.read = reader.read
-        request.write = writer.awrite
+        request.readinto = reader.readinto
+        request.write = response.write
+        request.response = response
         request.close = writer.aclose
         request.method, request.url, version = items
+        request.version = version
+        parse_query(request)
         self.logMsg("Method: " + request.method)
         self.logMsg("URL: " + request.url)
         self.logMsg("Version: " + version)        
 
         try:
-            try:
-                if version not in ("HTTP/1.0", "HTTP/1.1"):
-                    raise HttpError(request, 505, "Version Not Supported")
+            if version not in ("HTTP/1.0", "HTTP/1.1"):
+                raise HttpError(request, 505, "Version Not Supported")
 
-                while True:
-                    items = await reader.readline()
-                    self.logMsg("Reader...second readline" + str(items))                            
-                    items = items.decode('ascii').split(":", 1)
-
-                    if len(items) == 2:
-                        self.logMsg("2 items...")                                                    
-                        header, value = items
-                        value = value.strip()
-                        self.logMsg("Header: " + header)                        
-                        self.logMsg("Value: " + value)
-
-                        if header in self.extract_headers:
-                            request.headers[header] = value
-                            
-                        self.logMsg(request.headers)
-                    elif len(items) == 1:
-                        self.logMsg("1 item...")                                                    
+            while True:
+                items = await reader.readline()
+                self.logMsg("Reader...second readline" + str(items))                            
+                items = items.decode('ascii').split(":", 1)
+
+                if len(items) == 2:
+                    self.logMsg("2 items...")                                                    
+                    header, value = items
+                    value = value.strip()
+                    self.logMsg("Header: " + header)                        
+                    self.logMsg("Value: " + value)
+
+                    if header in self.extract_headers:
+                        request.headers[header] = value
+                        
+                    self.logMsg(request.headers)
+                elif len(items) == 1:
+                    self.logMsg("1 item...")                                                    
 #                        self.logMsg("1 item left: " + str(items))
  #                       self.logMsg("request.headers: " + str(type(request.headers)))
-                        self.logMsg(request.headers)
-                       
-                        if (request.headers.get('Content-Length') != None
-                                and request.headers.get('Content-Length') != '0'):
-                            self.logMsg("Content-Length present... " + value)                            
-                            bytesleft = int(request.headers.get('Content-Length', 0))
-                            self.logMsg("Todo item bytes left..." + str(bytesleft))
-                            body = await reader.read(bytesleft)
-                            body = body.decode()
-                            
-                            try:
-                                self.logMsg("Body:\r\n" + str(body))                
-                                parsed = ujson.loads(str(body))
-                                request.body = parsed
-                            except (ValueError, TypeError):
-                                print("json parsing error")
-                                    
-                        break                        
-                
-                if self.callback_request:
-                    print("in callback_request")
-                    self.callback_request(request)
-
-                if request.url in self.routes:
-                    # 1. If current url exists in routes
-                    self.logMsg("route found: " + request.url)                    
-                    request.route = request.url
-                    await self.generate_output(request, self.routes[request.url])
+                    self.logMsg(request.headers)
+                   
+                    content_type = request.headers.get('Content-Type', '').split(';')[0].strip()
+
+                    if content_type in self.stream_content_types:
+                        request.body_left = int(request.headers.get('Content-Length', 0))
+                    elif (request.headers.get('Content-Length') != None
+                            and request.headers.get('Content-Length') != '0'):
+                        self.logMsg("Content-Length present... " + value)                            
+                        bytesleft = int(request.headers.get('Content-Length', 0))
+                        self.logMsg("Todo item bytes left..." + str(bytesleft))
+                        body = await reader.readexactly(bytesleft)
+                        body = body.decode()
+                        
+                        try:
+                            self.logMsg("Body:\r\n" + str(body))                
+                            parsed = ujson.loads(str(body))
+                            request.body = parsed
+                        except (ValueError, TypeError):
+                            print("json parsing error")
+                                
+                    break                        
+
+            response.keep_alive = more and wants_keep_alive(request)
+
+            if self.callback_request:
+                print("in callback_request")
+                self.callback_request(request)
+
+            match = self.route_trie.match(request.url, slash_wildcards=True)
+
+            if match is not None:
+                # 1. Exact, parameter or wildcard route, in one walk of the url
+                request.route, handler, request.params = match
+                self.logMsg("route found: " + request.route)
+                await self.generate_output(request, handler)
+            else:
+                # 2. Try to load index file
+                if request.url in ('', '/'):
+                    await self.send_asset(request, self.INDEX_FILE)
                 else:
-                    # 2. Search url in routes with wildcard
-                    for route, handler in self.routes.items():
-                        if (route == request.url or request.url.startswith(route[:-1])):
-#                            or (route[-1] == '*' and
-                                #or request.url.startswith(route[:-1]):
-                            request.route = route
-                            self.logMsg("wildcard route found: " + request.url)                                                
-                            await self.generate_output(request, handler)
+                    # 3. Current url have an assets extension ?
+                    for extension in self.assets_extensions:
+                        if request.url.endswith('.' + extension):
+                            await self.send_asset(
+                                request,
+                                '%s/%s' % (
+                                    self.STATIC_DIR,
+                                    request.url,
+                                ),
+                            )
                             break
                     else:
-                        # 3. Try to load index file
-                        if request.url in ('', '/'):
-                            await send_file(request, self.INDEX_FILE)
-                        else:
-                            # 4. Current url have an assets extension ?
-                            for extension in self.assets_extensions:
-                                if request.url.endswith('.' + extension):
-                                    await send_file(
-                                        request,
-                                        '%s/%s' % (
-                                            self.STATIC_DIR,
-                                            request.url,
-                                        ),
-                                        binary=True,
-                                    )
-                                    break
-                            else:
-                                raise HttpError(request, 404, "File Not Found")
-            except HttpError as e:
-                request, code, message = e.args
-                await self.callback_error(request, code, message)
-        except OSError as e:
-            # Skip ECONNRESET error (client abort request)
-            if e.args[0] != uerrno.ECONNRESET:
-                raise
-        finally:
-            await writer.aclose()
+                        raise HttpError(request, 404, "File Not Found")
+        except HttpError as e:
+            request, code, message = e.args
+            response.discard()
+            await self.callback_error(request, code, message)
+
+        if request.body_left:
+            # The next request would start inside the unread body
+            response.keep_alive = False
+
+        return await response.finish()
 
     async def handle(self, reader, writer):
-        items = await reader.readline()
+        await self.serve(reader, writer, self.handle_request)
+
+    async def handle_request(self, reader, writer, items, more):
         items = items.decode('ascii').split()
         if len(items) != 3:
-            return
+            return False
 
         request = Request()
+        response = ResponseWriter(writer, self.response_buffer)
         request.read = reader.read
-        request.write = writer.awrite
+        request.readinto = reader.readinto
+        request.write = response.write
+        request.response = response
         request.close = writer.aclose
 
         request.method, request.url, version = items
+        request.version = version
+        parse_query(request)
 
         try:
-            try:
-                if version not in ("HTTP/1.0", "HTTP/1.1"):
-                    raise HttpError(request, 505, "Version Not Supported")
+            if version not in ("HTTP/1.0", "HTTP/1.1"):
+                raise HttpError(request, 505, "Version Not Supported")
 
-                while True:
-                    items = await reader.readline()
-                    items = items.decode('ascii').split(":", 1)
+            while True:
+                items = await reader.readline()
+                items = items.decode('ascii').split(":", 1)
 
-                    if len(items) == 2:
-                        header, value = items
-                        value = value.strip()
+                if len(items) == 2:
+                    header, value = items
+                    value = value.strip()
 
-                        if header in self.extract_headers:
-                            request.headers[header] = value
-                    elif len(items) == 1:
-                        break
+                    if header in self.extract_headers:
+                        request.headers[header] = value
+                elif len(items) == 1:
+                    break
+
+            # Handlers read their own body here
+            request.body_left = int(request.headers.get('Content-Length', 0))
+            response.keep_alive = more and wants_keep_alive(request)
+
+            if self.callback_request:
+                self.callback_request(request)
 
-                if self.callback_request:
-                    self.callback_request(request)
+            match = self.route_trie.match(request.url)
 
-                if request.url in self.routes:
-                    # 1. If current url exists in routes
-                    request.route = request.url
-                    await self.generate_output(request,
-                                               self.routes[request.url])
+            if match is not None:
+                # 1. Exact, parameter or wildcard route, in one walk of the url
+                request.route, handler, request.params = match
+                await self.generate_output(request, handler)
+            else:
+                # 2. Try to load index file
+                if request.url in ('', '/'):
+                    await self.send_asset(request, self.INDEX_FILE)
                 else:
-                    # 2. Search url in routes with wildcard
-                    for route, handler in self.routes.items():
-                        if route == request.url \
-                            or (route[-1] == '*' and
-                                request.url.startswith(route[:-1])):
-                            request.route = route
-                            await self.generate_output(request, handler)
+                    # 3. Current url have an assets extension ?
+                    for extension in self.assets_extensions:
+                        if request.url.endswith('.' + extension):
+                            await self.send_asset(
+                                request,
+                                '%s/%s' % (
+                                    self.STATIC_DIR,
+                                    request.url,
+                                ),
+                            )
                             break
                     else:
-                        # 3. Try to load index file
-                        if request.url in ('', '/'):
-                            await send_file(request, self.INDEX_FILE)
-                        else:
-                            # 4. Current url have an assets extension ?
-                            for extension in self.assets_extensions:
-                                if request.url.endswith('.' + extension):
-                                    await send_file(
-                                        request,
-                                        '%s/%s' % (
-                                            self.STATIC_DIR,
-                                            request.url,
-                                        ),
-                                        binary=True,
-                                    )
-                                    break
-                            else:
-                                raise HttpError(request, 404, "File Not Found")
-            except HttpError as e:
-                request, code, message = e.args
-                await self.callback_error(request, code, message)
-        except OSError as e:
-            # Skip ECONNRESET error (client abort request)
-            if e.args[0] != uerrno.ECONNRESET:
-                raise
-        finally:
-            await writer.aclose()
-            
+                        raise HttpError(request, 404, "File Not Found")
+        except HttpError as e:
+            request, code, message = e.args
+            response.discard()
+            await self.callback_error(request, code, message)
+
+        if request.body_left:
+            # The next request would start inside the unread body
+            response.keep_alive = False
+
+        return await response.finish()
+
     async def run(self):
         return await asyncio.start_server(self.handle_x, self.address, self.port)
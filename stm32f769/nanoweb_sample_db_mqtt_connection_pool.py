@@ -4,7 +4,7 @@ import time
 import sys
 import uasyncio as asyncio
 import gc
-from nanoweb import HttpError, Nanoweb, send_file
+from nanoweb import HttpError, Nanoweb, receive_file, send_file, send_json_array, serve_file
 from ubinascii import a2b_base64 as base64_decode
 import uhashlib
 import ubinascii
@@ -21,6 +21,21 @@ from ramblock import RAMBlockDevExt
 useMem = True
 useRAMDisk = False
 useSDDisk = False
+usePagedStorage = False
+_nodeCacheSize = 0
+useWal = False
+_bloomBits = 0
+useLsmForMeterReadings = False
+useTimeSeriesForMeterReadings = False
+_treeSyncSeconds = 5
+useAssetCache = True
+useMetrics = True
+_metricsPublishSeconds = 0
+useEventOutbox = False
+_coalesceEvents = False
+useStoreForward = False
+_storeForwardMaxBytes = 65536
+_storeForwardMaxAgeSeconds = 24 * 3600
 
 #mem cache
 if ((useMem == True) & (useRAMDisk == False)):
@@ -33,6 +48,8 @@ if ((useMem == True) & (useRAMDisk == False)):
 elif ((useMem == False) & ((useRAMDisk == True) | (useSDDisk == True))):
     #from btree_disk import BTree
     from bplus_tree import BPlusTree as BTree    
+    if (useLsmForMeterReadings == True):
+        from lsm_tree import LSMTree
     from ToDoDaoBTCustomMem import ToDoDaoBT
     from AssetDaoBTCustomMem import AssetDaoBT
     from AssetTaskDaoBTCustomMem import AssetTaskDaoBT
@@ -46,6 +63,21 @@ else:
     from MeterDaoBTCustomDiskCache import MeterDaoBT
     from MeterReadingDaoBTCustomDiskCache import MeterReadingDaoBT
 
+if (useTimeSeriesForMeterReadings == True):
+    from MeterReadingDaoTimeSeries import MeterReadingDaoTS
+
+if (useAssetCache == True):
+    from asset_cache import AssetCache
+
+if (useMetrics == True):
+    from metrics import Metrics
+
+if (useEventOutbox == True):
+    from event_outbox import EventOutbox, entity_update_key
+
+if (useStoreForward == True):
+    from store_forward import StoreForwardQueue
+
 from MqttConnectionPool import MqttConnectionPool
 import pyb
 
@@ -68,6 +100,27 @@ _error_q = {}
 _success_q = {}
 _in_hash_md5 = uhashlib.sha256()
 fout = None
+assetCache = None
+diskBTrees = []
+lsmTrees = []
+mqttConnectionPool = None
+eventOutbox = None
+storeForwardQueue = None
+metrics = None
+
+if (useMetrics == True):
+    metrics = Metrics()
+
+# Coroutines of the controllers and DAOs timed by the metrics
+TODO_CALLS = ('AddItem', 'UpdateItem', 'GetItemById', 'GetAllItems', 'GetItemCount', 'DeleteItem', 'DeleteAllItems')
+ASSET_CALLS = ('AddAsset', 'UpdateAsset', 'GetAssetById', 'GetAllAssets', 'GetAssetCount', 'DeleteAsset', 'DeleteAllAssets')
+ASSET_TASK_CALLS = ('AddAssetTask', 'UpdateAssetTask', 'GetAssetTaskById', 'GetAllAssetTasks', 'GetAssetTaskCount',
+                    'DeleteAssetTask', 'DeleteAllAssetTasks')
+METER_CALLS = ('AddMeter', 'UpdateMeter', 'GetMeterById', 'GetAllMeters', 'GetMeterCount', 'DeleteMeter', 'DeleteAllMeters',
+               'GetAdr')
+METER_READING_CALLS = ('AddMeterReading', 'UpdateMeterReading', 'GetMeterReadingById', 'GetAllMeterReadings',
+                       'GetMeterReadingCount', 'DeleteMeterReading', 'DeleteAllMeterReadings', 'GetMeterReadingsInWindow',
+                       'GetReadingsForMeter', 'GetAdr')
 
 async def Init(backupDir):
     global toDoController
@@ -76,34 +129,54 @@ async def Init(backupDir):
     global meterReadingController        
     global assetTaskController    
     global dbName
+    global mqttConnectionPool
+    global eventOutbox
+    global storeForwardQueue
 
     if ((useMem == True) | (useRAMDisk == True) | (useSDDisk == True)):
         if ((useRAMDisk == True) | (useSDDisk == True)):
             toDoDir = backupDir + "/todo"
-            toDoBTree = BTree(_treeDepth, toDoDir, 'toDo.json')
+            toDoBTree = BTree(_treeDepth, toDoDir, 'toDo.json', paged=usePagedStorage, cache_size=_nodeCacheSize, wal=useWal, bloom_bits=_bloomBits)
             
             assetDir = backupDir + "/asset"
-            assetBTree = BTree(_treeDepth, assetDir, 'asset.json')
+            assetBTree = BTree(_treeDepth, assetDir, 'asset.json', paged=usePagedStorage, cache_size=_nodeCacheSize, wal=useWal, bloom_bits=_bloomBits)
             
             assetTaskDir = backupDir + "/assetTask"            
-            assetTaskBTree = BTree(_treeDepth, assetTaskDir, 'assetTask.json')
+            assetTaskBTree = BTree(_treeDepth, assetTaskDir, 'assetTask.json', paged=usePagedStorage, cache_size=_nodeCacheSize, wal=useWal, bloom_bits=_bloomBits)
             
             meterDir = backupDir + "/meter"                        
-            meterBTree = BTree(_treeDepth, meterDir, 'meter.json')
+            meterBTree = BTree(_treeDepth, meterDir, 'meter.json', paged=usePagedStorage, cache_size=_nodeCacheSize, wal=useWal, bloom_bits=_bloomBits)
             
             meterReadingDir = backupDir + "/meterReading"                                    
-            meterReadingBTree = BTree(_treeDepth, meterReadingDir, 'meterReading.json')
+            if (useLsmForMeterReadings == True):
+                # Log-structured store for the append-heavy readings
+                meterReadingBTree = LSMTree(_treeDepth, meterReadingDir + "Lsm")
+                lsmTrees.append(meterReadingBTree)
+            else:
+                meterReadingBTree = BTree(_treeDepth, meterReadingDir, 'meterReading.json', paged=usePagedStorage, cache_size=_nodeCacheSize, wal=useWal, bloom_bits=_bloomBits)
+
+            meterReadingIndexDir = backupDir + "/meterReadingIndex"
+            meterReadingIndexBTree = BTree(_treeDepth, meterReadingIndexDir, 'meterReadingIndex.json', paged=usePagedStorage, cache_size=_nodeCacheSize, wal=useWal, bloom_bits=_bloomBits)
+            diskBTrees.extend([toDoBTree, assetBTree, assetTaskBTree, meterBTree, meterReadingIndexBTree])
+
+            if (useLsmForMeterReadings == False):
+                diskBTrees.append(meterReadingBTree)
         elif (useMem == True):            
             toDoBTree = BTree(_treeDepth)
             assetBTree = BTree(_treeDepth)
             assetTaskBTree = BTree(_treeDepth)
             meterBTree = BTree(_treeDepth)
             meterReadingBTree = BTree(_treeDepth)
+            meterReadingIndexBTree = BTree(_treeDepth)
         
         toDoDao = ToDoDaoBT(toDoBTree)
         assetDao = AssetDaoBT(assetBTree)
         meterDao = MeterDaoBT(meterBTree)
-        meterReadingDao = MeterReadingDaoBT(meterReadingBTree, meterDao)                        
+        if (useTimeSeriesForMeterReadings == True):
+            # Packed per-meter series for the ADR, count and range queries
+            meterReadingDao = MeterReadingDaoTS(meterReadingBTree, meterDao)
+        else:
+            meterReadingDao = MeterReadingDaoBT(meterReadingBTree, meterDao, indexBTree=meterReadingIndexBTree)                        
         assetTaskDao = AssetTaskDaoBT(assetTaskBTree, assetDao)
     else:
         toDoDao = ToDoDaoBT(_treeDepth, backupDir)
@@ -112,14 +185,42 @@ async def Init(backupDir):
         meterDao = MeterDaoBT(_treeDepth, backupDir)
         meterReadingDao = MeterReadingDaoBT(_treeDepth, backupDir)                        
         
+    if (metrics != None):
+        # Time the DAO calls under their class names
+        toDoDao = metrics.wrap(toDoDao, "ToDoDao", TODO_CALLS)
+        assetDao = metrics.wrap(assetDao, "AssetDao", ASSET_CALLS)
+        assetTaskDao = metrics.wrap(assetTaskDao, "AssetTaskDao", ASSET_TASK_CALLS)
+        meterDao = metrics.wrap(meterDao, "MeterDao", METER_CALLS)
+        meterReadingDao = metrics.wrap(meterReadingDao, "MeterReadingDao", METER_READING_CALLS)
+
     topics = ['/entities']
     mqttConnectionPool = MqttConnectionPool(MQTT_BROKERS)
-    await mqttConnectionPool.Initialise()
-    toDoController = ToDoController(mqttConnectionPool, toDoDao, topics)
-    assetTaskController = AssetTaskController(mqttConnectionPool, assetTaskDao, topics)        
-    assetController = AssetController(mqttConnectionPool, assetDao, topics, assetTaskController)
-    meterReadingController = MeterReadingController(mqttConnectionPool, meterReadingDao, topics)            
-    meterController = MeterController(mqttConnectionPool, meterDao, topics, meterReadingController)
+    publisher = mqttConnectionPool
+
+    if (useStoreForward == True):
+        # Events are kept on flash or SD until a broker takes them; main() connects the pool
+        storeForwardQueue = StoreForwardQueue(mqttConnectionPool, backupDir + "/outbox", max_bytes=_storeForwardMaxBytes, max_age_s=_storeForwardMaxAgeSeconds)
+        publisher = storeForwardQueue
+    else:
+        await mqttConnectionPool.Initialise()
+
+    if (useEventOutbox == True):
+        # Controllers queue their events and return; batches go out in the background
+        eventOutbox = EventOutbox(publisher, coalesce_key=entity_update_key if (_coalesceEvents == True) else None)
+        publisher = eventOutbox
+
+    toDoController = ToDoController(publisher, toDoDao, topics)
+    assetTaskController = AssetTaskController(publisher, assetTaskDao, topics)        
+    assetController = AssetController(publisher, assetDao, topics, assetTaskController)
+    meterReadingController = MeterReadingController(publisher, meterReadingDao, topics)            
+    meterController = MeterController(publisher, meterDao, topics, meterReadingController)
+
+    if (metrics != None):
+        toDoController = metrics.wrap(toDoController, "ToDoController", TODO_CALLS)
+        assetTaskController = metrics.wrap(assetTaskController, "AssetTaskController", ASSET_TASK_CALLS)
+        assetController = metrics.wrap(assetController, "AssetController", ASSET_CALLS)
+        meterReadingController = metrics.wrap(meterReadingController, "MeterReadingController", METER_READING_CALLS)
+        meterController = metrics.wrap(meterController, "MeterController", METER_CALLS)
 
 async def get_time():
     uptime_s = int(time.ticks_ms() / 1000)
@@ -140,6 +241,15 @@ async def api_send_response(request, code=200, message="OK"):
     await request.write("Content-Type: application/json\r\n\r\n")
     await request.write('{"status": true}')
 
+def page_args(request):
+    # Optional ?offset=&limit= paging for the GET-all endpoints
+    try:
+        offset = int(request.query.get('offset', 0))
+        limit = request.query.get('limit')
+        return offset, None if limit is None else int(limit)
+    except ValueError:
+        raise HttpError(request, 400, "Bad Request")
+
 def authenticate(credentials):
     async def fail(request):
         await request.write("HTTP/1.1 401 Unauthorized\r\n")
@@ -195,6 +305,35 @@ async def api_status(request):
     }))
 
 
+@authenticate(credentials=CREDENTIALS)
+async def api_metrics(request):
+    if (metrics == None):
+        raise HttpError(request, 404, "File Not Found")
+
+    if (request.query.get('format') == 'prometheus'):
+        await request.write("HTTP/1.1 200 OK\r\n")
+        await request.write("Content-Type: text/plain; version=0.0.4\r\n\r\n")
+
+        for line in metrics.prometheus_lines():
+            await request.write(line)
+    else:
+        await request.write("HTTP/1.1 200 OK\r\n")
+        await request.write("Content-Type: application/json\r\n\r\n")
+        await request.write(json.dumps(metrics.to_dict()))
+
+
+@authenticate(credentials=CREDENTIALS)
+async def api_brokers(request):
+    await request.write("HTTP/1.1 200 OK\r\n")
+    await request.write("Content-Type: application/json\r\n\r\n")
+    stats = mqttConnectionPool.stats()
+
+    if (storeForwardQueue != None):
+        stats['queue'] = storeForwardQueue.stats()
+
+    await request.write(json.dumps(stats))
+
+
 @authenticate(credentials=CREDENTIALS)
 async def api_ls(request):
     await request.write("HTTP/1.1 200 OK\r\n")
@@ -203,14 +342,23 @@ async def api_ls(request):
         '"' + f + '"' for f in sorted(os.listdir('.'))
     ))
 
+def backup_file(request):
+    """Path of the backup file named by the rest of the URL, kept inside the storage directory."""
+    filename = request.url[len(request.route.rstrip("*")) - 1:].strip("/")
+
+    if '..' in filename.split('/'):
+        raise HttpError(request, 400, "Bad Request")
+
+    if (useMem == True) or not filename:
+        raise HttpError(request, 404, "File Not Found")
+
+    return dir + '/' + filename
+
 @authenticate(credentials=CREDENTIALS)
 async def api_download(request):
-    await request.write("HTTP/1.1 200 OK\r\n")
-    filename = request.url[len(request.route.rstrip("*")) - 1:].strip("/")        
-    await request.write("Content-Type: application/octet-stream\r\n")
-    await request.write("Content-Disposition: attachment; filename=%s\r\n\r\n"
-                        % filename)
-    await send_file(request, filename)
+    filename = backup_file(request)
+    await serve_file(request, filename,
+                     headers={"Content-Disposition": "attachment; filename=%s" % filename.split('/')[-1]})
 
 @authenticate(credentials=CREDENTIALS)
 async def api_download_all(request):
@@ -251,21 +399,17 @@ async def upload(request):
     if request.method != "PUT":
         raise HttpError(request, 501, "Not Implemented")
 
-    bytesleft = int(request.headers.get('Content-Length', 0))
-
-    if not bytesleft:
+    if not request.body_left:
         await request.write("HTTP/1.1 204 No Content\r\n\r\n")
         return
 
-    output_file = request.url[len(request.route.rstrip("*")) - 1:].strip("\/")
+    output_file = backup_file(request)
     tmp_file = output_file + '.tmp'
 
     try:
+        # Sent as application/octet-stream, so the body is still unread
         with open(tmp_file, 'wb') as o:
-            while bytesleft > 0:
-                chunk = await request.read(min(bytesleft, 64))
-                o.write(chunk)
-                bytesleft -= len(chunk)
+            await receive_file(request, o)
             o.flush()
     except OSError as e:
         raise HttpError(request, 500, "Internal error")
@@ -285,31 +429,21 @@ async def upload(request):
 
 @authenticate(credentials=CREDENTIALS)
 async def file_assets(request):
-    await request.write("HTTP/1.1 200 OK\r\n")
-
-    args = {}
-
     filename = request.url.split('/')[-1]
-    if filename.endswith('.png'):
-        args = {'binary': True}
-
-    await request.write("\r\n")
-
-    await send_file(
-        request,
-        './%s/%s' % (EXAMPLE_ASSETS_DIR, filename),
-        **args,
-    )
+    await send_asset(request, './%s/%s' % (EXAMPLE_ASSETS_DIR, filename))
 
 
 @authenticate(credentials=CREDENTIALS)
 async def index(request):
-    await request.write(b"HTTP/1.1 200 Ok\r\n\r\n")
+    await send_asset(request, './%s/index.html' % EXAMPLE_ASSETS_DIR)
 
-    await send_file(
-        request,
-        './%s/index.html' % EXAMPLE_ASSETS_DIR,
-    )
+
+async def send_asset(request, path):
+    if (assetCache != None):
+        await assetCache.send(request, path)
+    else:
+        await request.write("HTTP/1.1 200 OK\r\n\r\n")
+        await send_file(request, path)
 
 @authenticate(credentials=CREDENTIALS)
 async def todo_items(request):
@@ -318,8 +452,6 @@ async def todo_items(request):
     result = "{}"
     
     if request.method == "POST":
-        urlParts = request.url.split('/')
-        
         if (dataKey in payload):        
             item = json.loads(payload[dataKey])
             result = await toDoController.AddItem(payload["mqttSessionId"], item)
@@ -328,12 +460,13 @@ async def todo_items(request):
         await request.write("Content-Type: application/json\r\n\r\n")        
         await request.write(json.dumps(result))
     elif request.method == "GET":
-        urlParts = request.url.split('/')
-        id = urlParts[3]        
+        id = request.params.get('id', '')
 
-        # Return all items
+        # Stream all items, or one page of them
         if (id == ""):
-            result = await toDoController.GetAllItems()
+            offset, limit = page_args(request)
+            await send_json_array(request, toDoController.IterAllItems(offset, limit))
+            return
         elif (id == "count"):
             result = await toDoController.GetItemCount()
             print("item count..." + str(result))            
@@ -345,10 +478,8 @@ async def todo_items(request):
         await request.write("Content-Type: application/json\r\n\r\n")
         await request.write(json.dumps(result))
     elif request.method == "PUT":
-        urlParts = request.url.split('/')
-        #print("len urlparts = " + str(len(urlParts)))
         #print("url = " + request.url)
-        id = urlParts[3]
+        id = request.params.get('id', '')
         
         if (dataKey in payload):        
             item = json.loads(payload[dataKey])        
@@ -362,13 +493,7 @@ async def todo_items(request):
         await request.write(json.dumps(result))
         #print("api: done update item...: " + json.dumps(result))                        
     elif request.method == "DELETE":
-        urlParts = request.url.split('/')
-        id = ''
-        
-        print("len: " + str(len(urlParts)))
-        
-        if (len(urlParts) == 4):         
-            id = urlParts[3]
+        id = request.params.get('id', '')
 
         print("api: delete item...id: " + str(id))
         
@@ -390,8 +515,6 @@ async def assets(request):
     result = "{}"
     
     if request.method == "POST":
-        urlParts = request.url.split('/')
-        
         if (dataKey in payload):        
             asset = json.loads(payload[dataKey])        
             result = await assetController.AddAsset(payload["mqttSessionId"], asset)
@@ -400,12 +523,13 @@ async def assets(request):
         await request.write("Content-Type: application/json\r\n\r\n")        
         await request.write(json.dumps(result))        
     elif request.method == "GET":
-        urlParts = request.url.split('/')
-        id = urlParts[3]                
+        id = request.params.get('id', '')
 
-        # Return all assets
+        # Stream all assets, or one page of them
         if (id == ""):
-            result = await assetController.GetAllAssets()
+            offset, limit = page_args(request)
+            await send_json_array(request, assetController.IterAllAssets(offset, limit))
+            return
         elif (id == "count"):
             result = await assetController.GetAssetCount()
             print("asset count..." + str(result))                        
@@ -417,10 +541,8 @@ async def assets(request):
         await request.write("Content-Type: application/json\r\n\r\n")
         await request.write(json.dumps(result))
     elif request.method == "PUT":
-        urlParts = request.url.split('/')
-        
         if (dataKey in payload):
-            id = urlParts[3]            
+            id = request.params.get('id', '')
             asset = json.loads(payload[dataKey])        
             result = await assetController.UpdateAsset(payload["mqttSessionId"], id, asset)
 
@@ -432,11 +554,7 @@ async def assets(request):
         await request.write(json.dumps(result))
   #      print("api: done update asset...: " + json.dumps(result))                        
     elif request.method == "DELETE":
-        urlParts = request.url.split('/')
-        id = ''
-        
-        if (len(urlParts) == 4):         
-            id = urlParts[3]
+        id = request.params.get('id', '')
 
         if (id == ''):
             result = await assetController.DeleteAllAssets()
@@ -456,8 +574,6 @@ async def meters(request):
     result = "{}"
     
     if request.method == "POST":
-        urlParts = request.url.split('/')
-        
         if (dataKey in payload):        
             meter = json.loads(payload[dataKey])
             result = await meterController.AddMeter(payload["mqttSessionId"], meter)
@@ -466,39 +582,25 @@ async def meters(request):
         await request.write("Content-Type: application/json\r\n\r\n")        
         await request.write(json.dumps(result))        
     elif request.method == "GET":
-        urlParts = request.url.split('/')
-        print("url: " + request.url)
-        print("url parts: " + str(urlParts))                
-        id = urlParts[3]        
-        operation = ""
-        
-        print("adr: " + str(len(urlParts)))
+        id = request.params.get('id', '')
         
-        if (len(urlParts) == 6):
-            operation = urlParts[4]        
-
-        print("operation: " + str(operation))
-        
-        # Return all meters
+        # Stream all meters, or one page of them
         if (id == ""):
-            result = await meterController.GetAllMeters()
+            offset, limit = page_args(request)
+            await send_json_array(request, meterController.IterAllMeters(offset, limit))
+            return
         elif (id == "count"):
             result = await meterController.GetMeterCount()
         else:
-            if (operation == 'adr'):
-                result = await meterController.GetAdr(id, True)
-            else:                
-                id = id.replace("%22", "'")
-                result = await meterController.GetMeterById(id, True)
+            id = id.replace("%22", "'")
+            result = await meterController.GetMeterById(id, True)
             
         await request.write("HTTP/1.1 200 OK\r\n")
         await request.write("Content-Type: application/json\r\n\r\n")
         await request.write(json.dumps(result))
     elif request.method == "PUT":
-        urlParts = request.url.split('/')
-        
         if (dataKey in payload):        
-            id = urlParts[3]        
+            id = request.params.get('id', '')
             meter = json.loads(payload[dataKey])
             result = await meterController.UpdateMeter(payload["mqttSessionId"], id, meter)
 
@@ -510,11 +612,7 @@ async def meters(request):
         await request.write(json.dumps(result))
   #      print("api: done update meter...: " + json.dumps(result))                        
     elif request.method == "DELETE":
-        urlParts = request.url.split('/')
-        id = ''
-        
-        if (len(urlParts) == 4):         
-            id = urlParts[3]
+        id = request.params.get('id', '')
 
         if (id == ''):
             result = await meterController.DeleteAllMeters()
@@ -527,6 +625,16 @@ async def meters(request):
     else:
         raise HttpError(request, 501, "Not Implemented")
 
+@authenticate(credentials=CREDENTIALS)
+async def meter_adr(request):
+    if request.method != "GET":
+        raise HttpError(request, 501, "Not Implemented")
+
+    result = await meterController.GetAdr(request.params['id'], True)
+    await request.write("HTTP/1.1 200 OK\r\n")
+    await request.write("Content-Type: application/json\r\n\r\n")
+    await request.write(json.dumps(result))
+
 @authenticate(credentials=CREDENTIALS)
 async def asset_tasks(request):
     payload = request.body
@@ -534,8 +642,6 @@ async def asset_tasks(request):
     result = "{}"
     
     if request.method == "POST":
-        urlParts = request.url.split('/')
-        
         if (dataKey in payload):        
             assetTask = json.loads(payload[dataKey])
             result = await assetTaskController.AddAssetTask(payload["mqttSessionId"], assetTask)
@@ -544,12 +650,13 @@ async def asset_tasks(request):
         await request.write("Content-Type: application/json\r\n\r\n")        
         await request.write(json.dumps(result))        
     elif request.method == "GET":
-        urlParts = request.url.split('/')
-        id = urlParts[3]        
+        id = request.params.get('id', '')
         
-        # Return all asset tasks
+        # Stream all asset tasks, or one page of them
         if (id == ""):
-            result = await assetTaskController.GetAllAssetTasks()
+            offset, limit = page_args(request)
+            await send_json_array(request, assetTaskController.IterAllAssetTasks(offset, limit))
+            return
         elif (id == "count"):
             result = await assetTaskController.GetAssetTaskCount()            
         else:            
@@ -560,10 +667,8 @@ async def asset_tasks(request):
         await request.write("Content-Type: application/json\r\n\r\n")
         await request.write(json.dumps(result))
     elif request.method == "PUT":
-        urlParts = request.url.split('/')
-        
         if (dataKey in payload):
-            id = urlParts[3]
+            id = request.params.get('id', '')
             assetTask = json.loads(payload[dataKey])
             result = await assetTaskController.UpdateAssetTask(payload["mqttSessionId"], id, assetTask)
 
@@ -574,12 +679,7 @@ async def asset_tasks(request):
         await request.write("Content-Type: application/json\r\n\r\n")
         await request.write(json.dumps(result))
     elif request.method == "DELETE":
-        urlParts = request.url.split('/')
-        clientId = urlParts[3]        
-        id = ''
-        
-        if (len(urlParts) == 4):         
-            id = urlParts[3]
+        id = request.params.get('id', '')
         
         if (id == ''):
             result = await assetTaskController.DeleteAllAssetTasks()
@@ -599,8 +699,6 @@ async def meter_readings(request):
     result = "{}"
     
     if request.method == "POST":
-        urlParts = request.url.split('/')
-        
         if (dataKey in payload):        
             meterReading = json.loads(payload[dataKey])                        
             result = await meterReadingController.AddMeterReading(payload["mqttSessionId"], meterReading)
@@ -609,12 +707,13 @@ async def meter_readings(request):
         await request.write("Content-Type: application/json\r\n\r\n")        
         await request.write(json.dumps(result))        
     elif request.method == "GET":
-        urlParts = request.url.split('/')
-        id = urlParts[3]        
+        id = request.params.get('id', '')
 
-        # Return all meterReadings
+        # Stream all meterReadings, or one page of them
         if (id == ""):
-            result = await meterReadingController.GetAllMeterReadings()
+            offset, limit = page_args(request)
+            await send_json_array(request, meterReadingController.IterAllMeterReadings(offset, limit))
+            return
         elif (id == "count"):
             result = await meterReadingController.GetMeterReadingCount()
         else:
@@ -625,10 +724,8 @@ async def meter_readings(request):
         await request.write("Content-Type: application/json\r\n\r\n")
         await request.write(json.dumps(result))
     elif request.method == "PUT":
-        urlParts = request.url.split('/')
-        
         if (dataKey in payload):        
-            id = urlParts[3]
+            id = request.params.get('id', '')
             meterReading = json.loads(payload[dataKey])                                
             result = await meterReadingController.UpdateMeterReading(payload["mqttSessionId"], id, meterReading)
 
@@ -639,12 +736,7 @@ async def meter_readings(request):
         await request.write("Content-Type: application/json\r\n\r\n")
         await request.write(json.dumps(result))
     elif request.method == "DELETE":
-        urlParts = request.url.split('/')
-        clientId = urlParts[3]        
-        id = ''
-        
-        if (len(urlParts) == 4):         
-            id = urlParts[3]
+        id = request.params.get('id', '')
                
         if (id == ''):
             result = await meterReadingController.DeleteAllMeterReadings()
@@ -657,6 +749,16 @@ async def meter_readings(request):
     else:
         raise HttpError(request, 501, "Not Implemented")
 
+@authenticate(credentials=CREDENTIALS)
+async def meter_readings_window(request):
+    if request.method != "GET":
+        raise HttpError(request, 501, "Not Implemented")
+
+    result = await meterReadingController.GetMeterReadingsInWindow(request.params['startNs'], request.params['endNs'])
+    await request.write("HTTP/1.1 200 OK\r\n")
+    await request.write("Content-Type: application/json\r\n\r\n")
+    await request.write(json.dumps(result))
+
 def free(full=False):
 #    gc.collect()        
     F = gc.mem_free()
@@ -666,6 +768,27 @@ def free(full=False):
     if not full: return P
     else : return ('Total:{0} Free:{1} ({2})'.format(T,F,P))
 
+async def syncTrees():
+    # Write back nodes held dirty in the B-tree node caches and save the Bloom filters
+    while True:
+        await asyncio.sleep(_treeSyncSeconds)
+
+        for btree in diskBTrees:
+            btree.sync()
+
+async def publishMetrics():
+    # Snapshot of the request and call metrics for listeners on the brokers
+    while True:
+        await asyncio.sleep(_metricsPublishSeconds)
+        await mqttConnectionPool.Publish('/metrics', json.dumps(metrics.to_dict()))
+
+async def connectBrokers():
+    # Brokers that can't be reached now are retried by the pool's run() task
+    try:
+        await mqttConnectionPool.Initialise()
+    except OSError as e:
+        print("no MQTT broker connected yet: " + str(e))
+
 async def showMemUsage():
     while True:
         print(free(True))
@@ -691,18 +814,58 @@ async def main():
     loop.create_task(naw.run())
     loop.create_task(showMemUsage())
 
+    if ((_nodeCacheSize > 0) | (useWal == True) | (_bloomBits > 0)):
+        loop.create_task(syncTrees())
+
+    if ((metrics != None) & (_metricsPublishSeconds > 0)):
+        loop.create_task(publishMetrics())
+
+    if (eventOutbox != None):
+        loop.create_task(eventOutbox.run())
+
+    # Keeps retrying brokers that were down at start-up
+    loop.create_task(mqttConnectionPool.run())
+
+    if (storeForwardQueue != None):
+        loop.create_task(connectBrokers())
+        loop.create_task(storeForwardQueue.run())
+
+    if (useWal == True):
+        # Group commit for the trees' write-ahead logs
+        for btree in diskBTrees:
+            loop.create_task(btree.wal.run())
+
+    for lsmTree in lsmTrees:
+        # Group commit and background compaction
+        loop.create_task(lsmTree.wal.run())
+        loop.create_task(lsmTree.run())
+
     loop.run_forever()
 
 naw = Nanoweb(8001)
 naw.assets_extensions += ('ico',)
 naw.STATIC_DIR = EXAMPLE_ASSETS_DIR
+if (useAssetCache == True):
+    assetCache = AssetCache(EXAMPLE_ASSETS_DIR + '.etags.json')
+    naw.asset_cache = assetCache
+naw.metrics = metrics
 
 naw.routes = {
     '/api/todoitems/': todo_items,
+    '/api/todoitems/{id}': todo_items,
     '/api/assets/': assets,
+    '/api/assets/{id}': assets,
     '/api/assettasks/': asset_tasks,
+    '/api/assettasks/{id}': asset_tasks,
     '/api/meters/': meters,
-    '/api/meterreadings/': meter_readings
+    '/api/meters/{id}': meters,
+    '/api/meters/{id}/adr/': meter_adr,
+    '/api/meterreadings/': meter_readings,
+    '/api/meterreadings/{id}': meter_readings,
+    '/api/meterreadings/window/{startNs}/{endNs}': meter_readings_window,
+    '/api/download/*': api_download,
+    '/api/metrics': api_metrics,
+    '/api/brokers': api_brokers
     }
 
 @naw.route("/ping")
@@ -0,0 +1,231 @@
+import ujson as json
+from collections import OrderedDict
+
+class NodeCache:
+    """
+    Bounded LRU cache of tree nodes with write-back of dirty nodes.
+
+    Nodes are loaded through `load_func(key)` on a miss and written through
+    `store_func(node)` when a dirty node is evicted or on `sync()`. The cache
+    is bounded by node count, by the (estimated) serialized size of the
+    cached nodes, or both; a bound of None is not enforced. Leaves are evicted
+    before internal nodes and pinned keys, such as the root, are never evicted.
+    With `hold_dirty` set dirty nodes are not evicted either and stay in the
+    cache until `sync()`.
+    """
+    def __init__(self, load_func, store_func, max_nodes=64, max_bytes=None, size_func=None):
+        self.load_func = load_func
+        self.store_func = store_func
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+        self.size_func = size_func if size_func is not None else self._estimate_size
+        self.nodes = OrderedDict()
+        self.sizes = {}
+        self.dirty = set()
+        self.pinned = set()
+        self.hold_dirty = False
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.evictions = 0
+
+    def _estimate_size(self, node):
+        return len(json.dumps(node.keys))
+
+    def get(self, key):
+        node = self.nodes.pop(key, None)
+
+        if node is not None:
+            self.hits += 1
+            self.nodes[key] = node
+            return node
+
+        self.misses += 1
+        node = self.load_func(key)
+        self._add(key, node)
+        return node
+
+    def put(self, key, node, dirty=True):
+        if key in self.nodes:
+            del self.nodes[key]
+            self.bytes -= self.sizes.pop(key, 0)
+
+        # Marked dirty first so that an immediate eviction still writes it.
+        if dirty:
+            self.dirty.add(key)
+
+        self._add(key, node)
+
+    def _add(self, key, node):
+        self.nodes[key] = node
+
+        if self.max_bytes is not None:
+            size = self.size_func(node)
+            self.sizes[key] = size
+            self.bytes += size
+
+        self._evict()
+
+    def _victim(self):
+        # Least recently used leaf first: internal nodes are on every
+        # root-to-leaf path, so keeping them lets a lookup miss on the leaf only.
+        victim = None
+
+        for key in self.nodes:
+            if key not in self.pinned and not (self.hold_dirty and key in self.dirty):
+                if self.nodes[key].is_leaf:
+                    return key
+                if victim is None:
+                    victim = key
+
+        return victim
+
+    def _evict(self):
+        while (self.max_nodes is not None and len(self.nodes) > self.max_nodes) or \
+                (self.max_bytes is not None and self.bytes > self.max_bytes):
+            key = self._victim()
+
+            if key is None:
+                return # Everything left is pinned or held
+
+            self.flush(key)
+            del self.nodes[key]
+            self.bytes -= self.sizes.pop(key, 0)
+            self.evictions += 1
+
+    def flush(self, key):
+        """Writes a single node back if it is dirty."""
+        if key in self.dirty:
+            self.dirty.discard(key)
+            self.store_func(self.nodes[key])
+            self.flushes += 1
+
+    def sync(self):
+        """Writes every dirty node back to storage."""
+        for key in list(self.dirty):
+            self.flush(key)
+
+    def discard(self, key):
+        """Drops a node without writing it, used when the node is deleted."""
+        if key in self.nodes:
+            del self.nodes[key]
+            self.bytes -= self.sizes.pop(key, 0)
+        self.dirty.discard(key)
+        self.pinned.discard(key)
+
+    def pin(self, key):
+        self.pinned.add(key)
+
+    def unpin(self, key):
+        self.pinned.discard(key)
+
+    def clear(self):
+        self.nodes = OrderedDict()
+        self.sizes = {}
+        self.dirty = set()
+        self.pinned = set()
+        self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'nodes': len(self.nodes),
+            'bytes': self.bytes,
+            'dirty': len(self.dirty),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0,
+            'flushes': self.flushes,
+            'evictions': self.evictions
+        }
+
+class CachedNodeManager:
+    """
+    Puts a NodeCache in front of a btree_disk / bplus_tree NodeManager.
+
+    Exposes the same interface as the wrapped manager. Nodes handed out keep
+    a reference to this object, so `node.save()` and `node.get_child()` go
+    through the cache as well. The current root is pinned.
+    """
+    def __init__(self, manager, max_nodes=64, max_bytes=None):
+        self.manager = manager
+        self.directory = manager.directory
+        self.cache = NodeCache(self._load_node, manager.save_node, max_nodes, max_bytes)
+        self._pin_root(manager.get_root_id())
+
+    def _load_node(self, node_id):
+        node = self.manager.get_node(node_id)
+        node.manager = self
+        return node
+
+    def _pin_root(self, node_id):
+        self.cache.pinned.clear()
+
+        if node_id is not None:
+            self.cache.pin(node_id)
+
+    def get_node(self, node_id):
+        return self.cache.get(node_id)
+
+    def save_node(self, node):
+        self.cache.put(node.node_id, node)
+
+    def delete_node(self, node_id):
+        self.cache.discard(node_id)
+        self.manager.delete_node(node_id)
+
+    def get_new_node_id(self, save_meta=True):
+        return self.manager.get_new_node_id(save_meta)
+
+    def set_root_id(self, node_id):
+        self._pin_root(node_id)
+        self.manager.set_root_id(node_id)
+
+    def get_root_id(self):
+        return self.manager.get_root_id()
+
+    def set_first_leaf_id(self, node_id):
+        self.manager.set_first_leaf_id(node_id)
+
+    def get_first_leaf_id(self):
+        return self.manager.get_first_leaf_id()
+
+    def get_meta(self, name):
+        return self.manager.get_meta(name)
+
+    def set_meta(self, name, value, save_meta=True):
+        self.manager.set_meta(name, value, save_meta)
+
+    def delete_all(self):
+        self.cache.clear()
+        self.manager.delete_all()
+
+    def sync(self):
+        self.cache.sync()
+
+class CachedDiskStorage:
+    """
+    NodeCache in front of btree_hybrid_disk_cache.DiskStorage, keyed by the
+    node's disk file.
+    """
+    def __init__(self, storage, max_nodes=64, max_bytes=None):
+        self.storage = storage
+        self.directory = storage.directory
+        self.cache = NodeCache(storage.load_node, storage.save_node, max_nodes, max_bytes,
+                               self._node_size)
+
+    def _node_size(self, node):
+        return len(self.storage.codec.encode(node))
+
+    def load_node(self, disk_file):
+        return self.cache.get(disk_file)
+
+    def save_node(self, node):
+        self.cache.put(node.disk_file, node)
+
+    def clear(self):
+        self.cache.clear()
+
+    def sync(self):
+        self.cache.sync()
@@ -0,0 +1,86 @@
+# Binary search helpers for the sorted key lists inside B-tree nodes.
+#
+# MicroPython has no bisect module, so these follow CPython's bisect
+# semantics. The kv_ variants search lists of (key, value) entries, tuples
+# or lists, on the key only, without building a separate key list.
+
+def bisect_left(keys, key, lo=0, hi=None):
+    """Index of the first element >= key."""
+    if hi is None:
+        hi = len(keys)
+
+    while lo < hi:
+        mid = (lo + hi) >> 1
+
+        if keys[mid] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+
+    return lo
+
+def bisect_right(keys, key, lo=0, hi=None):
+    """Index of the first element > key."""
+    if hi is None:
+        hi = len(keys)
+
+    while lo < hi:
+        mid = (lo + hi) >> 1
+
+        if key < keys[mid]:
+            hi = mid
+        else:
+            lo = mid + 1
+
+    return lo
+
+def kv_bisect_left(items, key, lo=0, hi=None):
+    """Index of the first entry whose key is >= key."""
+    if hi is None:
+        hi = len(items)
+
+    while lo < hi:
+        mid = (lo + hi) >> 1
+
+        if items[mid][0] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+
+    return lo
+
+def kv_bisect_right(items, key, lo=0, hi=None):
+    """Index of the first entry whose key is > key."""
+    if hi is None:
+        hi = len(items)
+
+    while lo < hi:
+        mid = (lo + hi) >> 1
+
+        if key < items[mid][0]:
+            hi = mid
+        else:
+            lo = mid + 1
+
+    return lo
+
+def kv_find(items, key):
+    """Index of the entry with `key`, or -1 when there is none."""
+    i = kv_bisect_left(items, key)
+
+    if i < len(items) and items[i][0] == key:
+        return i
+
+    return -1
+
+def insort(keys, key):
+    """Inserts key after any equal keys and returns its index."""
+    i = bisect_right(keys, key)
+    keys.insert(i, key)
+    return i
+
+def kv_insort(items, item):
+    """Inserts a (key, value) entry after any equal keys and returns its index."""
+    i = kv_bisect_right(items, item[0])
+    items.insert(i, item)
+    return i
@@ -0,0 +1,56 @@
+import time
+from nanoweb import RouteTrie
+
+ROUTES = 60
+LOOKUPS = 2000
+
+def handler(request):
+    pass
+
+def build_routes():
+    routes = {}
+
+    for i in range(ROUTES // 3):
+        routes['/api/entity%d/' % i] = handler
+        routes['/api/entity%d/{id}/history' % i] = handler
+        routes['/static/set%d/*' % i] = handler
+
+    return routes
+
+def linear_match(routes, url):
+    # What handle_x did before the trie: a scan of every route
+    if url in routes:
+        return url, routes[url], {}
+
+    for route, handler in routes.items():
+        if route == url or url.startswith(route[:-1]):
+            return route, handler, {}
+
+    return None
+
+def bench(name, match, urls):
+    start = time.ticks_us()
+
+    for i in range(LOOKUPS):
+        match(urls[i % len(urls)])
+
+    elapsed_us = time.ticks_diff(time.ticks_us(), start)
+    print("%-8s %d routes  %d lookups: %7d us  (%.1f us/dispatch)" %
+          (name, ROUTES, LOOKUPS, elapsed_us, elapsed_us / LOOKUPS))
+
+routes = build_routes()
+trie = RouteTrie()
+
+for route, func in routes.items():
+    trie.add(route, func)
+
+last = ROUTES // 3 - 1
+urls = ['/api/entity%d' % last, '/api/entity%d/' % last, '/api/entity%d/42' % last,
+        '/api/entity%d/42/history' % last, '/static/set%d/app.js' % last, '/missing']
+
+# The bare url goes to its trailing-slash route, as it did in handle_x
+match = trie.match(urls[0], slash_wildcards=True)
+assert match is not None and match[0] == urls[1], match
+
+bench('linear', lambda url: linear_match(routes, url), urls)
+bench('trie', lambda url: trie.match(url, slash_wildcards=True), urls)
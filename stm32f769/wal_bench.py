@@ -0,0 +1,34 @@
+import time
+from btree_disk import BTree
+
+BURST = 300
+TREE_DEPTH = 10
+BENCH_DIR = '/wal_bench'
+
+def reading(i):
+    return {"id": str(1700000000000000000 + i), "meterId": i % 4, "reading": 1234.5 + i,
+            "readingOn": "2024-01-01T10:00:00", "version": 0}
+
+def bench(name, **kwargs):
+    tree = BTree(TREE_DEPTH, BENCH_DIR + '_' + name, 'bench.json', **kwargs)
+    tree.delete_all()
+
+    # A burst of AddMeterReading style inserts, then the write-back
+    start = time.ticks_ms()
+
+    for i in range(BURST):
+        value = reading(i)
+        tree.insert((value["id"], value))
+
+    insert_ms = time.ticks_diff(time.ticks_ms(), start)
+    start = time.ticks_ms()
+    tree.sync()
+    sync_ms = time.ticks_diff(time.ticks_ms(), start)
+
+    print("%-6s %d inserts: %6d ms  (%.0f/s)  sync: %5d ms  %s" %
+          (name, BURST, insert_ms, BURST * 1000 / max(1, insert_ms), sync_ms, tree.stats()))
+
+bench('plain')
+bench('cache', cache_size=32)
+bench('wal', wal=True)
+bench('wal64', wal=True, wal_group_size=64, checkpoint_nodes=128)
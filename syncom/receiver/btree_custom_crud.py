@@ -1,4 +1,5 @@
 import json as ujson
+from node_search import bisect_left, bisect_right
 
 class BTreeNode:
     def __init__(self, is_leaf=True):
@@ -28,25 +29,12 @@ class BTree:
         self.periodic_save()            
 
     def insert_non_full(self, x, key, value):
-        i = len(x.keys) - 1
+        i = bisect_right(x.keys, key)
 
         if x.is_leaf:
-            x.keys.append(None)
-            x.values.append(None)
-
-            while i >= 0 and key < x.keys[i]:
-                x.keys[i + 1] = x.keys[i]
-                x.values[i + 1] = x.values[i]
-                i -= 1
-
-            x.keys[i + 1] = key
-            x.values[i + 1] = value
+            x.keys.insert(i, key)
+            x.values.insert(i, value)
         else:
-            while i >= 0 and key < x.keys[i]:
-                i -= 1
-
-            i += 1
-
             if len(x.children[i].keys) == (2 * self.t) - 1:
                 self.split_child(x, i)
 
@@ -80,9 +68,7 @@ class BTree:
             self.periodic_save()
 
     def search_node(self, node, key):
-        i = 0
-        while i < len(node.keys) and key > node.keys[i]:
-            i += 1
+        i = bisect_left(node.keys, key)
 
         if i < len(node.keys) and key == node.keys[i]:
             return node, i
@@ -103,10 +89,7 @@ class BTree:
             self.root = root.children[0]
 
     def delete_recursive(self, x, key):
-        i = 0
-
-        while i < len(x.keys) and key > x.keys[i]:
-            i += 1
+        i = bisect_left(x.keys, key)
 
         if i < len(x.keys) and key == x.keys[i]:
             if x.is_leaf:
@@ -258,10 +241,7 @@ class BTree:
         if node is None:
             return 0
 
-        i = 0
-        
-        while i < len(node.keys) and key > node.keys[i]:
-            i += 1
+        i = bisect_left(node.keys, key)
 
         if i < len(node.keys) and key == node.keys[i]:
             count = 1